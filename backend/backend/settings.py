@@ -287,3 +287,76 @@ if not DEBUG:
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Recommender
+# Embeddings are persisted per model, so changing this re-encodes content lazily
+RECOMMENDER_EMBEDDING_MODEL = os.getenv('RECOMMENDER_EMBEDDING_MODEL', 'sentence-transformers/paraphrase-MiniLM-L12-v2')
+# Number of texts sent to the embedding model per forward pass
+RECOMMENDER_ENCODE_BATCH_SIZE = int(os.getenv('RECOMMENDER_ENCODE_BATCH_SIZE', 64))
+# Queued recommender jobs (see the run_recommender_jobs command): seconds between polls of an empty queue,
+# attempts before a failing job is left aside, and seconds after which a claim is considered abandoned
+RECOMMENDER_JOB_POLL_INTERVAL = float(os.getenv('RECOMMENDER_JOB_POLL_INTERVAL', 2))
+RECOMMENDER_JOB_MAX_ATTEMPTS = int(os.getenv('RECOMMENDER_JOB_MAX_ATTEMPTS', 3))
+RECOMMENDER_JOB_CLAIM_TIMEOUT = int(os.getenv('RECOMMENDER_JOB_CLAIM_TIMEOUT', 600))
+# Maximum number of items each content-based recommender scores into its result
+RECOMMENDER_TOP_K = int(os.getenv('RECOMMENDER_TOP_K', 100))
+# Seconds before the in-memory membership matrix is reloaded from the database
+RECOMMENDER_INTERACTIONS_MAX_AGE = int(os.getenv('RECOMMENDER_INTERACTIONS_MAX_AGE', 3600))
+# Approximate nearest-neighbour retrieval for posts and activities: clusters probed per query, and
+# matrix (or candidate window) size from which the index is used instead of an exact scan
+RECOMMENDER_ANN_PROBES = int(os.getenv('RECOMMENDER_ANN_PROBES', 8))
+RECOMMENDER_ANN_MIN_SIZE = int(os.getenv('RECOMMENDER_ANN_MIN_SIZE', 5000))
+# Load the embedding model when a web worker starts instead of on the first recommendation request
+RECOMMENDER_WARM_UP = os.getenv('RECOMMENDER_WARM_UP', 'False') == 'True'
+# Tell the other worker processes to drop stale embeddings and cached settings over PostgreSQL LISTEN/NOTIFY
+INVALIDATION_BUS_ENABLED = os.getenv('INVALIDATION_BUS_ENABLED', 'True') == 'True'
+INVALIDATION_CHANNEL = os.getenv('INVALIDATION_CHANNEL', 'ss_api_invalidation')
+# Seconds a user's ranked recommendation lists are kept in the cache
+RECOMMENDATION_CACHE_TTL = int(os.getenv('RECOMMENDATION_CACHE_TTL', 600))
+# Recommendations computed and kept per user and type; endpoints accept ?limit= up to this
+RECOMMENDATION_LIMIT = int(os.getenv('RECOMMENDATION_LIMIT', 50))
+# Popular items kept per type for users with nothing to base recommendations on, and their refresh interval
+RECOMMENDER_POPULAR_SIZE = int(os.getenv('RECOMMENDER_POPULAR_SIZE', 50))
+RECOMMENDER_POPULAR_TTL = int(os.getenv('RECOMMENDER_POPULAR_TTL', 900))
+# Search query embeddings kept in memory (LRU), and the most results semantic search returns per type
+RECOMMENDER_QUERY_CACHE_SIZE = int(os.getenv('RECOMMENDER_QUERY_CACHE_SIZE', 256))
+SEMANTIC_SEARCH_LIMIT = int(os.getenv('SEMANTIC_SEARCH_LIMIT', 20))
+# Embeddings kept per type in the in-process LRU cache; least recently used entries are evicted beyond that.
+# Only user embeddings are cached this way, catalogue embeddings live in the scoring matrices
+RECOMMENDER_EMBEDDING_CACHE_SIZES = {
+    'users': int(os.getenv('RECOMMENDER_USER_EMBEDDING_CACHE_SIZE', 10000)),
+}
+RECOMMENDER_EMBEDDING_CACHE_DEFAULT_SIZE = int(os.getenv('RECOMMENDER_EMBEDDING_CACHE_DEFAULT_SIZE', 1000))
+# Posts created, and activities ended, within this many days are kept in the in-process scoring matrices
+# (and so can be recommended, searched and related); older rows are evicted every RECOMMENDER_MATRIX_EVICT_INTERVAL seconds
+RECOMMENDER_MATRIX_WINDOW_DAYS = int(os.getenv('RECOMMENDER_MATRIX_WINDOW_DAYS', 365))
+RECOMMENDER_MATRIX_EVICT_INTERVAL = int(os.getenv('RECOMMENDER_MATRIX_EVICT_INTERVAL', 3600))
+# In-memory storage of recommender embeddings: float32, float16 or int8 (with a per-vector scale)
+RECOMMENDER_EMBEDDING_DTYPE = os.getenv('RECOMMENDER_EMBEDDING_DTYPE', 'float32')
+# Directory of the memory-mapped embedding snapshots written by the build_embedding_snapshot command
+RECOMMENDER_SNAPSHOT_DIR = os.getenv('RECOMMENDER_SNAPSHOT_DIR', str(BASE_DIR / 'embedding_snapshots'))
+# Share of the community recommender's user profile taken by recent visits and searches (the rest is interests)
+RECOMMENDER_PROFILE_ACTIVITY_WEIGHT = float(os.getenv('RECOMMENDER_PROFILE_ACTIVITY_WEIGHT', 0.5))
+# Weight the activity profile keeps on every new visit or search
+RECOMMENDER_PROFILE_DECAY = float(os.getenv('RECOMMENDER_PROFILE_DECAY', 0.8))
+# Visits and searches folded in when a user's activity profile is first built
+RECOMMENDER_PROFILE_HISTORY = int(os.getenv('RECOMMENDER_PROFILE_HISTORY', 10))
+# Seconds precomputed recommendation lists (see the precompute_recommendations command) are served for
+RECOMMENDER_PRECOMPUTED_MAX_AGE = int(os.getenv('RECOMMENDER_PRECOMPUTED_MAX_AGE', 86400))
+# Most similar communities kept per community in the co-membership neighbour table
+RECOMMENDER_COMMUNITY_NEIGHBORS = int(os.getenv('RECOMMENDER_COMMUNITY_NEIGHBORS', 20))
+# Most similar posts kept per post in the related-posts table
+RECOMMENDER_RELATED_POSTS = int(os.getenv('RECOMMENDER_RELATED_POSTS', 10))
+# Days after which a community visit or search counts half as much
+RECOMMENDER_ACTIVITY_HALF_LIFE_DAYS = float(os.getenv('RECOMMENDER_ACTIVITY_HALF_LIFE_DAYS', 14))
+# Searches kept per user in the recent-search history
+RECOMMENDER_RECENT_SEARCHES = int(os.getenv('RECOMMENDER_RECENT_SEARCHES', 20))
+# Only posts created within this many days are recommended
+RECOMMENDER_POST_WINDOW_DAYS = int(os.getenv('RECOMMENDER_POST_WINDOW_DAYS', 90))
+# Only activities that have not ended and start within this many days are recommended
+RECOMMENDER_ACTIVITY_WINDOW_DAYS = int(os.getenv('RECOMMENDER_ACTIVITY_WINDOW_DAYS', 60))
+# Days after which a post's (or an upcoming activity's) recency weight halves
+RECOMMENDER_RECENCY_HALF_LIFE_DAYS = float(os.getenv('RECOMMENDER_RECENCY_HALF_LIFE_DAYS', 14))
+# Share of a post or activity score that depends on recency, between 0 and 1
+RECOMMENDER_RECENCY_WEIGHT = float(os.getenv('RECOMMENDER_RECENCY_WEIGHT', 0.3))
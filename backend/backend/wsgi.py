@@ -14,3 +14,19 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_wsgi_application()
+
+# Opt-in: load the recommender model while the worker starts, not on its first request
+from django.conf import settings
+
+if settings.RECOMMENDER_WARM_UP:
+    from ss_api.recommender import warm_up
+
+    warm_up()
+
+# Apply the cache invalidations of the other workers, see ss_api.invalidation_bus
+from django.db import connection
+
+if settings.INVALIDATION_BUS_ENABLED and connection.vendor == "postgresql":
+    from ss_api.invalidation_bus import listener
+
+    listener.start()
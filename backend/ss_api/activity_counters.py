@@ -0,0 +1,115 @@
+from datetime import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Community, CommunityInteraction, SearchHistory
+
+# Communities per page of the community search, and so the most a search is counted for
+COMMUNITY_SEARCH_PAGE_SIZE = 10
+
+# UserActivity types of the community, people and semantic searches; only the first is counted for communities
+COMMUNITY_SEARCH = "search"
+SEARCH_ACTIVITY_TYPES = (COMMUNITY_SEARCH, "user_search", "semantic_search")
+
+
+def decay_factor(since, until):
+    """
+    Weight left to a count recorded at `since`, seen at `until`, with RECOMMENDER_ACTIVITY_HALF_LIFE_DAYS.
+    """
+    half_life = settings.RECOMMENDER_ACTIVITY_HALF_LIFE_DAYS * 86400
+    return 0.5 ** (max((until - since).total_seconds(), 0) / half_life)
+
+
+def record_community_signals(user_id, community_ids, signal, when=None):
+    """
+    Add one visit or search (signal) of each community to the user's decayed counters.
+    Rows are created on first use and updated under a row lock, so concurrent requests do not lose counts.
+    """
+    community_ids = set(community_ids)
+    if user_id is None or not community_ids:
+        return
+    when = when or timezone.now()
+
+    with transaction.atomic():
+        CommunityInteraction.objects.bulk_create(
+            [CommunityInteraction(user_id=user_id, community_id=community_id, updated_at=when)
+             for community_id in community_ids],
+            ignore_conflicts=True
+        )
+        interactions = list(CommunityInteraction.objects.select_for_update().filter(
+            user_id=user_id, community_id__in=community_ids
+        ))
+        for interaction in interactions:
+            decay = decay_factor(interaction.updated_at, when)
+            interaction.visit_score *= decay
+            interaction.search_score *= decay
+            interaction.updated_at = max(interaction.updated_at, when)
+            if signal == "visit":
+                interaction.visit_score += 1
+                interaction.visits += 1
+                interaction.last_visited_at = when
+            else:
+                interaction.search_score += 1
+                interaction.searches += 1
+        CommunityInteraction.objects.bulk_update(
+            interactions, ['visit_score', 'search_score', 'visits', 'searches', 'last_visited_at', 'updated_at']
+        )
+
+
+def record_visit(user_id, community_id):
+    record_community_signals(user_id, [community_id], "visit")
+
+
+def community_search(query):
+    """
+    Communities whose name contains the query, as listed by the community search.
+    """
+    return Community.objects.filter(name__icontains=query).order_by('id')
+
+
+def searched_communities(query):
+    """
+    Ids of the communities a community search is counted for: the first page of community_search(query),
+    whichever page was requested. rebuild_activity_counters applies the same rule to the logged community
+    searches, so rebuilt counters match the live ones.
+    """
+    return list(community_search(query).values_list('id', flat=True)[:COMMUNITY_SEARCH_PAGE_SIZE])
+
+
+def record_search(user_id, query, activity_type=COMMUNITY_SEARCH):
+    """
+    Push a search, of one of SEARCH_ACTIVITY_TYPES, onto the user's capped recent-search history. Community
+    searches are also counted for the communities they list (see searched_communities).
+    """
+    if user_id is None:
+        return
+    community_ids = searched_communities(query) if activity_type == COMMUNITY_SEARCH else []
+    when = timezone.now()
+    with transaction.atomic():
+        history, _ = SearchHistory.objects.select_for_update().get_or_create(user_id=user_id)
+        history.entries = [[query, when.isoformat()], *history.entries][:settings.RECOMMENDER_RECENT_SEARCHES]
+        history.save(update_fields=['entries', 'updated_at'])
+    record_community_signals(user_id, community_ids, "search", when)
+
+
+def community_signal_scores(user_id):
+    """
+    Return {community_id: (visit_score, search_score)} decayed to now, from one indexed query.
+    """
+    now = timezone.now()
+    return {
+        community_id: (visit_score * decay_factor(updated_at, now), search_score * decay_factor(updated_at, now))
+        for community_id, visit_score, search_score, updated_at in CommunityInteraction.objects.filter(
+            user_id=user_id
+        ).values_list('community_id', 'visit_score', 'search_score', 'updated_at')
+    }
+
+
+def recent_searches(user_id):
+    """
+    Return the user's recent searches as (query, datetime), most recent first.
+    """
+    entries = SearchHistory.objects.filter(user_id=user_id).values_list('entries', flat=True).first() or []
+    return [(query, datetime.fromisoformat(searched_at)) for query, searched_at in entries]
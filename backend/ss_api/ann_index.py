@@ -0,0 +1,122 @@
+import logging
+import threading
+
+import numpy as np
+
+from .embedding_matrix import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+
+def spherical_kmeans(vectors, n_clusters, iterations=10, seed=0):
+    """
+    Cluster L2-normalised vectors by cosine similarity and return the normalised centroids.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+
+        # Re-seed clusters that lost all their members
+        empty = np.flatnonzero(np.bincount(labels, minlength=n_clusters) == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = normalize_rows(sums)
+
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file (IVF-flat) approximate nearest-neighbour index over the rows of an EmbeddingMatrix.
+    Rows are clustered around k-means centroids; a query only scores the rows of the n_probe closest
+    clusters. Inserts and deletes are applied incrementally, and the centroids are retrained once the
+    matrix has doubled since the last training. Below min_train_size rows the index stays untrained
+    and searches fall back to the exact scan.
+    """
+
+    def __init__(self, n_probe=8, min_train_size=5000, max_training_sample=50000, chunk_size=8192):
+        self._lock = threading.RLock()
+        self.n_probe = n_probe
+        self.min_train_size = min_train_size
+        self.max_training_sample = max_training_sample
+        self.chunk_size = chunk_size
+        self.centroids = None
+        self.trained_size = 0
+        self._lists = []
+        self._assignments = {}
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def needs_training(self, size):
+        if size < self.min_train_size:
+            return False
+        return not self.is_trained or size >= 2 * self.trained_size
+
+    def _nearest_lists(self, vectors):
+        return np.concatenate([
+            np.argmax(vectors[start:start + self.chunk_size].astype(np.float32) @ self.centroids.T, axis=1)
+            for start in range(0, len(vectors), self.chunk_size)
+        ]) if len(vectors) else np.empty(0, dtype=np.int64)
+
+    def train(self, ids, vectors):
+        """
+        Fit the centroids on (a sample of) the given vectors and assign every row to a list.
+        Rows only need the right direction: float16 and unscaled int8 rows, or a memmap of them, work as is.
+        """
+        n_lists = int(np.clip(np.sqrt(len(ids)), 16, 4096))
+        rng = np.random.default_rng(0)
+        sample_size = min(len(ids), self.max_training_sample, 64 * n_lists)
+        sample = normalize_rows(vectors[np.sort(rng.choice(len(ids), sample_size, replace=False))])
+
+        with self._lock:
+            self.centroids = spherical_kmeans(sample, n_lists)
+            self._lists = [set() for _ in range(n_lists)]
+            self._assignments = {}
+            self.trained_size = len(ids)
+            self.add(ids, vectors)
+
+        logger.info(f"Trained IVF index with {n_lists} lists over {len(ids)} embeddings.")
+
+    def add(self, ids, vectors):
+        """
+        Assign new or replaced rows to their closest list. A no-op until the index is trained.
+        """
+        with self._lock:
+            if not self.is_trained:
+                return
+            for object_id, list_number in zip(np.asarray(ids).tolist(), self._nearest_lists(vectors).tolist()):
+                previous = self._assignments.get(object_id)
+                if previous is not None:
+                    self._lists[previous].discard(object_id)
+                self._lists[list_number].add(object_id)
+                self._assignments[object_id] = list_number
+
+    def discard(self, ids):
+        with self._lock:
+            for object_id in ids:
+                list_number = self._assignments.pop(object_id, None)
+                if list_number is not None:
+                    self._lists[list_number].discard(object_id)
+
+    def clear(self):
+        with self._lock:
+            self.centroids = None
+            self.trained_size = 0
+            self._lists = []
+            self._assignments = {}
+
+    def candidate_ids(self, query, n_probe=None):
+        """
+        Return the ids stored in the n_probe lists whose centroids are closest to the normalised query.
+        """
+        with self._lock:
+            n_probe = min(n_probe or self.n_probe, len(self._lists))
+            centroid_scores = self.centroids @ query
+            probes = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+            return [object_id for list_number in probes for object_id in self._lists[list_number]]
@@ -0,0 +1,384 @@
+import threading
+
+import numpy as np
+
+from .quantization import check_dtype, quantize_rows, dequantize_rows, score_rows
+from .embedding_snapshot import SNAPSHOT_HASH_LENGTH
+
+
+def normalize_rows(vectors):
+    """
+    L2-normalise a vector or each row of a matrix, leaving all-zero rows untouched.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def select_top_k(ids, scores, k=None, score_threshold=None):
+    """
+    Keep the k highest scores (all of them when k is None) at or above score_threshold,
+    returned best first. Uses argpartition so only the selected k are sorted.
+    """
+    if score_threshold is not None:
+        keep = scores >= score_threshold
+        ids, scores = ids[keep], scores[keep]
+
+    if k is not None and len(scores) > k:
+        top = np.argpartition(-scores, k - 1)[:k]
+        ids, scores = ids[top], scores[top]
+
+    order = np.argsort(-scores, kind='stable')
+    return np.asarray(ids)[order], scores[order]
+
+
+class EmbeddingMatrix:
+    """
+    Contiguous matrix of L2-normalised float32 embeddings for one entity type, plus the matching id array.
+    Rows are inserted, replaced and removed in place, so scoring a user against every item is a single
+    matrix-vector product instead of a per-request rebuild of Python lists.
+    An optional approximate nearest-neighbour index (see ann_index.IVFIndex) is kept in step with the rows
+    and used by search().
+    Rows can be stored as float16, or int8 with a per-row scale, to cut memory 2-4x; they are then scored
+    chunk by chunk, chunk_size rows at a time, so no float32 copy of the whole matrix is ever made.
+    A read-only EmbeddingSnapshot shared between processes can be attached as the base of the matrix;
+    the in-process rows are then only a delta of new and changed objects, and snapshot rows that were
+    replaced or removed are masked out.
+    Each row keeps a prefix of the hash of the text it was computed from, see hash_matches(). Storage
+    shrinks again when most rows are removed.
+    """
+
+    def __init__(self, initial_capacity=1024, index=None, dtype="float32", chunk_size=1024):
+        self._lock = threading.RLock()
+        self._initial_capacity = initial_capacity
+        self.dtype = check_dtype(dtype)
+        self.chunk_size = chunk_size
+        self._vectors = None
+        self._scales = None
+        self._ids = np.empty(0, dtype=np.int64)
+        self._hashes = np.empty(0, dtype=f"S{SNAPSHOT_HASH_LENGTH}")
+        self._positions = {}
+        self._size = 0
+        self.index = index
+        self.snapshot = None
+        self._snapshot_alive = None
+        self._snapshot_size = 0
+        # Highest object id embedded by a full sync, and ids whose rows were invalidated since
+        self.synced_up_to = 0
+        self.pending_ids = set()
+
+    def __len__(self):
+        return self._snapshot_size + self._size
+
+    def __contains__(self, object_id):
+        return object_id in self._positions or self._snapshot_row(object_id) is not None
+
+    def _snapshot_row(self, object_id):
+        if self.snapshot is None:
+            return None
+        row = self.snapshot.row_of(object_id)
+        return row if row is not None and self._snapshot_alive[row] else None
+
+    def _delta_vectors(self):
+        if self._vectors is None:
+            return np.empty((0, 0), dtype=np.float32), None
+        scales = self._scales[:self._size] if self._scales is not None else None
+        return self._vectors[:self._size], scales
+
+    @property
+    def ids(self):
+        with self._lock:
+            return self._current_ids()
+
+    @property
+    def vectors(self):
+        """
+        The rows as float32, aligned with ids; a dequantised copy when a compact dtype or a snapshot is used.
+        Use rows() to read both while other threads may change the matrix.
+        """
+        with self._lock:
+            return self._current_vectors()
+
+    def rows(self):
+        """
+        The ids and float32 rows, read together so they stay aligned while other threads change the matrix.
+        The arrays are copies.
+        """
+        with self._lock:
+            return self._current_ids().copy(), self._current_vectors().copy()
+
+    def _current_ids(self):
+        delta_ids = self._ids[:self._size]
+        if self.snapshot is None:
+            return delta_ids
+        return np.concatenate([self.snapshot.ids[self._snapshot_alive], delta_ids])
+
+    def _current_vectors(self):
+        codes, scales = self._delta_vectors()
+        if self.snapshot is None and self.dtype == "float32":
+            return codes
+        vectors = dequantize_rows(codes, scales)
+        if self.snapshot is None:
+            return vectors
+        snapshot_vectors = self.snapshot.vectors_of(np.flatnonzero(self._snapshot_alive))
+        return np.vstack([snapshot_vectors, vectors]) if len(vectors) else snapshot_vectors
+
+    def missing(self, object_ids):
+        """
+        Return the ids that have no row yet.
+        """
+        return [object_id for object_id in object_ids if object_id not in self]
+
+    def vector_of(self, object_id):
+        """
+        The row of an id as float32, or None when it has none.
+        """
+        with self._lock:
+            position = self._positions.get(object_id)
+            if position is not None:
+                codes, scales = self._delta_vectors()
+                return dequantize_rows(codes[position], scales[position] if scales is not None else None)
+            row = self._snapshot_row(object_id)
+            return self.snapshot.vectors_of([row])[0] if row is not None else None
+
+    def hash_matches(self, object_id, text_hash):
+        """
+        Whether the row of an id was computed from a text with this content hash.
+        """
+        with self._lock:
+            position = self._positions.get(object_id)
+            if position is not None:
+                return self._hashes[position] == text_hash[:SNAPSHOT_HASH_LENGTH].encode("ascii")
+            row = self._snapshot_row(object_id)
+            return row is not None and self.snapshot.hash_matches(row, text_hash)
+
+    def _allocate(self, capacity, dimension):
+        """
+        Move the rows into new arrays of the given capacity.
+        """
+        vectors = np.zeros((capacity, dimension), dtype=self.dtype)
+        ids = np.zeros(capacity, dtype=np.int64)
+        hashes = np.zeros(capacity, dtype=self._hashes.dtype)
+        scales = np.zeros(capacity, dtype=np.float32) if self.dtype == "int8" else None
+        if self._vectors is not None:
+            vectors[:self._size] = self._vectors[:self._size]
+            ids[:self._size] = self._ids[:self._size]
+            hashes[:self._size] = self._hashes[:self._size]
+            if scales is not None:
+                scales[:self._size] = self._scales[:self._size]
+        self._vectors, self._ids, self._hashes, self._scales = vectors, ids, hashes, scales
+
+    def _reserve(self, size, dimension):
+        if self._vectors is None:
+            self._allocate(max(self._initial_capacity, size), dimension)
+        elif size > len(self._vectors):
+            self._allocate(max(size, 2 * len(self._vectors)), self._vectors.shape[1])
+
+    def _mask_snapshot_rows(self, object_ids):
+        """
+        Hide the snapshot rows of objects that were replaced or removed in this process.
+        """
+        if self.snapshot is None:
+            return
+        rows = self.snapshot.rows_of(object_ids)
+        rows = rows[self._snapshot_alive[rows]]
+        self._snapshot_alive[rows] = False
+        self._snapshot_size -= len(rows)
+
+    def attach_snapshot(self, snapshot):
+        """
+        Use a snapshot as the base rows. In-process rows and pending ids take precedence over it,
+        and objects newer than the snapshot are left to the next sync.
+        """
+        with self._lock:
+            self.snapshot = snapshot
+            self._snapshot_alive = np.ones(len(snapshot), dtype=bool)
+            self._snapshot_size = len(snapshot)
+            self._mask_snapshot_rows(list(self._positions) + list(self.pending_ids))
+            self.synced_up_to = max(self.synced_up_to, snapshot.synced_up_to)
+            if self.index is not None:
+                # Retrained over the snapshot rows by the next search
+                self.index.clear()
+
+    def upsert(self, object_ids, embeddings, text_hashes=None):
+        """
+        Insert or replace the rows of the given ids, computed from texts with the given content hashes.
+        """
+        if not len(object_ids):
+            return
+        vectors = normalize_rows(np.vstack(embeddings))
+        codes, scales = quantize_rows(vectors, self.dtype)
+
+        with self._lock:
+            self._reserve(self._size + len(object_ids), vectors.shape[1])
+            for row, object_id in enumerate(object_ids):
+                position = self._positions.get(object_id)
+                if position is None:
+                    position = self._size
+                    self._positions[object_id] = position
+                    self._ids[position] = object_id
+                    self._size += 1
+                self._vectors[position] = codes[row]
+                self._hashes[position] = text_hashes[row][:SNAPSHOT_HASH_LENGTH] if text_hashes else b""
+                if scales is not None:
+                    self._scales[position] = scales[row]
+            self._mask_snapshot_rows(object_ids)
+
+            if self.index is not None:
+                self.index.add(object_ids, vectors)
+            self.pending_ids.difference_update(object_ids)
+
+    def remove(self, object_ids):
+        """
+        Drop the rows of the given ids by moving the last row into each freed slot.
+        """
+        with self._lock:
+            for object_id in object_ids:
+                position = self._positions.pop(object_id, None)
+                if position is None:
+                    continue
+                last = self._size - 1
+                if position != last:
+                    self._vectors[position] = self._vectors[last]
+                    self._ids[position] = self._ids[last]
+                    self._hashes[position] = self._hashes[last]
+                    if self._scales is not None:
+                        self._scales[position] = self._scales[last]
+                    self._positions[int(self._ids[position])] = position
+                self._size = last
+            self._mask_snapshot_rows(object_ids)
+
+            capacity = len(self._vectors) if self._vectors is not None else 0
+            if capacity > self._initial_capacity and capacity >= 4 * self._size:
+                # Mostly empty, e.g. after old rows were evicted: give the memory back
+                self._allocate(max(self._initial_capacity, 2 * self._size), self._vectors.shape[1])
+
+            if self.index is not None:
+                self.index.discard(object_ids)
+
+    def invalidate(self, object_ids):
+        """
+        Drop the rows of changed objects and remember them so the next sync re-embeds them.
+        """
+        with self._lock:
+            self.remove(object_ids)
+            self.pending_ids.update(object_ids)
+
+    def clear(self):
+        """
+        Drop every row, including the attached snapshot.
+        """
+        with self._lock:
+            self._positions.clear()
+            self._size = 0
+            self._vectors = None
+            self._scales = None
+            self._ids = np.empty(0, dtype=np.int64)
+            self._hashes = np.empty(0, dtype=self._hashes.dtype)
+            self.snapshot = None
+            self._snapshot_alive = None
+            self._snapshot_size = 0
+            self.synced_up_to = 0
+            self.pending_ids.clear()
+            if self.index is not None:
+                self.index.clear()
+
+    def stats(self):
+        """
+        Row counts and the bytes held by the in-process rows (the snapshot is a shared memory map).
+        """
+        with self._lock:
+            arrays = [self._vectors, self._scales, self._ids, self._hashes]
+            return {
+                "rows": len(self),
+                "snapshot_rows": self._snapshot_size,
+                "delta_rows": self._size,
+                "capacity": len(self._vectors) if self._vectors is not None else 0,
+                "pending": len(self.pending_ids),
+                "nbytes": sum(array.nbytes for array in arrays if array is not None),
+            }
+
+    def _delta_candidates(self, query, candidate_ids):
+        codes, scales = self._delta_vectors()
+        if candidate_ids is None:
+            return self._ids[:self._size].copy(), score_rows(codes, scales, query, chunk_size=self.chunk_size)
+
+        rows = np.fromiter(
+            (self._positions[object_id] for object_id in candidate_ids if object_id in self._positions),
+            dtype=np.int64
+        )
+        if len(rows) < self._size // 4:
+            # Few candidates: gather their rows instead of scoring the whole matrix
+            scores = score_rows(codes, scales, query, rows, self.chunk_size)
+        else:
+            scores = score_rows(codes, scales, query, chunk_size=self.chunk_size)[rows]
+        return self._ids[rows], scores
+
+    def _snapshot_candidates(self, query, candidate_ids):
+        if candidate_ids is None:
+            scores = self.snapshot.scores(query, chunk_size=self.chunk_size)
+            if self._snapshot_size == len(self.snapshot):
+                return self.snapshot.ids, scores
+            return self.snapshot.ids[self._snapshot_alive], scores[self._snapshot_alive]
+
+        rows = self.snapshot.rows_of(candidate_ids)
+        rows = rows[self._snapshot_alive[rows]]
+        if len(rows) < len(self.snapshot) // 4:
+            scores = self.snapshot.scores(query, rows, self.chunk_size)
+        else:
+            scores = self.snapshot.scores(query, chunk_size=self.chunk_size)[rows]
+        return self.snapshot.ids[rows], scores
+
+    def top_k(self, query, k=None, candidate_ids=None, score_threshold=None):
+        """
+        Score the query against every row with one matrix-vector product and return the ids and
+        cosine similarities of the best k, best first. candidate_ids restricts the result to those ids.
+        """
+        query = normalize_rows(query)
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        with self._lock:
+            delta = self._delta_candidates(query, candidate_ids) if self._size else empty
+            if self.snapshot is None or not self._snapshot_size:
+                return select_top_k(*delta, k, score_threshold)
+            base = select_top_k(*self._snapshot_candidates(query, candidate_ids), k, score_threshold)
+
+        return select_top_k(
+            np.concatenate([base[0], delta[0]]), np.concatenate([base[1], delta[1]]), k, score_threshold
+        )
+
+    def _train_index(self):
+        # Rows are only compared by direction, so compact rows are used as they are, without rescaling
+        codes, _ = self._delta_vectors()
+        delta_ids = self._ids[:self._size].copy()
+        if self.snapshot is None or not len(self.snapshot):
+            self.index.train(delta_ids, codes)
+            return
+
+        # Train on the (usually much larger) snapshot straight from the memmap, then add the delta
+        self.index.train(self.snapshot.ids, self.snapshot.vectors)
+        self.index.discard(self.snapshot.ids[~self._snapshot_alive].tolist())
+        if self._size:
+            self.index.add(delta_ids, codes)
+
+    def search(self, query, k, score_threshold=None, candidate_ids=None):
+        """
+        Like top_k, but only scores the rows of the closest index lists once the attached index is trained.
+        The returned similarities are exact for the rows that were scored. candidate_ids restricts the
+        search to those ids; sets smaller than the index's min_train_size are scanned exactly instead.
+        """
+        if self.index is None or (candidate_ids is not None and len(candidate_ids) < self.index.min_train_size):
+            return self.top_k(query, k, candidate_ids, score_threshold)
+
+        with self._lock:
+            if self.index.needs_training(len(self)):
+                self._train_index()
+            if not self.index.is_trained:
+                return self.top_k(query, k, candidate_ids, score_threshold)
+            probed_ids = self.index.candidate_ids(normalize_rows(query))
+
+        if candidate_ids is not None:
+            candidate_ids = set(candidate_ids)
+            probed_ids = [object_id for object_id in probed_ids if object_id in candidate_ids]
+        return self.top_k(query, k, probed_ids, score_threshold)
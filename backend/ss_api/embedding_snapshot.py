@@ -0,0 +1,185 @@
+import json
+import logging
+import os
+import shutil
+import time
+
+import numpy as np
+
+from .quantization import check_dtype, quantize_rows, dequantize_rows, score_rows
+
+logger = logging.getLogger(__name__)
+
+# Leading hex digits of the content hash kept per row, enough to tell whether a text changed
+SNAPSHOT_HASH_LENGTH = 16
+
+
+def pointer_path(directory, cache_type):
+    return os.path.join(directory, f"{cache_type}.current")
+
+
+class EmbeddingSnapshot:
+    """
+    Read-only embeddings of one entity type, as written by the build_embedding_snapshot command.
+    A snapshot directory holds one contiguous file of normalised rows (vectors.bin), the sorted object
+    ids of those rows (ids.npy), the content hash prefix of every row (hashes.npy), the per-row scales
+    of int8 rows (scales.npy) and meta.json. Everything is opened with numpy memmaps, so all the
+    workers of a host share the same pages through the OS page cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as file:
+            self.meta = json.load(file)
+        count, dimension = self.meta["count"], self.meta["dimension"]
+
+        self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode='r')
+        self.hashes = np.load(os.path.join(path, "hashes.npy"), mmap_mode='r')
+        self.vectors = np.memmap(
+            os.path.join(path, "vectors.bin"), dtype=self.meta["dtype"], mode='r', shape=(count, dimension)
+        )
+        scales_path = os.path.join(path, "scales.npy")
+        self.scales = np.load(scales_path, mmap_mode='r') if os.path.exists(scales_path) else None
+
+    @classmethod
+    def open_current(cls, directory, cache_type):
+        """
+        Open the latest snapshot of an entity type, or return None when none was built.
+        """
+        try:
+            with open(pointer_path(directory, cache_type)) as file:
+                name = file.read().strip()
+        except FileNotFoundError:
+            return None
+        return cls(os.path.join(directory, name))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def model_name(self):
+        return self.meta["model_name"]
+
+    @property
+    def synced_up_to(self):
+        return self.meta["synced_up_to"]
+
+    def rows_of(self, object_ids):
+        """
+        Return the row positions of the given ids; ids missing from the snapshot are skipped.
+        """
+        object_ids = np.fromiter(object_ids, dtype=np.int64)
+        if not len(self.ids) or not len(object_ids):
+            return np.empty(0, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.ids, object_ids), len(self.ids) - 1)
+        return rows[self.ids[rows] == object_ids]
+
+    def row_of(self, object_id):
+        rows = self.rows_of([object_id])
+        return int(rows[0]) if len(rows) else None
+
+    def hash_matches(self, row, text_hash):
+        return self.hashes[row] == text_hash[:SNAPSHOT_HASH_LENGTH].encode("ascii")
+
+    def vectors_of(self, rows):
+        """
+        Return the given rows as float32.
+        """
+        return dequantize_rows(self.vectors[rows], self.scales[rows] if self.scales is not None else None)
+
+    def scores(self, query, rows=None, chunk_size=1024):
+        return score_rows(self.vectors, self.scales, query, rows, chunk_size)
+
+
+class SnapshotWriter:
+    """
+    Write a new snapshot chunk by chunk into a fresh directory, then publish it by atomically
+    replacing the pointer file. Workers still mapping an older snapshot keep reading it safely.
+    """
+
+    def __init__(self, directory, cache_type, capacity, dtype="float32"):
+        self.directory = directory
+        self.cache_type = cache_type
+        self.capacity = capacity
+        self.dtype = check_dtype(dtype)
+        # Nanosecond timestamps keep the names unique and sorted by age
+        self.name = f"{cache_type}-{time.time_ns()}"
+        # Objects whose embedding is stored again after this may have been read before the change
+        self.started_at = time.time()
+        self.path = os.path.join(directory, self.name)
+        os.makedirs(self.path)
+
+        self.count = 0
+        self._vectors = None
+        self._ids = []
+        self._hashes = []
+        self._scales = []
+
+    def append(self, object_ids, vectors, text_hashes):
+        """
+        Add normalised float32 rows, in increasing object id order.
+        """
+        if not len(object_ids):
+            return
+        codes, scales = quantize_rows(vectors, self.dtype)
+        if self._vectors is None:
+            self._vectors = np.memmap(
+                os.path.join(self.path, "vectors.bin"), dtype=self.dtype, mode='w+',
+                shape=(max(self.capacity, len(object_ids)), codes.shape[1])
+            )
+        self._vectors[self.count:self.count + len(codes)] = codes
+        self.count += len(codes)
+
+        self._ids.extend(object_ids)
+        self._hashes.extend(text_hash[:SNAPSHOT_HASH_LENGTH] for text_hash in text_hashes)
+        if scales is not None:
+            self._scales.append(scales)
+
+    def commit(self, model_name, synced_up_to):
+        """
+        Finish the files, publish the snapshot and return its path.
+        """
+        if self._vectors is None:
+            shutil.rmtree(self.path)
+            return None
+
+        dimension = self._vectors.shape[1]
+        self._vectors.flush()
+        del self._vectors
+        # Rows for objects without text were never written
+        os.truncate(os.path.join(self.path, "vectors.bin"), self.count * dimension * np.dtype(self.dtype).itemsize)
+
+        np.save(os.path.join(self.path, "ids.npy"), np.array(self._ids, dtype=np.int64))
+        np.save(os.path.join(self.path, "hashes.npy"), np.array(self._hashes, dtype=f"S{SNAPSHOT_HASH_LENGTH}"))
+        if self._scales:
+            np.save(os.path.join(self.path, "scales.npy"), np.concatenate(self._scales))
+        with open(os.path.join(self.path, "meta.json"), "w") as file:
+            json.dump({
+                "cache_type": self.cache_type,
+                "model_name": model_name,
+                "dtype": self.dtype,
+                "dimension": dimension,
+                "count": self.count,
+                "synced_up_to": synced_up_to,
+                "started_at": self.started_at,
+                "built_at": time.time(),
+            }, file)
+
+        temporary_pointer = f"{pointer_path(self.directory, self.cache_type)}.{os.getpid()}"
+        with open(temporary_pointer, "w") as file:
+            file.write(self.name)
+        os.replace(temporary_pointer, pointer_path(self.directory, self.cache_type))
+        return self.path
+
+
+def prune_snapshots(directory, cache_type, keep=2):
+    """
+    Delete all but the newest `keep` snapshot directories of an entity type. The current one is always kept.
+    """
+    names = sorted(
+        name for name in os.listdir(directory)
+        if name.startswith(f"{cache_type}-") and os.path.isdir(os.path.join(directory, name))
+    )
+    for name in names[:-max(keep, 1)]:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+        logger.info(f"Deleted embedding snapshot {name}")
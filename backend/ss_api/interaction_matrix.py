@@ -0,0 +1,138 @@
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+
+
+class InteractionMatrix:
+    """
+    Sparse user x item interaction matrix (memberships, for communities).
+    It is loaded in bulk from (user_id, item_id) pairs and then updated one cell at a time;
+    pending cell updates are folded into the CSR matrix the next time it is read.
+    """
+
+    def __init__(self, max_age=None):
+        self._lock = threading.RLock()
+        self.max_age = max_age
+        self.loaded_at = None
+        self._reset()
+
+    def _reset(self):
+        self._row_index = {}
+        self._item_ids = []
+        self._item_index = {}
+        self._matrix = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self._pending = {}
+
+    @property
+    def is_stale(self):
+        """
+        True when the matrix was never loaded or is older than max_age seconds.
+        """
+        if self.loaded_at is None:
+            return True
+        return self.max_age is not None and time.monotonic() - self.loaded_at > self.max_age
+
+    def _row(self, user_id):
+        if user_id not in self._row_index:
+            self._row_index[user_id] = len(self._row_index)
+        return self._row_index[user_id]
+
+    def _column(self, item_id):
+        if item_id not in self._item_index:
+            self._item_index[item_id] = len(self._item_ids)
+            self._item_ids.append(item_id)
+        return self._item_index[item_id]
+
+    def load(self, pairs):
+        """
+        Rebuild the matrix from an iterable of (user_id, item_id) pairs.
+        """
+        with self._lock:
+            self._reset()
+            rows = []
+            columns = []
+            for user_id, item_id in pairs:
+                rows.append(self._row(user_id))
+                columns.append(self._column(item_id))
+
+            matrix = sparse.coo_matrix(
+                (np.ones(len(rows), dtype=np.float32), (rows, columns)),
+                shape=(len(self._row_index), len(self._item_ids))
+            ).tocsr()
+            matrix.sum_duplicates()
+            matrix.data[:] = 1
+            self._matrix = matrix
+            self.loaded_at = time.monotonic()
+
+    def clear(self):
+        """
+        Drop every interaction; the matrix is stale until the next load().
+        """
+        with self._lock:
+            self._reset()
+            self.loaded_at = None
+
+    def set(self, user_id, item_id, value=1):
+        """
+        Record a single interaction (value=1) or its removal (value=0).
+        """
+        with self._lock:
+            self._pending[(self._row(user_id), self._column(item_id))] = value
+
+    def reload_items(self, item_ids, pairs):
+        """
+        Replace the interactions of the given items with the (user_id, item_id) pairs read back for them,
+        e.g. to catch up with changes made by another process.
+        """
+        with self._lock:
+            self._flush()
+            matrix = self._matrix.tocsc()
+            for item_id in item_ids:
+                column = self._item_index.get(item_id)
+                if column is None:
+                    continue
+                for row in matrix.indices[matrix.indptr[column]:matrix.indptr[column + 1]]:
+                    self._pending[(int(row), column)] = 0
+            for user_id, item_id in pairs:
+                self._pending[(self._row(user_id), self._column(item_id))] = 1
+
+    def _flush(self):
+        shape = (len(self._row_index), len(self._item_ids))
+        if self._matrix.shape != shape:
+            # Grow into a new matrix sharing the old buffers, readers may still hold the previous one
+            matrix = self._matrix
+            extra_rows = np.full(shape[0] - matrix.shape[0], matrix.indptr[-1], dtype=matrix.indptr.dtype)
+            self._matrix = sparse.csr_matrix(
+                (matrix.data, matrix.indices, np.concatenate([matrix.indptr, extra_rows])), shape=shape
+            )
+        if not self._pending:
+            return
+
+        rows, columns = (list(index) for index in zip(*self._pending))
+        values = np.fromiter(self._pending.values(), dtype=np.float32, count=len(self._pending))
+        current = np.asarray(self._matrix[rows, columns]).ravel()
+        delta = sparse.coo_matrix((values - current, (rows, columns)), shape=shape)
+
+        matrix = (self._matrix + delta).tocsr()
+        matrix.eliminate_zeros()
+        self._matrix = matrix
+        self._pending.clear()
+
+    @property
+    def matrix(self):
+        with self._lock:
+            self._flush()
+            return self._matrix
+
+    @property
+    def item_ids(self):
+        with self._lock:
+            return np.array(self._item_ids, dtype=np.int64)
+
+    def row_of(self, user_id):
+        return self._row_index.get(user_id)
+
+    def column_of(self, item_id):
+        return self._item_index.get(item_id)
@@ -0,0 +1,141 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections
+
+logger = logging.getLogger(__name__)
+
+# Handlers by message kind, see register()
+_handlers = {}
+_reset_handlers = []
+
+
+def register(kind):
+    """
+    Decorator registering the function applying messages of a kind; it is called with the message's arguments.
+    """
+    def decorator(handler):
+        _handlers[kind] = handler
+        return handler
+    return decorator
+
+
+def register_reset(handler):
+    """
+    Register a function dropping everything a kind of handler may have missed, called when the listener
+    reconnects after losing its connection, since notifications sent meanwhile are lost.
+    """
+    _reset_handlers.append(handler)
+    return handler
+
+
+def notify(kind, *args):
+    """
+    Tell every other process to apply an invalidation; the caller applies it to its own state itself.
+    Sent with pg_notify on the current connection, so it is delivered when the surrounding transaction
+    commits and dropped if it rolls back. Does nothing unless the database is PostgreSQL and the bus is
+    enabled (INVALIDATION_BUS_ENABLED).
+    """
+    if not settings.INVALIDATION_BUS_ENABLED or connection.vendor != "postgresql":
+        return
+    payload = json.dumps({"origin": listener.origin, "kind": kind, "args": args})
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, %s)", [settings.INVALIDATION_CHANNEL, payload])
+
+
+def dispatch(payload, origin=None):
+    """
+    Apply a received message, unless it was sent by this process (origin).
+    """
+    message = json.loads(payload)
+    if message["origin"] == origin:
+        return
+    handler = _handlers.get(message["kind"])
+    if handler is None:
+        logger.warning(f"Ignoring invalidation message of unknown kind {message['kind']}")
+        return
+    handler(*message["args"])
+
+
+@register("cache")
+def delete_cache_keys(keys):
+    # The default cache is per process (LocMem), so every worker holds its own copy of these keys
+    cache.delete_many(keys)
+
+
+class InvalidationListener:
+    """
+    Daemon thread LISTENing on the invalidation channel over a dedicated PostgreSQL connection and applying
+    the messages of other processes as they arrive. After a lost connection it reconnects, and runs the
+    reset handlers, as notifications sent in between were missed. Started once per process, and again in
+    forked children (e.g. gunicorn --preload workers), whose copy of the thread would not be running.
+    """
+
+    def __init__(self, channel, poll_timeout=5, reconnect_delay=1):
+        self.channel = channel
+        self.poll_timeout = poll_timeout
+        self.reconnect_delay = reconnect_delay
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.origin = uuid.uuid4().hex
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self.origin = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        if self._thread is not None:
+            self._thread = None
+            self.start()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="invalidation-listener", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        connected_before = False
+        while True:
+            try:
+                self._listen(reset=connected_before)
+            except Exception:
+                logger.exception("Invalidation listener lost its connection, reconnecting")
+            connected_before = True
+            time.sleep(self.reconnect_delay)
+
+    def _listen(self, reset):
+        database = connections['default']
+        listen_connection = database.Database.connect(**database.get_connection_params())
+        try:
+            listen_connection.autocommit = True
+            with listen_connection.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+            if reset:
+                for handler in _reset_handlers:
+                    handler()
+
+            while True:
+                if select.select([listen_connection], [], [], self.poll_timeout) == ([], [], []):
+                    continue
+                listen_connection.poll()
+                while listen_connection.notifies:
+                    notification = listen_connection.notifies.pop(0)
+                    try:
+                        dispatch(notification.payload, self.origin)
+                    except Exception:
+                        logger.exception(f"Could not apply invalidation message {notification.payload}")
+        finally:
+            listen_connection.close()
+
+
+listener = InvalidationListener(settings.INVALIDATION_CHANNEL)
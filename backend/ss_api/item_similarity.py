@@ -0,0 +1,51 @@
+import numpy as np
+
+from .embedding_matrix import select_top_k
+
+
+def cosine_neighbors(matrix, columns=None, size=20, chunk_size=256):
+    """
+    Item-item cosine similarity of a binary user x item matrix: co-occurrences / sqrt(degree_i * degree_j).
+    Yields (column, neighbor_columns, scores) with the best `size` other items of each of the given
+    columns (all of them when None), best first. Co-occurrences are computed chunk_size columns at a
+    time with one sparse product, so the dense item x item matrix is never built.
+    """
+    matrix = matrix.tocsc()
+    degrees = np.asarray(matrix.sum(axis=0)).ravel()
+    columns = np.arange(matrix.shape[1]) if columns is None else np.asarray(columns, dtype=np.int64)
+
+    for start in range(0, len(columns), chunk_size):
+        chunk = columns[start:start + chunk_size]
+        co_occurrences = (matrix[:, chunk].T @ matrix).tocsr()
+        for row, column in enumerate(chunk.tolist()):
+            begin, end = co_occurrences.indptr[row], co_occurrences.indptr[row + 1]
+            neighbor_columns = co_occurrences.indices[begin:end]
+            counts = co_occurrences.data[begin:end]
+            keep = (neighbor_columns != column) & (counts > 0)
+            neighbor_columns, counts = neighbor_columns[keep], counts[keep]
+            scores = counts / np.sqrt(degrees[column] * degrees[neighbor_columns])
+            yield (column, *select_top_k(neighbor_columns, scores, size))
+
+
+def co_occurring_columns(matrix, column):
+    """
+    Columns of the items sharing at least one user with the given item, the item itself included.
+    """
+    matrix = matrix.tocsr()
+    users = matrix[:, column].nonzero()[0]
+    return np.unique(np.append(matrix[users].indices, column))
+
+
+def embedding_neighbors(ids, vectors, size=10, chunk_size=256):
+    """
+    Nearest neighbours of every row of a matrix of L2-normalised embeddings, by cosine similarity.
+    Yields (id, neighbor_ids, scores) with the best `size` other rows of each, best first; similarities
+    are computed chunk_size rows at a time, so the dense row x row matrix is never built.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    for start in range(0, len(ids), chunk_size):
+        similarities = vectors[start:start + chunk_size] @ vectors.T
+        for row, object_id in enumerate(ids[start:start + chunk_size].tolist()):
+            scores = similarities[row]
+            keep = ids != object_id
+            yield (object_id, *select_top_k(ids[keep], scores[keep], size))
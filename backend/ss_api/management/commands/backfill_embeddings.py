@@ -0,0 +1,139 @@
+import json
+import multiprocessing
+import os
+import re
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Max, Min
+
+from ... import recommender
+
+
+def init_worker(model_name):
+    """
+    Pool initializer: drop the inherited database connections and load the model to embed with,
+    once per worker.
+    """
+    connections.close_all()
+    if model_name != recommender.EMBEDDING_MODEL_NAME:
+        # Loaded by name on first use; stored rows are keyed by this name
+        recommender.set_model(None, model_name=model_name)
+    recommender.warm_up()
+
+
+def embed_chunk(task):
+    """
+    Embed the objects of one primary key range into the store. Rows already stored for the same
+    model and content are reused unless force is set. Returns the task and the number of objects.
+    """
+    cache_type, low, high, batch_size, force = task
+    model_class, _, embedding_text = recommender.EMBEDDED_ENTITIES[cache_type]
+    objects = list(model_class.objects.filter(id__gte=low, id__lt=high).order_by('id'))
+    if objects:
+        # No cache keys: nothing is kept in the worker's memory
+        recommender.get_embeddings(
+            [embedding_text(obj) for obj in objects], [None] * len(objects), cache_type,
+            [obj.id for obj in objects], force_update=force, batch_size=batch_size
+        )
+    return task, len(objects)
+
+
+class Command(BaseCommand):
+    help = (
+        "Embed every community, post and activity into the embedding store, in primary key chunks spread over "
+        "worker processes. Progress is checkpointed per chunk, so an interrupted run resumes where it stopped; "
+        "use it to re-embed the corpus with a new model before switching traffic to it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--types', nargs='+', choices=list(recommender.EMBEDDED_ENTITIES),
+                            default=list(recommender.EMBEDDED_ENTITIES))
+        parser.add_argument('--model', default=settings.RECOMMENDER_EMBEDDING_MODEL,
+                            help="SentenceTransformer model to embed with")
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help="Worker processes; 1 embeds in this process")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Primary keys per chunk")
+        parser.add_argument('--batch-size', type=int, default=256, help="Texts per model call")
+        parser.add_argument('--checkpoint', help="Checkpoint file, by default one per model next to the snapshots")
+        parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and start over")
+        parser.add_argument('--force', action='store_true',
+                            help="Re-encode objects even when an embedding of the same content is stored")
+
+    def handle(self, *args, **options):
+        checkpoint_path = options['checkpoint'] or os.path.join(
+            settings.RECOMMENDER_SNAPSHOT_DIR, f"backfill-{re.sub(r'[^A-Za-z0-9.-]+', '_', options['model'])}.json"
+        )
+        checkpoint = self.load_checkpoint(checkpoint_path, options)
+        tasks = self.plan(checkpoint, options)
+        if not tasks:
+            self.stdout.write("Nothing left to embed")
+            return
+
+        self.stdout.write(f"Embedding {len(tasks)} chunks with {options['model']}, checkpoint {checkpoint_path}")
+        started = time.perf_counter()
+        rows = 0
+        if options['processes'] <= 1:
+            init_worker(options['model'])
+            for task, count in map(embed_chunk, tasks):
+                rows = self.record(checkpoint, checkpoint_path, task, count, rows, started)
+        else:
+            # Forked workers must not share the parent's connections
+            connections.close_all()
+            with multiprocessing.Pool(options['processes'], initializer=init_worker,
+                                      initargs=(options['model'],)) as pool:
+                for task, count in pool.imap_unordered(embed_chunk, tasks):
+                    rows = self.record(checkpoint, checkpoint_path, task, count, rows, started)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Embedded {rows} objects in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.1f} rows/s)")
+
+    def load_checkpoint(self, path, options):
+        if not options['restart'] and os.path.exists(path):
+            with open(path) as file:
+                checkpoint = json.load(file)
+            if checkpoint["model_name"] != options['model']:
+                self.stdout.write(f"Ignoring the checkpoint, it was written for {checkpoint['model_name']}")
+                return {"model_name": options['model'], "chunk_size": options['chunk_size'], "done": {}}
+            if checkpoint["chunk_size"] != options['chunk_size']:
+                self.stdout.write(f"Resuming with the checkpoint's chunk size of {checkpoint['chunk_size']}")
+            return checkpoint
+        return {"model_name": options['model'], "chunk_size": options['chunk_size'], "done": {}}
+
+    def plan(self, checkpoint, options):
+        """
+        Split each type's primary key range into chunks and drop those the checkpoint marks as done.
+        """
+        chunk_size = checkpoint["chunk_size"]
+        tasks = []
+        for cache_type in options['types']:
+            model_class = recommender.EMBEDDED_ENTITIES[cache_type][0]
+            bounds = model_class.objects.aggregate(low=Min('id'), high=Max('id'))
+            if bounds['low'] is None:
+                continue
+            done = set(checkpoint["done"].get(cache_type, []))
+            first = bounds['low'] - bounds['low'] % chunk_size
+            tasks.extend(
+                (cache_type, low, low + chunk_size, options['batch_size'], options['force'])
+                for low in range(first, bounds['high'] + 1, chunk_size) if low not in done
+            )
+        return tasks
+
+    def record(self, checkpoint, path, task, count, rows, started):
+        """
+        Mark a chunk as done, rewriting the checkpoint atomically, and report the throughput so far.
+        """
+        cache_type, low = task[0], task[1]
+        checkpoint["done"].setdefault(cache_type, []).append(low)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(checkpoint, file)
+        os.replace(f"{path}.tmp", path)
+
+        rows += count
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"{cache_type} {low}-{task[2] - 1}: {count} objects, "
+                          f"{rows} total, {rows / elapsed if elapsed else 0:.1f} rows/s")
+        return rows
@@ -0,0 +1,308 @@
+import io
+import json
+import random
+import time
+import tracemalloc
+import zlib
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from ... import recommender
+from ...models import User, Community, Membership, Post, LikedPost, CommunityActivity, ActivityParticipants, \
+    UserActivity
+
+# Words shared by every topic, so texts are not trivially separable
+COMMON_WORDS = ["club", "students", "campus", "event", "weekly", "meetup", "share", "learn"]
+
+
+class HashingEncoder:
+    """
+    Deterministic bag-of-words stand-in for the SentenceTransformer model: every token maps to a
+    fixed random unit vector and a text is the sum of its tokens. Fast, needs no download, and texts
+    sharing words stay similar, which is all the recommenders need to be exercised and evaluated.
+    """
+
+    def __init__(self, dimension=384):
+        self.dimension = dimension
+        self._token_vectors = {}
+
+    def _token_vector(self, token):
+        vector = self._token_vectors.get(token)
+        if vector is None:
+            rng = np.random.default_rng(zlib.crc32(token.encode("utf-8")))
+            vector = rng.standard_normal(self.dimension).astype(np.float32)
+            self._token_vectors[token] = vector
+        return vector
+
+    def encode(self, texts, batch_size=None, convert_to_numpy=True, **kwargs):
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in "".join(c if c.isalnum() else " " for c in text.lower()).split():
+                embeddings[row] += self._token_vector(token)
+        return embeddings
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 3) if values else None
+
+
+class Command(BaseCommand):
+    help = "Benchmark the hybrid recommenders on a synthetic dataset and print the results as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--communities', type=int, default=200)
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--activities', type=int, default=1000)
+        parser.add_argument('--topics', type=int, default=20)
+        parser.add_argument('--memberships-per-user', type=int, default=5)
+        parser.add_argument('--likes-per-user', type=int, default=10)
+        parser.add_argument('--user-activity-per-user', type=int, default=10,
+                            help="Visit and search rows per user")
+        parser.add_argument('--sample-users', type=int, default=50, help="Users the recommenders are run for")
+        parser.add_argument('--k', type=int, default=10, help="Cut-off for precision@k")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Also write the JSON report to this file")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        previous_model, previous_model_name = recommender._model, recommender.EMBEDDING_MODEL_NAME
+        recommender.set_model(HashingEncoder(), model_name="benchmark-hashing-encoder")
+        recommender.clear_state()
+
+        try:
+            # Everything written by the benchmark, stored embeddings included, is rolled back
+            with transaction.atomic():
+                started = time.perf_counter()
+                dataset = self.build_dataset(options)
+                build_seconds = time.perf_counter() - started
+                started = time.perf_counter()
+                call_command('rebuild_activity_counters', stdout=io.StringIO())
+                recommender.refresh_community_neighbors()
+                derived_seconds = time.perf_counter() - started
+                # What the run_recommender_jobs worker does as objects are saved; recommendation requests never encode them
+                started = time.perf_counter()
+                for cache_type, (model_class, _, _) in recommender.EMBEDDED_ENTITIES.items():
+                    recommender.embed_objects(cache_type, list(model_class.objects.values_list('id', flat=True)))
+                user_ids = list(User.objects.values_list('id', flat=True))
+                recommender.embed_interests(user_ids)
+                recommender.update_activity_profiles(user_ids)
+                embedding_seconds = time.perf_counter() - started
+
+                report = {
+                    "created_at": timezone.now().isoformat(),
+                    "options": {key: options[key] for key in (
+                        'users', 'communities', 'posts', 'activities', 'topics', 'memberships_per_user',
+                        'likes_per_user', 'user_activity_per_user', 'sample_users', 'k', 'seed'
+                    )},
+                    "dataset_build_seconds": round(build_seconds, 3),
+                    "derived_tables_seconds": round(derived_seconds, 3),
+                    "embedding_seconds": round(embedding_seconds, 3),
+                    "recommenders": {
+                        "communities": self.run(recommender.get_hybrid_recommendations, dataset, "communities", options),
+                        "posts": self.run(recommender.hybrid_post_recommendation, dataset, "posts", options),
+                        "activities": self.run(recommender.hybrid_activity_recommendation, dataset, "activities",
+                                               options),
+                    },
+                    "embedding_cache": recommender.embedding_cache_stats(),
+                }
+                transaction.set_rollback(True)
+        finally:
+            recommender.clear_state()
+            recommender.set_model(previous_model, model_name=previous_model_name)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        self.stdout.write(output)
+
+    def build_dataset(self, options):
+        """
+        Create users, communities, memberships, posts, likes, activities and visit/search rows.
+        Every community belongs to one topic and every user is interested in one or two topics,
+        which gives the ground truth for precision@k.
+        """
+        rng = self.rng
+        topics = [[f"topic{topic}"] + [f"t{topic}w{word}" for word in range(7)] for topic in range(options['topics'])]
+        now = timezone.now()
+
+        def topic_text(topic, words):
+            return " ".join(rng.sample(topics[topic], words) + rng.sample(COMMON_WORDS, 2))
+
+        user_topics = [rng.sample(range(len(topics)), rng.randint(1, 2)) for _ in range(options['users'])]
+        users = User.objects.bulk_create([
+            User(
+                username=f"benchmark_user_{index}",
+                email=f"benchmark_user_{index}@benchmark.invalid",
+                first_name="Benchmark",
+                last_name=str(index),
+                interests=[word for topic in interests for word in rng.sample(topics[topic], 3)],
+            )
+            for index, interests in enumerate(user_topics)
+        ])
+
+        community_topics = [index % len(topics) for index in range(options['communities'])]
+        communities = Community.objects.bulk_create([
+            Community(
+                name=f"{topic_text(topic, 2)} {index}",
+                keyword=rng.sample(topics[topic], 3),
+                description=topic_text(topic, 4),
+                rules="Be nice",
+            )
+            for index, topic in enumerate(community_topics)
+        ])
+        communities_by_topic = {}
+        for community, topic in zip(communities, community_topics):
+            communities_by_topic.setdefault(topic, []).append(community)
+
+        def topic_community(user_index):
+            return rng.choice(communities_by_topic[rng.choice(user_topics[user_index])])
+
+        memberships = {}
+        for index, user in enumerate(users):
+            for _ in range(options['memberships_per_user']):
+                community = topic_community(index)
+                memberships[(user.id, community.id)] = Membership(user=user, community=community, status='accepted')
+        Membership.objects.bulk_create(memberships.values())
+
+        posts = Post.objects.bulk_create([
+            Post(
+                title=topic_text(community_topics[position], 3),
+                content=topic_text(community_topics[position], 5),
+                created_by=rng.choice(users),
+                posted_in=communities[position],
+            )
+            for position in (rng.randrange(len(communities)) for _ in range(options['posts']))
+        ])
+        posts_by_community = {}
+        for post in posts:
+            posts_by_community.setdefault(post.posted_in_id, []).append(post)
+
+        likes = {}
+        for index, user in enumerate(users):
+            for _ in range(options['likes_per_user']):
+                candidates = posts_by_community.get(topic_community(index).id)
+                if candidates:
+                    post = rng.choice(candidates)
+                    likes[(user.id, post.id)] = LikedPost(user=user, post=post)
+        LikedPost.objects.bulk_create(likes.values())
+
+        activities = CommunityActivity.objects.bulk_create([
+            CommunityActivity(
+                title=topic_text(community_topics[position], 3),
+                description=topic_text(community_topics[position], 5),
+                startDate=now + timedelta(days=rng.randint(1, 60)),
+                endDate=now + timedelta(days=rng.randint(61, 90)),
+                location="Benchmark hall",
+                organizer=rng.choice(users),
+                community=communities[position],
+                max_participants=50,
+            )
+            for position in (rng.randrange(len(communities)) for _ in range(options['activities']))
+        ])
+        if activities:
+            participants = {
+                (user.id, activity.id): ActivityParticipants(user=user, activity=activity)
+                for user, activity in (
+                    (rng.choice(users), rng.choice(activities)) for _ in range(len(activities) * 5)
+                )
+            }
+            ActivityParticipants.objects.bulk_create(participants.values())
+
+        UserActivity.objects.bulk_create([
+            UserActivity(
+                user=user,
+                activity_type=rng.choice(["visit", "search"]),
+                activity_data=topic_community(index).name,
+            )
+            for index, user in enumerate(users)
+            for _ in range(options['user_activity_per_user'])
+        ])
+
+        community_topic = {community.id: topic for community, topic in zip(communities, community_topics)}
+        return {
+            "users": users,
+            "user_topics": user_topics,
+            # Topic of a recommended item; it is relevant when the user is interested in that topic
+            "topic_of": {
+                "communities": lambda community: community_topic.get(community.id),
+                "posts": lambda post: community_topic.get(post.posted_in_id),
+                "activities": lambda activity: community_topic.get(activity.community_id),
+            },
+        }
+
+    def run(self, recommend, dataset, entity_type, options):
+        """
+        Time the recommender for a sample of users and evaluate precision@k against the user topics.
+        The first call builds the in-process matrices and is reported separately as the cold call.
+        """
+        sample = self.rng.sample(range(len(dataset["users"])), min(options['sample_users'], len(dataset["users"])))
+        topic_of = dataset["topic_of"][entity_type]
+        k = options['k']
+
+        recommender.clear_state()
+        started = time.perf_counter()
+        recommend(dataset["users"][sample[0]].id)
+        cold_ms = (time.perf_counter() - started) * 1000
+
+        latencies = []
+        query_counts = []
+        precisions = []
+        result_counts = []
+        for index in sample:
+            user = dataset["users"][index]
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                recommendations = recommend(user.id)
+                latencies.append((time.perf_counter() - started) * 1000)
+            query_counts.append(len(queries))
+            result_counts.append(len(recommendations))
+
+            top = recommendations[:k]
+            if top:
+                interests = set(dataset["user_topics"][index])
+                hits = sum(1 for item, *_ in top if topic_of(item) in interests)
+                precisions.append(hits / len(top))
+
+        # Where the time goes, from the per-stage timings of the pipeline behind the recommender
+        stage_timings = defaultdict(list)
+        for index in sample:
+            for stage_name, elapsed in recommender.PIPELINES[entity_type].execute(
+                    dataset["users"][index].id).timings.items():
+                stage_timings[stage_name].append(elapsed)
+
+        # Peak Python allocations, measured in a separate pass as tracing slows every call down
+        recommender.clear_state()
+        tracemalloc.start()
+        recommend(dataset["users"][sample[0]].id)
+        cold_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        for index in sample[:10]:
+            recommend(dataset["users"][index].id)
+        warm_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        return {
+            "cold_ms": round(cold_ms, 3),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "mean_ms": round(float(np.mean(latencies)), 3) if latencies else None,
+            "queries_mean": round(float(np.mean(query_counts)), 2) if query_counts else None,
+            "queries_max": max(query_counts, default=None),
+            "cold_peak_memory_kib": round(cold_peak / 1024, 1),
+            "warm_peak_memory_kib": round(warm_peak / 1024, 1),
+            f"precision_at_{k}": round(float(np.mean(precisions)), 4) if precisions else None,
+            "coverage": round(len(precisions) / len(sample), 4) if sample else None,
+            "results_mean": round(float(np.mean(result_counts)), 2) if result_counts else None,
+            "stage_mean_ms": {
+                stage_name: round(float(np.mean(elapsed)), 3) for stage_name, elapsed in stage_timings.items()
+            },
+        }
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ... import recommender
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the CommunityNeighbor table: for every community, the most similar communities by cosine "
+        "similarity of their member sets. Membership signals keep it up to date in between."
+    )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        # Always start from the current memberships
+        recommender.community_interactions.clear()
+        count = recommender.refresh_community_neighbors()
+        self.stdout.write(f"Wrote {count} community neighbours in {time.perf_counter() - started:.1f}s")
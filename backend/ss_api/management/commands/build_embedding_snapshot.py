@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ... import recommender
+from ...embedding_matrix import normalize_rows
+from ...embedding_snapshot import SnapshotWriter, prune_snapshots
+from ...quantization import SUPPORTED_DTYPES
+
+
+class Command(BaseCommand):
+    help = (
+        "Write memory-mapped embedding snapshots of communities, posts and activities, shared read-only "
+        "by every worker. Workers pick up a new snapshot when they restart."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--types', nargs='+', choices=list(recommender.EMBEDDED_ENTITIES),
+                            default=list(recommender.EMBEDDED_ENTITIES))
+        parser.add_argument('--directory', default=settings.RECOMMENDER_SNAPSHOT_DIR)
+        parser.add_argument('--dtype', choices=SUPPORTED_DTYPES, default=settings.RECOMMENDER_EMBEDDING_DTYPE)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--keep', type=int, default=2, help="Snapshots to keep per type, the new one included")
+
+    def handle(self, *args, **options):
+        os.makedirs(options['directory'], exist_ok=True)
+        for cache_type in options['types']:
+            path, count = self.build(cache_type, options)
+            if path is None:
+                self.stdout.write(f"No {cache_type} to write a snapshot of")
+                continue
+            prune_snapshots(options['directory'], cache_type, options['keep'])
+            self.stdout.write(f"Wrote {count} {cache_type} embeddings to {path}")
+
+    def build(self, cache_type, options):
+        model_class, _, embedding_text = recommender.EMBEDDED_ENTITIES[cache_type]
+        queryset = model_class.objects.order_by('id')
+        writer = SnapshotWriter(options['directory'], cache_type, queryset.count(), options['dtype'])
+        highest_id = 0
+
+        batch = []
+        for obj in queryset.iterator(chunk_size=options['chunk_size']):
+            batch.append(obj)
+            highest_id = obj.id
+            if len(batch) == options['chunk_size']:
+                self.write_batch(writer, cache_type, embedding_text, batch)
+                batch = []
+        if batch:
+            self.write_batch(writer, cache_type, embedding_text, batch)
+
+        path = writer.commit(recommender.EMBEDDING_MODEL_NAME, highest_id)
+        return path, writer.count
+
+    def write_batch(self, writer, cache_type, embedding_text, objects):
+        # No cache keys: the builder reuses persisted embeddings but keeps nothing in memory
+        texts = [embedding_text(obj) for obj in objects]
+        embeddings = recommender.get_embeddings(
+            texts, [None] * len(objects), cache_type, [obj.id for obj in objects]
+        )
+        rows = [
+            (obj.id, recommender.content_hash(text), embedding)
+            for obj, text, embedding in zip(objects, texts, embeddings) if embedding is not None
+        ]
+        if rows:
+            object_ids, text_hashes, vectors = zip(*rows)
+            writer.append(list(object_ids), normalize_rows(np.vstack(vectors)), list(text_hashes))
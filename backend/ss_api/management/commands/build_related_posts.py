@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ... import recommender
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the PostNeighbor table: for every approved post, the most similar approved posts by "
+        "embedding, encoding the posts that have no stored embedding yet. The run_recommender_jobs worker "
+        "keeps it up to date as posts are created, edited and moderated."
+    )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = recommender.refresh_related_posts()
+        self.stdout.write(f"Wrote {count} related posts in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,116 @@
+import multiprocessing
+import os
+import time
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Count, Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from ... import recommender
+from ...models import User, StoredEmbedding
+
+
+def init_worker():
+    """
+    Pool initializer: drop the database connections inherited from the parent, so every worker opens
+    its own. The model is not loaded: recommendations only read stored embeddings.
+    """
+    connections.close_all()
+
+
+def precompute_chunk(user_ids, entity_types):
+    """
+    Compute and store the recommendations of a chunk of users. Returns (users, failures).
+    """
+    recommender.reserve_precomputed_recommendations(user_ids, entity_types)
+    computed_at = timezone.now()
+    rows = []
+    failures = 0
+    for user_id in user_ids:
+        try:
+            rows.extend(
+                (user_id, entity_type, recommender.compute_recommendations(user_id, entity_type))
+                for entity_type in entity_types
+            )
+        except Exception:
+            recommender.logger.exception(f"Could not precompute recommendations for user {user_id}")
+            failures += 1
+    recommender.save_precomputed_recommendations(rows, computed_at)
+    return len(user_ids), failures
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute community, post and activity recommendations for active users on a process pool and store "
+        "them in PrecomputedRecommendation, which the recommendation views read before computing live."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--types', nargs='+', choices=list(recommender.RECOMMENDERS),
+                            default=list(recommender.RECOMMENDERS))
+        parser.add_argument('--users', nargs='+', type=int, help="Only these user ids")
+        parser.add_argument('--active-days', type=int, default=30,
+                            help="Only users active within this many days; 0 for every active user")
+        parser.add_argument('--stale', action='store_true',
+                            help="Only users with a missing or expired list, e.g. after their memberships changed")
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help="Worker processes; 1 computes in this process")
+        parser.add_argument('--chunk-size', type=int, default=50, help="Users per task")
+
+    def handle(self, *args, **options):
+        user_ids = self.select_users(options)
+        if not user_ids:
+            self.stdout.write("No users to precompute recommendations for")
+            return
+
+        chunks = [user_ids[start:start + options['chunk_size']]
+                  for start in range(0, len(user_ids), options['chunk_size'])]
+        entity_types = options['types']
+        started = time.perf_counter()
+        done = failures = 0
+
+        if options['processes'] <= 1:
+            for users, chunk_failures in (precompute_chunk(chunk, entity_types) for chunk in chunks):
+                done, failures = self.report(done + users, failures + chunk_failures, len(user_ids), started)
+            return
+
+        # Forked workers must not share the parent's connections
+        connections.close_all()
+        with multiprocessing.Pool(options['processes'], initializer=init_worker) as pool:
+            tasks = pool.imap_unordered(partial(precompute_chunk, entity_types=entity_types), chunks)
+            for users, chunk_failures in tasks:
+                done, failures = self.report(done + users, failures + chunk_failures, len(user_ids), started)
+
+    def select_users(self, options):
+        # Users without a stored interest or activity embedding would only get the popular fallback lists
+        users = User.objects.filter(is_active=True).filter(Exists(StoredEmbedding.objects.filter(
+            object_type__in=["users", "user_activity"],
+            object_id=OuterRef('id'),
+            model_name=recommender.EMBEDDING_MODEL_NAME
+        )))
+        if options['users']:
+            users = users.filter(id__in=options['users'])
+        if options['active_days']:
+            users = users.filter(last_active__gte=timezone.now() - timedelta(days=options['active_days']))
+        if options['stale']:
+            fresh_after = timezone.now() - timedelta(seconds=settings.RECOMMENDER_PRECOMPUTED_MAX_AGE)
+            users = users.annotate(fresh=Count(
+                'precomputed_recommendations',
+                filter=Q(precomputed_recommendations__entity_type__in=options['types'],
+                         precomputed_recommendations__computed_at__gte=fresh_after) & (
+                    Q(precomputed_recommendations__invalidated_at__isnull=True) |
+                    Q(precomputed_recommendations__computed_at__gt=F('precomputed_recommendations__invalidated_at'))
+                )
+            )).filter(fresh__lt=len(options['types']))
+        return list(users.order_by('id').values_list('id', flat=True))
+
+    def report(self, done, failures, total, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{done}/{total} users, {failures} failed, {done / elapsed if elapsed else 0:.1f} users/s"
+        )
+        return done, failures
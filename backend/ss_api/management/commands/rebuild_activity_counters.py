@@ -0,0 +1,72 @@
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from ...activity_counters import decay_factor, searched_communities, COMMUNITY_SEARCH, SEARCH_ACTIVITY_TYPES
+from ...models import Community, CommunityInteraction, SearchHistory, UserActivity
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the decayed per-user community visit and search counters and the recent-search histories "
+        "from the UserActivity log. Only needed once; the community views keep them up to date afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        community_ids = {}
+        for community_id, name in Community.objects.order_by('-id').values_list('id', 'name'):
+            community_ids[name] = community_id
+
+        counters = defaultdict(lambda: {"visit_score": 0.0, "search_score": 0.0, "visits": 0, "searches": 0,
+                                        "last_visited_at": None})
+        history_size = settings.RECOMMENDER_RECENT_SEARCHES
+        searches = defaultdict(lambda: deque(maxlen=history_size))
+        activities = UserActivity.objects.filter(
+            user__isnull=False, activity_type__in=["visit", *SEARCH_ACTIVITY_TYPES]
+        ).order_by('timestamp', 'id').values_list('user_id', 'activity_type', 'activity_data', 'timestamp')
+
+        # Searched communities by query, counted with the same rule as live searches
+        searched = {}
+        for user_id, activity_type, activity_data, timestamp in activities.iterator(chunk_size=options['chunk_size']):
+            if activity_type == "visit":
+                # Visits are logged with the community name
+                community_id = community_ids.get(activity_data)
+                if community_id is None:
+                    continue
+                counter = counters[(user_id, community_id)]
+                counter["visit_score"] += decay_factor(timestamp, now)
+                counter["visits"] += 1
+                counter["last_visited_at"] = timestamp
+                continue
+
+            searches[user_id].append([activity_data, timestamp.isoformat()])
+            if activity_type != COMMUNITY_SEARCH:
+                continue
+            if activity_data not in searched:
+                searched[activity_data] = searched_communities(activity_data)
+            for community_id in searched[activity_data]:
+                counter = counters[(user_id, community_id)]
+                counter["search_score"] += decay_factor(timestamp, now)
+                counter["searches"] += 1
+
+        with transaction.atomic():
+            CommunityInteraction.objects.all().delete()
+            CommunityInteraction.objects.bulk_create(
+                [CommunityInteraction(user_id=user_id, community_id=community_id, updated_at=now, **counter)
+                 for (user_id, community_id), counter in counters.items()],
+                batch_size=1000
+            )
+            SearchHistory.objects.all().delete()
+            SearchHistory.objects.bulk_create(
+                [SearchHistory(user_id=user_id, entries=list(entries)[::-1])
+                 for user_id, entries in searches.items()],
+                batch_size=1000
+            )
+        self.stdout.write(f"Rebuilt {len(counters)} community counters and {len(searches)} search histories")
@@ -0,0 +1,39 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from ... import invalidation_bus, recommender, recommender_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Process the queued recommender jobs (RecommenderJob): embed saved communities, posts and activities "
+        "and maintain the tables derived from them. This is the only process that loads the embedding model "
+        "for catalogue items; run one or more next to the web workers. Several workers can share the queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+        parser.add_argument('--batch-size', type=int, default=settings.RECOMMENDER_ENCODE_BATCH_SIZE,
+                            help="Jobs claimed at a time")
+        parser.add_argument('--poll-interval', type=float, default=settings.RECOMMENDER_JOB_POLL_INTERVAL,
+                            help="Seconds to wait when the queue is empty")
+
+    def handle(self, *args, **options):
+        # Keep this process's matrices in step with the saves of the web workers, as they do with each other
+        if settings.INVALIDATION_BUS_ENABLED and connection.vendor == "postgresql":
+            invalidation_bus.listener.start()
+
+        processed = 0
+        while True:
+            close_old_connections()
+            count = recommender_jobs.process_batch(recommender.JOB_HANDLERS, options['batch_size'])
+            processed += count
+            if count:
+                self.stdout.write(f"Processed {count} jobs ({processed} in total)")
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['poll_interval'])
@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ss_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_type', models.CharField(max_length=50)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('model_name', models.CharField(max_length=255)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('vector', models.BinaryField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='storedembedding',
+            constraint=models.UniqueConstraint(fields=('object_type', 'object_id', 'model_name'), name='unique_stored_embedding'),
+        ),
+    ]
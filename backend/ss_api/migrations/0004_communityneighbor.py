@@ -0,0 +1,25 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ss_api', '0003_precomputedrecommendation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommunityNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('community', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='ss_api.community')),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ss_api.community')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='communityneighbor',
+            constraint=models.UniqueConstraint(fields=('community', 'neighbor'), name='unique_community_neighbor'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ss_api', '0004_communityneighbor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommunityInteraction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('visit_score', models.FloatField(default=0)),
+                ('search_score', models.FloatField(default=0)),
+                ('visits', models.PositiveIntegerField(default=0)),
+                ('searches', models.PositiveIntegerField(default=0)),
+                ('last_visited_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('community', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ss_api.community')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='community_interactions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='communityinteraction',
+            constraint=models.UniqueConstraint(fields=('user', 'community'), name='unique_community_interaction'),
+        ),
+        migrations.CreateModel(
+            name='SearchHistory',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_history', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('entries', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ss_api', '0005_communityinteraction_searchhistory'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['created_at'], name='ss_api_post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='communityactivity',
+            index=models.Index(fields=['endDate', 'startDate'], name='ss_api_activity_dates_idx'),
+        ),
+    ]
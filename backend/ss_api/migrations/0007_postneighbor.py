@@ -0,0 +1,25 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ss_api', '0006_recommendation_window_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ss_api.post')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='ss_api.post')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='postneighbor',
+            constraint=models.UniqueConstraint(fields=('post', 'neighbor'), name='unique_post_neighbor'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ss_api', '0007_postneighbor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommenderJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=32)),
+                ('object_id', models.IntegerField()),
+                ('enqueued_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['enqueued_at'], name='ss_api_job_enqueued_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='recommenderjob',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='unique_recommender_job'),
+        ),
+    ]
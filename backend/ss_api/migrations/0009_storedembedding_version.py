@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ss_api', '0008_recommenderjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedembedding',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        # Activity profiles stored a timestamp or an activity id as their hash: they are up to date with
+        # the last activity of their user
+        migrations.RunSQL(
+            """
+            UPDATE ss_api_storedembedding SET content_hash = '', version = COALESCE((
+                SELECT MAX(id) FROM ss_api_useractivity WHERE user_id = ss_api_storedembedding.object_id
+            ), 0)
+            WHERE object_type = 'user_activity'
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,18 @@
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ss_api', '0009_storedembedding_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recommenderjob',
+            name='token',
+            field=models.UUIDField(default=uuid.uuid4),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ss_api', '0010_recommenderjob_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='precomputedrecommendation',
+            name='invalidated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -5,6 +5,7 @@ from django.contrib.postgres.fields import ArrayField
 from django.contrib.contenttypes.models import ContentType
 from django.utils.timezone import now
 import pyotp
+import uuid
 
 from django.db.models import JSONField
 from rest_framework.exceptions import ValidationError
@@ -92,6 +93,9 @@ class Post(models.Model):
     isPinned = models.BooleanField(default=False)
     status = models.CharField(max_length=255, default='approved')
 
+    class Meta:
+        indexes = [models.Index(fields=['created_at'], name='ss_api_post_created_idx')]
+
 
 class Membership(models.Model):
     user = models.ForeignKey(User, to_field='id', on_delete=models.CASCADE)
@@ -280,6 +284,9 @@ class CommunityActivity(models.Model):
     max_participants = models.PositiveIntegerField()
     image = models.URLField(max_length=None, null=True, blank=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['endDate', 'startDate'], name='ss_api_activity_dates_idx')]
+
     def __str__(self):
         return self.title
 
@@ -375,4 +382,122 @@ class Vote(models.Model):
     option = models.IntegerField()
 
     def __str__(self):
-        return f"Vote {self.option} for Poll {self.poll.id}"
\ No newline at end of file
+        return f"Vote {self.option} for Poll {self.poll.id}"
+
+class StoredEmbedding(models.Model):
+    object_type = models.CharField(max_length=50)
+    object_id = models.PositiveBigIntegerField()
+    model_name = models.CharField(max_length=255)
+    content_hash = models.CharField(max_length=64)
+    # For embeddings folded from a stream rather than computed from a text (the "user_activity" profiles),
+    # the id of the last UserActivity folded in; content_hash is then empty
+    version = models.PositiveBigIntegerField(default=0)
+    vector = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['object_type', 'object_id', 'model_name'], name='unique_stored_embedding')
+        ]
+
+    def __str__(self):
+        return f"{self.object_type} {self.object_id} ({self.model_name})"
+
+
+class PrecomputedRecommendation(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='precomputed_recommendations')
+    entity_type = models.CharField(max_length=20)
+    # Ranked [object_id, score, ...] lists, as returned by recommender.get_cached_recommendations
+    items = models.JSONField(default=list)
+    # When the computation started; the list is out of date if the user's data changed after that
+    computed_at = models.DateTimeField(default=now)
+    invalidated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'entity_type'], name='unique_precomputed_recommendation')
+        ]
+
+    def __str__(self):
+        return f"{self.entity_type} for {self.user_id} ({self.computed_at})"
+
+
+class CommunityNeighbor(models.Model):
+    community = models.ForeignKey(Community, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Community, on_delete=models.CASCADE, related_name='+')
+    # Cosine similarity of the two communities' member sets
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['community', 'neighbor'], name='unique_community_neighbor')
+        ]
+
+    def __str__(self):
+        return f"{self.community_id} -> {self.neighbor_id} ({self.score:.3f})"
+
+
+class PostNeighbor(models.Model):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    # Cosine similarity of the two posts' embeddings
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'neighbor'], name='unique_post_neighbor')
+        ]
+
+    def __str__(self):
+        return f"{self.post_id} -> {self.neighbor_id} ({self.score:.3f})"
+
+
+class CommunityInteraction(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='community_interactions')
+    community = models.ForeignKey(Community, on_delete=models.CASCADE, related_name='+')
+    # Exponentially decayed visit and search counts, as of updated_at (see activity_counters)
+    visit_score = models.FloatField(default=0)
+    search_score = models.FloatField(default=0)
+    visits = models.PositiveIntegerField(default=0)
+    searches = models.PositiveIntegerField(default=0)
+    last_visited_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(default=now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'community'], name='unique_community_interaction')
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.community_id} ({self.visits} visits, {self.searches} searches)"
+
+
+class SearchHistory(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='search_history')
+    # Most recent first, [query, ISO timestamp] pairs capped at RECOMMENDER_RECENT_SEARCHES
+    entries = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Search history of {self.user_id}"
+
+
+class RecommenderJob(models.Model):
+    # What to recompute for object_id, e.g. the embedding of a post ("posts"); see recommender.JOB_HANDLERS
+    kind = models.CharField(max_length=32)
+    object_id = models.IntegerField()
+    enqueued_at = models.DateTimeField(default=now)
+    # Set while a worker processes the job; claims older than RECOMMENDER_JOB_CLAIM_TIMEOUT are taken over
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Replaced every time the job is enqueued again, so a worker only deletes the version it claimed
+    token = models.UUIDField(default=uuid.uuid4)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='unique_recommender_job')
+        ]
+        indexes = [models.Index(fields=['enqueued_at'], name='ss_api_job_enqueued_idx')]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} (queued {self.enqueued_at})"
@@ -0,0 +1,260 @@
+import logging
+import time
+
+import numpy as np
+
+from .models import User, Membership
+
+logger = logging.getLogger(__name__)
+
+
+class ScoredItems:
+    """
+    Output of a scoring stage: parallel arrays of object ids and scores, plus optional reasons by object id.
+    """
+
+    def __init__(self, ids=(), scores=(), reasons=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.scores = np.asarray(scores, dtype=np.float64)
+        self.reasons = reasons or {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def without(self, excluded_ids):
+        """
+        Drop the given ids.
+        """
+        if not excluded_ids or not len(self.ids):
+            return self
+        keep = ~np.isin(self.ids, np.fromiter(excluded_ids, dtype=np.int64, count=len(excluded_ids)))
+        return ScoredItems(self.ids[keep], self.scores[keep], self.reasons)
+
+    def scores_of(self, object_ids, default=1.0):
+        """
+        The scores of the given ids, default for the ids that are not listed.
+        """
+        object_ids = np.asarray(object_ids, dtype=np.int64)
+        scores = np.full(len(object_ids), default, dtype=np.float64)
+        if not len(self.ids) or not len(object_ids):
+            return scores
+        order = np.argsort(self.ids)
+        positions = np.minimum(np.searchsorted(self.ids, object_ids, sorter=order), len(order) - 1)
+        found = self.ids[order[positions]] == object_ids
+        scores[found] = self.scores[order[positions[found]]]
+        return scores
+
+
+def min_max_normalize(scores):
+    """
+    Scale scores to [0, 1] within their own range. If every score is equal they all become 1.
+    """
+    if not len(scores):
+        return scores
+    low, high = scores.min(), scores.max()
+    if high == low:
+        return np.ones_like(scores)
+    return (scores - low) / (high - low)
+
+
+def fuse(weighted_sources, score_threshold, limit=None, item_weights=None):
+    """
+    Combine (ScoredItems, weight) pairs: each source is normalised within its own range, the weighted
+    scores of an id are summed and ids below score_threshold are dropped. The remaining totals are then
+    multiplied by the id's item_weights score (ScoredItems, e.g. recency; 1 for ids it does not list).
+    Returns (ids, scores, reasons) best first, at most `limit` of them; ties keep the order in which the
+    sources listed them, and the first source's reason wins. With a limit only the selected ids are
+    sorted (argpartition).
+    """
+    ids = np.concatenate([items.ids for items, _ in weighted_sources])
+    weighted = np.concatenate([min_max_normalize(items.scores) * weight for items, weight in weighted_sources])
+
+    unique_ids, first_positions, inverse = np.unique(ids, return_index=True, return_inverse=True)
+    totals = np.zeros(len(unique_ids), dtype=np.float64)
+    np.add.at(totals, inverse, weighted)
+
+    keep = totals >= score_threshold
+    unique_ids, first_positions, totals = unique_ids[keep], first_positions[keep], totals[keep]
+    if item_weights is not None:
+        # Before the cut, so an item the weight lifts into the best `limit` is kept
+        totals = totals * item_weights.scores_of(unique_ids)
+    if limit is not None and len(totals) > limit:
+        top = np.argpartition(-totals, limit - 1)[:limit]
+        unique_ids, first_positions, totals = unique_ids[top], first_positions[top], totals[top]
+    order = np.lexsort((first_positions, -totals))
+
+    reasons = {}
+    for items, _ in reversed(weighted_sources):
+        reasons.update(items.reasons)
+    return unique_ids[order], totals[order], reasons
+
+
+class RecommendationContext:
+    """
+    State shared by the stages of one pipeline run.
+    """
+
+    def __init__(self, user_id, content_weight, collaborative_weight, score_threshold, limit=None):
+        self.user_id = user_id
+        self.limit = limit
+        self.content_weight = content_weight
+        self.collaborative_weight = collaborative_weight
+        self.score_threshold = score_threshold
+        # None means the whole catalogue; scoring stages then retrieve their own candidates
+        self.candidate_ids = None
+        # Per-candidate score multipliers (ScoredItems), if the candidates stage provides them
+        self.item_weights = None
+        self.excluded_ids = set()
+        self.content = ScoredItems()
+        self.collaborative = ScoredItems()
+        self.ids = np.empty(0, dtype=np.int64)
+        self.scores = np.empty(0, dtype=np.float64)
+        self.reasons = {}
+        # Objects already loaded by a stage, reused when the results are hydrated
+        self.objects = {}
+        self.results = []
+        self.timings = {}
+        self._user = None
+        self._memberships = None
+
+    @property
+    def user(self):
+        if self._user is None:
+            self._user = User.objects.get(id=self.user_id)
+        return self._user
+
+    @property
+    def memberships(self):
+        """
+        Ids of the communities the user belongs to, loaded once per run.
+        """
+        if self._memberships is None:
+            self._memberships = set(
+                Membership.objects.filter(user_id=self.user_id).values_list('community_id', flat=True)
+            )
+        return self._memberships
+
+
+class RecommendationPipeline:
+    """
+    Hybrid recommender for one entity type, run as a fixed sequence of stages over a RecommendationContext:
+
+    candidates     ids that may be recommended, or None for the whole catalogue; returned as ScoredItems,
+                   their scores are per-item weights (e.g. recency) applied by fusion and fallback
+    exclusions     ids that must not be recommended (memberships, NotInterested marks, ...)
+    content        content-based ScoredItems
+    collaborative  collaborative-filtering ScoredItems
+    fusion         vectorised normalise, weight and merge of both scores, then the item weights, keeping
+                   the best `limit`
+    fallback       when nothing is left, e.g. for a new user without interests, popular items instead
+    hydration      load the recommended objects
+
+    Stages are plain functions of the context and each records its duration in context.timings, so any of
+    them can be swapped, cached or profiled on its own, for communities, posts and activities alike.
+    """
+
+    def __init__(self, name, model_class, content, collaborative, candidates=None, exclusions=None, fallback=None,
+                 with_reasons=False, content_weight=0.6, collaborative_weight=0.4, score_threshold=0.3):
+        self.name = name
+        self.model_class = model_class
+        self.with_reasons = with_reasons
+        self.defaults = {
+            "content_weight": content_weight,
+            "collaborative_weight": collaborative_weight,
+            "score_threshold": score_threshold,
+        }
+        self.stages = [
+            ("candidates", self._candidates(candidates)),
+            ("exclusions", self._exclusions(exclusions)),
+            ("content", self._scoring("content", content)),
+            ("collaborative", self._scoring("collaborative", collaborative)),
+            ("fusion", self.fuse),
+            ("fallback", self._fallback(fallback)),
+            ("hydration", self.hydrate),
+        ]
+
+    @staticmethod
+    def _candidates(candidates):
+        def stage(context):
+            context.candidate_ids = candidates(context) if candidates is not None else None
+            if isinstance(context.candidate_ids, ScoredItems):
+                context.item_weights = context.candidate_ids
+                context.candidate_ids = context.item_weights.ids
+        return stage
+
+    @staticmethod
+    def _exclusions(exclusions):
+        def stage(context):
+            context.excluded_ids = set(exclusions(context)) if exclusions is not None else set()
+            if context.candidate_ids is not None and context.excluded_ids:
+                context.candidate_ids = context.candidate_ids[~np.isin(
+                    context.candidate_ids, np.fromiter(context.excluded_ids, dtype=np.int64)
+                )]
+        return stage
+
+    @staticmethod
+    def _scoring(attribute, scorer):
+        def stage(context):
+            setattr(context, attribute, scorer(context).without(context.excluded_ids))
+        return stage
+
+    @staticmethod
+    def fuse(context):
+        context.ids, context.scores, context.reasons = fuse(
+            [(context.content, context.content_weight), (context.collaborative, context.collaborative_weight)],
+            context.score_threshold, context.limit, context.item_weights
+        )
+
+    @staticmethod
+    def _fallback(fallback):
+        def stage(context):
+            if fallback is None or len(context.ids):
+                return
+            items = fallback(context).without(context.excluded_ids)
+            if context.candidate_ids is not None:
+                keep = np.isin(items.ids, context.candidate_ids)
+                items = ScoredItems(items.ids[keep], items.scores[keep], items.reasons)
+            if context.item_weights is not None:
+                scores = items.scores * context.item_weights.scores_of(items.ids)
+                order = np.argsort(-scores, kind='stable')
+                items = ScoredItems(items.ids[order], scores[order], items.reasons)
+            context.ids, context.scores = items.ids[:context.limit], items.scores[:context.limit]
+            context.reasons = items.reasons
+        return stage
+
+    def hydrate(self, context):
+        ids = context.ids.tolist()
+        missing = [object_id for object_id in ids if object_id not in context.objects]
+        if missing:
+            context.objects.update(self.model_class.objects.in_bulk(missing))
+
+        context.results = []
+        for object_id, score in zip(ids, context.scores.tolist()):
+            obj = context.objects.get(object_id)
+            if obj is None:
+                continue
+            if self.with_reasons:
+                context.results.append((obj, score, context.reasons.get(object_id)))
+            else:
+                context.results.append((obj, score))
+
+    def execute(self, user_id, **options):
+        """
+        Run every stage and return the context, with the results and the per-stage timings in milliseconds.
+        """
+        context = RecommendationContext(user_id, **{**self.defaults, **options})
+        for stage_name, stage in self.stages:
+            started = time.perf_counter()
+            stage(context)
+            context.timings[stage_name] = (time.perf_counter() - started) * 1000
+        logger.debug(f"{self.name} pipeline for user {user_id}: " + ", ".join(
+            f"{stage_name} {elapsed:.1f} ms" for stage_name, elapsed in context.timings.items()
+        ))
+        return context
+
+    def run(self, user_id, **options):
+        """
+        Return the recommendations as (object, score, reason) tuples with reasons, (object, score) otherwise,
+        best first. Pass limit to keep only the best ones.
+        """
+        return self.execute(user_id, **options).results
@@ -0,0 +1,183 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Storage dtypes for in-memory embeddings; int8 rows carry a per-row float32 scale
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+
+
+def check_dtype(dtype):
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported embedding dtype {dtype!r}, expected one of {', '.join(SUPPORTED_DTYPES)}.")
+    return dtype
+
+
+def quantize_rows(vectors, dtype):
+    """
+    Convert a float32 vector or matrix to the storage dtype. Returns (codes, scales) where scales
+    holds max(|row|) / 127 per row for int8 and is None for the float dtypes.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype != "int8":
+        return vectors.astype(dtype), None
+
+    scales = np.abs(vectors).max(axis=-1) / 127
+    safe_scales = np.where(scales == 0, 1, scales)
+    codes = np.rint(vectors / np.expand_dims(safe_scales, -1)).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize_rows(codes, scales=None):
+    """
+    Inverse of quantize_rows, always returning float32.
+    """
+    vectors = codes.astype(np.float32)
+    if scales is not None:
+        vectors *= np.expand_dims(scales, -1)
+    return vectors
+
+
+def score_rows(codes, scales, query, rows=None, chunk_size=1024):
+    """
+    Dot products of a float32 query with the stored rows (all of them, or the given row positions).
+    Compact rows are dequantised one chunk at a time, so no float32 copy of the whole matrix is made.
+    """
+    if codes.dtype == np.float32 and scales is None:
+        return (codes if rows is None else codes[rows]) @ query
+
+    count = len(codes) if rows is None else len(rows)
+    scores = np.empty(count, dtype=np.float32)
+    for start in range(0, count, chunk_size):
+        chunk = slice(start, min(start + chunk_size, count)) if rows is None else rows[start:start + chunk_size]
+        chunk_scores = codes[chunk].astype(np.float32) @ query
+        if scales is not None:
+            chunk_scores *= scales[chunk]
+        scores[start:start + len(chunk_scores)] = chunk_scores
+    return scores
+
+
+class EmbeddingBlockCache:
+    """
+    Dict-like embedding cache whose vectors live as rows of fixed-size array blocks in the configured
+    dtype, instead of one float32 array object per key. Rows freed by pop() are reused and get()
+    returns a float32 copy, so callers see the same interface as a plain dict of arrays.
+    An entry can carry a version stamp (e.g. the hash of its source text); get() with a version
+    only returns entries stamped with that same version.
+    With max_entries the cache is an LRU: once full, set() evicts the least recently read or written
+    entry and reuses its row, so memory stays bounded however much content accumulates.
+    Hits, misses and evictions are counted, see stats().
+    """
+
+    def __init__(self, dtype="float32", block_size=1024, max_entries=None):
+        self._lock = threading.Lock()
+        self.dtype = check_dtype(dtype)
+        self.max_entries = max_entries
+        self.block_size = min(block_size, max_entries) if max_entries else block_size
+        self.hits = self.misses = self.evictions = 0
+        self.clear()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by the blocks, including free rows.
+        """
+        return sum(codes.nbytes + (scales.nbytes if scales is not None else 0) for codes, scales in self._blocks)
+
+    def stats(self):
+        """
+        Counters for sizing workers and spotting thrashing: many evictions with a low hit rate mean
+        max_entries is below the working set.
+        """
+        return {
+            "size": len(self._slots),
+            "max_entries": self.max_entries,
+            "nbytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _allocate(self):
+        codes = np.zeros((self.block_size, self._dimension), dtype=self.dtype)
+        scales = np.zeros(self.block_size, dtype=np.float32) if self.dtype == "int8" else None
+        first_slot = len(self._blocks) * self.block_size
+        self._blocks.append((codes, scales))
+        # Hand out the lowest rows first
+        self._free.extend(range(first_slot + self.block_size - 1, first_slot, -1))
+        return first_slot
+
+    def _read(self, slot):
+        codes, scales = self._blocks[slot // self.block_size]
+        row = slot % self.block_size
+        return dequantize_rows(codes[row], scales[row] if scales is not None else None)
+
+    def get(self, key, default=None, version=None):
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None or (version is not None and self._versions.get(key) != version):
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._slots.move_to_end(key)
+            return self._read(slot)
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, embedding):
+        self.set(key, embedding)
+
+    def set(self, key, embedding, version=None):
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        with self._lock:
+            if self._dimension is None:
+                self._dimension = len(embedding)
+            elif len(embedding) != self._dimension:
+                raise ValueError(f"Expected an embedding of dimension {self._dimension}, got {len(embedding)}.")
+
+            slot = self._slots.get(key)
+            if slot is None:
+                if self.max_entries and len(self._slots) >= self.max_entries:
+                    evicted_key, evicted_slot = self._slots.popitem(last=False)
+                    self._versions.pop(evicted_key, None)
+                    self._free.append(evicted_slot)
+                    self.evictions += 1
+                slot = self._free.pop() if self._free else self._allocate()
+                self._slots[key] = slot
+            else:
+                self._slots.move_to_end(key)
+
+            codes, scale = quantize_rows(embedding, self.dtype)
+            block_codes, block_scales = self._blocks[slot // self.block_size]
+            block_codes[slot % self.block_size] = codes
+            if block_scales is not None:
+                block_scales[slot % self.block_size] = scale
+            self._versions[key] = version
+
+    def pop(self, key, default=None):
+        with self._lock:
+            slot = self._slots.pop(key, None)
+            if slot is None:
+                return default
+            value = self._read(slot)
+            self._free.append(slot)
+            self._versions.pop(key, None)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._slots = OrderedDict()
+            self._versions = {}
+            self._blocks = []
+            self._free = []
+            self._dimension = None
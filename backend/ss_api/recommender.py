@@ -1,454 +1,1426 @@
+import hashlib
 import logging
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-from django.db.models import Q
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import lru_cache, partial
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q, Count, F
+from django.utils import timezone
 import numpy as np
 from .models import Community, User, Membership, CommunityActivity, Post, LikedPost, Likes, ActivityParticipants, \
-    UserActivity, NotInterested
-
-# Initialize the SentenceTransformer model
-model = SentenceTransformer('sentence-transformers/paraphrase-MiniLM-L12-v2')
+    UserActivity, NotInterested, StoredEmbedding, PrecomputedRecommendation, CommunityNeighbor, \
+    CommunityInteraction, PostNeighbor, RecommenderJob
+from .embedding_matrix import EmbeddingMatrix, normalize_rows
+from .interaction_matrix import InteractionMatrix
+from .item_similarity import cosine_neighbors, co_occurring_columns, embedding_neighbors
+from .ann_index import IVFIndex
+from .quantization import EmbeddingBlockCache
+from .embedding_snapshot import EmbeddingSnapshot
+from .pipeline import RecommendationPipeline, ScoredItems
+from .activity_counters import community_signal_scores, recent_searches, SEARCH_ACTIVITY_TYPES
+from . import invalidation_bus, recommender_jobs
+
+# The SentenceTransformer model is loaded on first use, see get_model()
+EMBEDDING_MODEL_NAME = settings.RECOMMENDER_EMBEDDING_MODEL
+_model = None
+_model_lock = threading.Lock()
 logger = logging.getLogger(__name__)
 
-# Cache for embeddings to optimize performance
-embedding_cache = {"users": {}, "communities": {}}
+# Cache for user embeddings, stored in RECOMMENDER_EMBEDDING_DTYPE blocks. Each type is an LRU bounded by
+# its RECOMMENDER_EMBEDDING_CACHE_SIZES quota, see embedding_cache_stats(). Catalogue embeddings are only
+# held in the scoring matrices below
+EMBEDDING_DTYPE = settings.RECOMMENDER_EMBEDDING_DTYPE
+
+
+def new_embedding_cache(cache_type):
+    return EmbeddingBlockCache(dtype=EMBEDDING_DTYPE, max_entries=settings.RECOMMENDER_EMBEDDING_CACHE_SIZES.get(
+        cache_type, settings.RECOMMENDER_EMBEDDING_CACHE_DEFAULT_SIZE
+    ))
+
+
+embedding_cache = {"users": new_embedding_cache("users")}
+
+
+def embedding_cache_stats():
+    """
+    Memory held by this process's embeddings: size, hit, miss and eviction counters of the LRU caches,
+    and row counts and bytes of the scoring matrices, by type.
+    """
+    return {
+        "caches": {cache_type: cache.stats() for cache_type, cache in embedding_cache.items()},
+        "matrices": {cache_type: matrix.stats() for cache_type, matrix in embedding_matrices.items()},
+    }
+
+# Normalised embedding matrices used for scoring, updated row by row as content changes.
+# Posts and activities are limited to RECOMMENDER_MATRIX_WINDOW_DAYS (see matrix_scope()) and, as they
+# are still the largest, also keep an approximate nearest-neighbour index.
+embedding_matrices = {
+    "communities": EmbeddingMatrix(dtype=EMBEDDING_DTYPE),
+    "posts": EmbeddingMatrix(dtype=EMBEDDING_DTYPE, index=IVFIndex(
+        n_probe=settings.RECOMMENDER_ANN_PROBES, min_train_size=settings.RECOMMENDER_ANN_MIN_SIZE
+    )),
+    "activities": EmbeddingMatrix(dtype=EMBEDDING_DTYPE, index=IVFIndex(
+        n_probe=settings.RECOMMENDER_ANN_PROBES, min_train_size=settings.RECOMMENDER_ANN_MIN_SIZE
+    )),
+}
+
+# When each matrix last dropped the rows that left its window, see evict_old_rows()
+_evicted_at = {}
+
+# Whether the shared embedding snapshots were looked for, see attach_snapshots()
+_snapshots_attached = False
+_snapshots_lock = threading.Lock()
+
+# Sparse user x community membership matrix for collaborative filtering
+community_interactions = InteractionMatrix(max_age=settings.RECOMMENDER_INTERACTIONS_MAX_AGE)
+
+
+def community_embedding_text(community):
+    return f"{community.name} {community.keyword}"
+
+
+def post_embedding_text(post):
+    return f"{post.title} {post.content}"
+
+
+def activity_embedding_text(activity):
+    return f"{activity.title} {activity.description}"
+
+
+# Model, cache key prefix and source text of every embedded entity type
+EMBEDDED_ENTITIES = {
+    "communities": (Community, "community", community_embedding_text),
+    "posts": (Post, "post", post_embedding_text),
+    "activities": (CommunityActivity, "activity", activity_embedding_text),
+}
+
+
+def get_model():
+    """
+    Return the SentenceTransformer model, loading it on first use.
+    Importing this module stays cheap, so management commands and workers that never
+    recommend anything do not pay for the model.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from sentence_transformers import SentenceTransformer
+
+                logger.info(f"Loading embedding model {EMBEDDING_MODEL_NAME}")
+                _model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    return _model
+
+
+def set_model(model, model_name=None):
+    """
+    Replace the embedding model, e.g. with a lightweight encoder in benchmarks. Stored embeddings are
+    keyed by model_name, so a different model never reads vectors written by another one.
+    """
+    global _model, EMBEDDING_MODEL_NAME
+    with _model_lock:
+        _model = model
+        if model_name is not None:
+            EMBEDDING_MODEL_NAME = model_name
+
+
+@invalidation_bus.register_reset
+def clear_state():
+    """
+    Forget every in-process embedding, matrix row and interaction, so they are rebuilt from the database.
+    """
+    for bucket in embedding_cache.values():
+        bucket.clear()
+    for matrix in embedding_matrices.values():
+        matrix.clear()
+    community_interactions.clear()
+    _evicted_at.clear()
+    _encode_query.cache_clear()
+    global _snapshots_attached
+    _snapshots_attached = False
+
+
+def warm_up():
+    """
+    Load the model and run one encode, so the first recommendation request does not pay for it.
+    Called at worker start when RECOMMENDER_WARM_UP is enabled.
+    """
+    get_model().encode(["warm up"], convert_to_numpy=True)
+
+
+def content_hash(text):
+    """
+    Hash the source text of an embedding so stored vectors can be matched against the current content.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def load_stored_embeddings(cache_type, object_ids):
+    """
+    Read the persisted embeddings of the current model for several objects in one query.
+    Returns a dict of object_id -> (content_hash, embedding). Rows written by an older model are ignored.
+    """
+    rows = StoredEmbedding.objects.filter(
+        object_type=cache_type,
+        object_id__in=object_ids,
+        model_name=EMBEDDING_MODEL_NAME
+    ).values_list('object_id', 'content_hash', 'vector')
+
+    return {
+        object_id: (text_hash, np.frombuffer(bytes(vector), dtype=np.float32))
+        for object_id, text_hash, vector in rows
+    }
+
+
+def save_stored_embeddings(cache_type, rows):
+    """
+    Persist (object_id, content_hash, embedding) rows for the current model, replacing stale ones.
+    """
+    StoredEmbedding.objects.bulk_create(
+        [
+            StoredEmbedding(
+                object_type=cache_type,
+                object_id=object_id,
+                model_name=EMBEDDING_MODEL_NAME,
+                content_hash=text_hash,
+                vector=np.asarray(embedding, dtype=np.float32).tobytes()
+            )
+            for object_id, text_hash, embedding in rows
+        ],
+        update_conflicts=True,
+        unique_fields=['object_type', 'object_id', 'model_name'],
+        update_fields=['content_hash', 'version', 'vector', 'updated_at']
+    )
+
+
+def delete_stored_embeddings(cache_type, object_id):
+    """
+    Drop every persisted embedding of an object, for all model versions.
+    """
+    StoredEmbedding.objects.filter(object_type=cache_type, object_id=object_id).delete()
+
+
+def attach_snapshots():
+    """
+    Open the latest embedding snapshot of every catalogue type (see the build_embedding_snapshot command)
+    and use it as the read-only base of the scoring matrix. Done once per process; snapshots written
+    for another model are ignored. Rows of objects changed since the snapshot was built are dropped,
+    so the next sync reads their current embedding.
+    """
+    global _snapshots_attached
+    if _snapshots_attached:
+        return
+    with _snapshots_lock:
+        if _snapshots_attached:
+            return
+        for cache_type, matrix in embedding_matrices.items():
+            try:
+                snapshot = EmbeddingSnapshot.open_current(settings.RECOMMENDER_SNAPSHOT_DIR, cache_type)
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not open the {cache_type} embedding snapshot: {e}")
+                continue
+            if snapshot is None:
+                continue
+            if snapshot.model_name != EMBEDDING_MODEL_NAME:
+                logger.warning(f"Ignoring the {cache_type} embedding snapshot built with {snapshot.model_name}.")
+                continue
+            matrix.attach_snapshot(snapshot)
+            changed_ids = snapshot_changes(cache_type, snapshot)
+            if cache_type == "communities":
+                # Community rows are re-added on demand by ensure_matrix_rows
+                matrix.remove(changed_ids)
+            else:
+                matrix.invalidate(changed_ids)
+            logger.info(f"Attached the {cache_type} embedding snapshot {snapshot.path} ({len(snapshot)} rows).")
+        _snapshots_attached = True
+
+
+def snapshot_changes(cache_type, snapshot):
+    """
+    Ids of the objects whose snapshot row may be stale: those whose stored embedding was rewritten for
+    another text since the snapshot build started, and those still queued for the run_recommender_jobs worker.
+    """
+    built_since = datetime.fromtimestamp(
+        snapshot.meta.get("started_at", snapshot.meta["built_at"]), tz=dt_timezone.utc
+    )
+    changed_ids = set(RecommenderJob.objects.filter(kind=cache_type).values_list('object_id', flat=True))
+    for object_id, text_hash in StoredEmbedding.objects.filter(
+            object_type=cache_type, model_name=EMBEDDING_MODEL_NAME, updated_at__gt=built_since
+    ).values_list('object_id', 'content_hash').iterator():
+        row = snapshot.row_of(object_id)
+        if row is None or not snapshot.hash_matches(row, text_hash):
+            changed_ids.add(object_id)
+    return list(changed_ids)
 
 
-def get_embedding(text, cache_key=None, cache_type="", force_update=False):
+def get_embeddings(texts, cache_keys, cache_type, object_ids=None, force_update=False, batch_size=None, encode=True):
     """
-    Generate or retrieve cached embeddings for text.
-    Automatically refreshes the cache if the data changes or force_update is True.
+    Generate or retrieve embeddings for a batch of texts. Returns one embedding per text, or None for empty texts.
+    In-memory entries are stamped with the hash of the text they were computed from and only reused
+    while the text is unchanged, so nothing has to be cleared when unrelated data changes. Only texts
+    with a cache key are kept there; catalogue objects are passed without one, their rows being held
+    by the scoring matrices.
+    Catalogue objects are then read from the shared snapshot when their text is unchanged; those rows
+    are not copied into the in-memory cache. Remaining misses are looked up in the persistent store with a single query, and whatever is still
+    missing is sent to the model in batches of batch_size (RECOMMENDER_ENCODE_BATCH_SIZE by default).
+    With encode=False the model is never called and those embeddings are returned as None.
     """
-    # Check if the cache exists and force_update is False
-    if cache_key and cache_type in embedding_cache:
-        cached_value = embedding_cache[cache_type].get(cache_key)
+    if object_ids is None:
+        object_ids = [None] * len(texts)
+    bucket = embedding_cache.get(cache_type)
+    if bucket is None and any(cache_keys):
+        bucket = embedding_cache.setdefault(cache_type, new_embedding_cache(cache_type))
+    embeddings = [None] * len(texts)
+
+    # Serve what we can from the in-memory cache
+    hashes = [content_hash(text) for text in texts]
+    misses = []
+    for index, (text, cache_key) in enumerate(zip(texts, cache_keys)):
+        cached_value = bucket.get(cache_key, version=hashes[index]) if cache_key else None
         if cached_value is not None and not force_update:
-            return cached_value
+            embeddings[index] = cached_value
+        elif text.strip():
+            misses.append(index)
+
+    if not misses:
+        return embeddings
+
+    # Read unchanged catalogue objects from the shared snapshot
+    matrix = embedding_matrices.get(cache_type)
+    snapshot = matrix.snapshot if matrix is not None else None
+    if snapshot is not None and not force_update:
+        for index in misses:
+            row = snapshot.row_of(object_ids[index]) if object_ids[index] is not None else None
+            if row is not None and snapshot.hash_matches(row, hashes[index]):
+                embeddings[index] = snapshot.vectors_of([row])[0]
+        misses = [index for index in misses if embeddings[index] is None]
+        if not misses:
+            return embeddings
+
+    # Look for persisted embeddings of the same content and model before encoding
+    stored = {}
+    if not force_update:
+        stored = load_stored_embeddings(
+            cache_type, [object_ids[index] for index in misses if object_ids[index] is not None]
+        )
 
-    # Generate a new embedding
-    if text.strip():
-        embedding = model.encode(text, convert_to_tensor=True).cpu().numpy()
-    else:
-        logger.error(f"Empty text provided for {cache_type}, skipping embedding generation.")
-        return None
+    to_encode = []
+    for index in misses:
+        stored_value = stored.get(object_ids[index])
+        if stored_value is not None and stored_value[0] == hashes[index]:
+            embeddings[index] = stored_value[1]
+        else:
+            to_encode.append(index)
+
+    if not encode:
+        misses = [index for index in misses if embeddings[index] is not None]
+        to_encode = []
+
+    # Encode the remaining texts in batches and persist them
+    if to_encode:
+        encoded = get_model().encode(
+            [texts[index] for index in to_encode],
+            batch_size=batch_size or settings.RECOMMENDER_ENCODE_BATCH_SIZE,
+            convert_to_numpy=True
+        )
+        for index, embedding in zip(to_encode, encoded):
+            embeddings[index] = embedding
+
+        save_stored_embeddings(cache_type, [
+            (object_ids[index], hashes[index], embeddings[index])
+            for index in to_encode if object_ids[index] is not None
+        ])
 
     # Update the cache
-    if cache_key:
-        if cache_type not in embedding_cache:
-            embedding_cache[cache_type] = {}
-        embedding_cache[cache_type][cache_key] = embedding
+    for index in misses:
+        if cache_keys[index]:
+            bucket.set(cache_keys[index], embeddings[index], version=hashes[index])
 
-    return embedding
+    return embeddings
+
+
+@lru_cache(maxsize=settings.RECOMMENDER_QUERY_CACHE_SIZE)
+def _encode_query(model_name, text):
+    return normalize_rows(get_model().encode([text], convert_to_numpy=True)[0])
+
+
+def query_embedding(text):
+    """
+    Normalised embedding of a search query, or None for an empty one. The last RECOMMENDER_QUERY_CACHE_SIZE
+    distinct queries (compared case- and whitespace-insensitively) are kept, so repeated searches skip the model.
+    """
+    text = " ".join(text.lower().split())
+    return _encode_query(EMBEDDING_MODEL_NAME, text) if text else None
 
 
 
 #validate embeddings
-def validate_embeddings(embeddings):
+def validate_embeddings(items, embeddings):
     """
-    Filter out empty or invalid embeddings.
+    Filter out empty or invalid embeddings, keeping each remaining item aligned with its embedding.
     """
+    valid_items = []
     valid_embeddings = []
-    for embedding in embeddings:
+    for item, embedding in zip(items, embeddings):
         if embedding is not None and isinstance(embedding, np.ndarray) and embedding.size > 0:
+            valid_items.append(item)
             valid_embeddings.append(embedding)
-    return valid_embeddings
+    return valid_items, valid_embeddings
 
 
-# Content-Based Filtering
-def content_based_recommendation(user_id, score_threshold=0.3):
-    user = User.objects.get(id=user_id)
-    user_memberships = Membership.objects.filter(user_id=user_id).values_list('community_id', flat=True)
-    not_interested_communities = NotInterested.objects.filter(user_id=user_id).values_list('community_id', flat=True)
-
-    # User interests from profile
-    user_interests = " ".join(user.interests)
-
-    # Get recent visits and searches - weight them more as they reflect recent interests
-    user_visits = " ".join(
-        [activity.activity_data for activity in
-         UserActivity.objects.filter(user_id=user_id, activity_type="visit").order_by('-timestamp')[:10]]
-    )
-    user_searches = " ".join(
-        [activity.activity_data for activity in
-         UserActivity.objects.filter(user_id=user_id, activity_type="search").order_by('-timestamp')[:10]]
-    )
+def embed_into_matrix(cache_type, objects, encode=True):
+    """
+    Embed the given objects (batched, through the caches) and insert them into the scoring matrix.
+    With encode=False only cached, snapshot and stored embeddings are used; the ids of the objects
+    that still need the model are returned, and queued for the run_recommender_jobs worker unless the
+    matrix already knows them as pending.
+    """
+    embedding_text = EMBEDDED_ENTITIES[cache_type][2]
+    texts = [embedding_text(obj) for obj in objects]
+    # No cache keys: the matrix row is the only in-process copy
+    embeddings = get_embeddings(texts, [None] * len(objects), cache_type, [obj.id for obj in objects], encode=encode)
+    not_ready = [
+        obj.id for obj, text, embedding in zip(objects, texts, embeddings) if embedding is None and text.strip()
+    ]
+    matrix = embedding_matrices[cache_type]
+    if not encode:
+        recommender_jobs.enqueue(
+            cache_type, [object_id for object_id in not_ready if object_id not in matrix.pending_ids], requeue=False
+        )
 
-    # Include visits and searches in the user profile but also allow these to be recommended even if they aren't in interests
-    user_text = f"{user_interests} {user_searches} {user_visits} "
+    rows, embeddings = validate_embeddings(list(zip(objects, texts)), embeddings)
+    matrix.upsert([obj.id for obj, _ in rows], embeddings, [content_hash(text) for _, text in rows])
+    return not_ready
 
-    # Generate user embedding based on all user activities
-    user_embedding = get_embedding(user_text, cache_key=f"user_{user.id}", cache_type="users")
 
-    if user_embedding is None:
-        logger.error("User embedding is empty, cannot proceed with content-based filtering.")
-        return []
+def embed_objects(cache_type, object_ids):
+    """
+    Encode the given objects where needed, persist their embeddings and add them to this process's matrix.
+    Run by the run_recommender_jobs worker; web processes read the stored rows on their next sync.
+    """
+    model_class = EMBEDDED_ENTITIES[cache_type][0]
+    embed_into_matrix(cache_type, list(model_class.objects.filter(id__in=object_ids)))
+    if cache_type == "posts":
+        update_related_posts(object_ids)
 
-    communities = list(Community.objects.exclude(id__in=user_memberships).exclude(id__in=not_interested_communities))
 
-    # Generate embeddings for each community
-    community_embeddings = [
-        get_embedding(
-            f"{community.name} {community.keyword}",
-            cache_key=f"community_{community.id}",
-            cache_type="communities"
-        )
-        for community in communities
-    ]
-    community_embeddings = validate_embeddings(community_embeddings)
+def enqueue_embedding(cache_type, object_id):
+    """
+    Have the object embedded by the run_recommender_jobs worker. The job is part of the current
+    transaction, so it is only seen once the save commits.
+    """
+    recommender_jobs.enqueue(cache_type, [object_id])
 
-    if not community_embeddings:
-        logger.error("No valid community embeddings available.")
-        return []
 
-    # Calculate similarity between the user and the communities
-    similarities = cosine_similarity([user_embedding], community_embeddings)[0]
+def refresh_embedding(cache_type, obj):
+    """
+    Drop the cached embedding and matrix row of a saved object, but only when its source text no longer
+    matches the version the embedding was computed from. Returns True when something was dropped.
+    """
+    embedding_text = EMBEDDED_ENTITIES[cache_type][2]
+    return drop_stale_embedding(cache_type, obj.id, content_hash(embedding_text(obj)))
 
-    recommended_communities = []
-    for community, similarity in zip(communities, similarities):
-        # If similarity score is above threshold, recommend the community
-        if similarity >= score_threshold:
-            combined_text = f"{community.name} {community.keyword}".lower()
 
-            # Match user interests, but also recommend based on visits and searches
-            matching_interests = [interest for interest in user.interests if interest.lower() in combined_text]
+@invalidation_bus.register("embedding")
+def drop_stale_embedding(cache_type, object_id, text_hash):
+    """
+    refresh_embedding given the hash of the object's current text; applies the saves of other processes.
+    """
+    matrix = embedding_matrices[cache_type]
+    if object_id not in matrix:
+        if cache_type != "communities":
+            # E.g. an activity moved back into the matrix window; the next sync checks
+            matrix.pending_ids.add(object_id)
+        return False
+    if matrix.hash_matches(object_id, text_hash):
+        return False
+
+    if cache_type == "communities":
+        # Community rows are re-added on demand by ensure_matrix_rows
+        matrix.remove([object_id])
+    else:
+        matrix.invalidate([object_id])
+    return True
 
-            # Reason for recommendation (matches interests or based on recent activity)
-            if matching_interests:
-                reason = f"Matches your interest: {', '.join(matching_interests)}"
-            else:
-                reason = "Recommended based on your recent searches and visits."
 
-            recommended_communities.append((community, similarity, reason))
+@invalidation_bus.register("embedding_deleted")
+def forget_embedding(cache_type, object_id):
+    """
+    Drop the cached embedding and matrix row of a deleted user, community, post or activity.
+    """
+    if cache_type == "users":
+        embedding_cache["users"].pop(f"user_{object_id}", None)
+    else:
+        embedding_matrices[cache_type].remove([object_id])
 
-    # Sort the recommendations by similarity score
-    recommended_communities = sorted(recommended_communities, key=lambda x: x[1], reverse=True)
-    return recommended_communities
 
+@invalidation_bus.register("membership")
+def apply_membership_change(user_id, community_id, value):
+    """
+    Apply a single Membership change to the in-memory user x community matrix.
+    """
+    if community_interactions.is_stale:
+        # The next recommendation request reloads the whole matrix anyway
+        return
+    community_interactions.set(user_id, community_id, value)
 
-def collaborative_filtering(user_id, score_threshold=0.25):
-    user_memberships = Membership.objects.filter(user_id=user_id).values_list('community_id', flat=True)
-    not_interested_communities = NotInterested.objects.filter(user_id=user_id).values_list('community_id', flat=True)
 
-    similar_users = Membership.objects.filter(
-        community_id__in=user_memberships
-    ).exclude(user_id=user_id).values_list('user_id', flat=True).distinct()
+def ensure_matrix_rows(cache_type, object_ids):
+    """
+    Add the given objects that have no row in the scoring matrix yet. Objects that were never embedded
+    are queued for the run_recommender_jobs worker and left out until their embedding is stored.
+    """
+    attach_snapshots()
+    matrix = embedding_matrices[cache_type]
+    missing = matrix.missing(object_ids)
+    if missing:
+        model_class = EMBEDDED_ENTITIES[cache_type][0]
+        embed_into_matrix(cache_type, list(model_class.objects.filter(id__in=missing)), encode=False)
+    return matrix
 
-    similar_user_memberships = Membership.objects.filter(
-        user_id__in=similar_users
-    ).values_list('community_id', flat=True).distinct()
 
-    communities = Community.objects.filter(id__in=similar_user_memberships).exclude(id__in=user_memberships).exclude(id__in=not_interested_communities)
+def sync_matrix_rows(cache_type, chunk_size=1000):
+    """
+    Bring the whole scoring matrix of an entity type up to date: add the objects created since the
+    last sync and those invalidated by a save. Usually a single indexed query returning nothing.
+    Nothing is encoded here: objects whose embedding is not stored yet are queued for the
+    run_recommender_jobs worker and stay pending until a later sync finds it.
+    Only the objects of matrix_scope() are added, and rows that left it are evicted from time to time.
+    """
+    attach_snapshots()
+    matrix = embedding_matrices[cache_type]
+    pending_ids = set(matrix.pending_ids)
+    highest_id = matrix.synced_up_to
+    not_ready = []
+
+    batch = []
+    for obj in matrix_scope(cache_type).filter(Q(id__gt=highest_id) | Q(id__in=pending_ids)).order_by('id').iterator(
+            chunk_size=chunk_size):
+        batch.append(obj)
+        highest_id = max(highest_id, obj.id)
+        if len(batch) == chunk_size:
+            not_ready.extend(embed_into_matrix(cache_type, batch, encode=False))
+            batch = []
+    if batch:
+        not_ready.extend(embed_into_matrix(cache_type, batch, encode=False))
+
+    matrix.synced_up_to = highest_id
+    # Whatever is still pending was deleted or has no text to embed
+    matrix.pending_ids.difference_update(pending_ids)
+    matrix.pending_ids.update(not_ready)
+    evict_old_rows(cache_type)
+    return matrix
+
+
+def matrix_scope(cache_type):
+    """
+    The objects the scoring matrix of a type holds: posts created and activities ended within
+    RECOMMENDER_MATRIX_WINDOW_DAYS, and every community.
+    """
+    queryset = EMBEDDED_ENTITIES[cache_type][0].objects.all()
+    cutoff = timezone.now() - timedelta(days=settings.RECOMMENDER_MATRIX_WINDOW_DAYS)
+    if cache_type == "posts":
+        return queryset.filter(created_at__gte=cutoff)
+    if cache_type == "activities":
+        return queryset.filter(endDate__gte=cutoff)
+    return queryset
 
-    if not communities.exists():
-        logger.warning("No communities found for collaborative filtering.")
-        return []
 
-    community_popularity = {
-        community.id: Membership.objects.filter(community_id=community.id).count()
-        for community in communities
+def evict_old_rows(cache_type):
+    """
+    Every RECOMMENDER_MATRIX_EVICT_INTERVAL seconds, drop the matrix rows (snapshot rows included) of
+    objects that left matrix_scope(), so the matrices of growing types stay bounded. Returns the number
+    of rows dropped.
+    """
+    if cache_type == "communities":
+        return 0
+    now = timezone.now()
+    evicted_at = _evicted_at.get(cache_type)
+    if evicted_at is not None and (now - evicted_at).total_seconds() < settings.RECOMMENDER_MATRIX_EVICT_INTERVAL:
+        return 0
+    _evicted_at[cache_type] = now
+
+    matrix = embedding_matrices[cache_type]
+    in_scope = np.fromiter(matrix_scope(cache_type).values_list('id', flat=True).iterator(), dtype=np.int64)
+    ids = matrix.ids
+    old_ids = ids[~np.isin(ids, in_scope)].tolist()
+    matrix.remove(old_ids)
+    if old_ids:
+        logger.info(f"Evicted {len(old_ids)} {cache_type} rows older than the matrix window.")
+    return len(old_ids)
+
+
+def activity_embeddings(activities):
+    """
+    Embed (activity_type, activity_data) visit and search events: a visit is represented by the embedding
+    of the visited community, a search by the embedding of the search text. Returns one embedding (or None)
+    per event.
+    """
+    visited_names = {activity_data for activity_type, activity_data in activities if activity_type == "visit"}
+    communities = {}
+    for community in Community.objects.filter(name__in=visited_names).order_by('-id'):
+        communities[community.name] = community
+    community_list = list(communities.values())
+    community_embeddings = dict(zip(
+        [community.name for community in community_list],
+        get_embeddings(
+            [community_embedding_text(community) for community in community_list],
+            [None] * len(community_list),
+            "communities",
+            [community.id for community in community_list],
+            encode=False
+        )
+    ))
+
+    search_embeddings = {
+        activity_data: query_embedding(activity_data)
+        for activity_type, activity_data in activities if activity_type in SEARCH_ACTIVITY_TYPES
     }
 
-    visit_score_adjustment = {}
-    search_score_adjustment = {}
+    return [
+        community_embeddings.get(activity_data) if activity_type == "visit" else search_embeddings.get(activity_data)
+        for activity_type, activity_data in activities
+    ]
 
-    for community in communities:
-        visit_score = UserActivity.objects.filter(
-            user_id=user_id, activity_type='visit', activity_data=community.name
-        ).count()
-        search_score = UserActivity.objects.filter(
-            user_id=user_id, activity_type='search', activity_data=community.name
-        ).count()
 
-        visit_score_adjustment[community.id] = visit_score * 0.5
-        search_score_adjustment[community.id] = search_score * 0.3
+def fold_activity_embedding(profile, embedding):
+    """
+    Exponentially decayed average: every new visit or search keeps RECOMMENDER_PROFILE_DECAY of the profile.
+    """
+    embedding = normalize_rows(embedding)
+    if profile is None:
+        return embedding
+    decay = settings.RECOMMENDER_PROFILE_DECAY
+    return decay * normalize_rows(profile) + (1 - decay) * embedding
 
-    recommended_communities = []
-    for community in communities:
-        popularity_score = community_popularity.get(community.id, 0) + visit_score_adjustment.get(community.id, 0) + search_score_adjustment.get(community.id, 0)
-        if popularity_score >= score_threshold * len(similar_users):
-            reason = "Popular among users like you"
-            recommended_communities.append((community, popularity_score, reason))
 
-    recommended_communities = sorted(recommended_communities, key=lambda x: x[1], reverse=True)
-    return recommended_communities
+def load_activity_profile(user_id, lock=False):
+    """
+    The persisted activity profile of a user as (version, embedding), or None. With lock, the row is locked
+    until the end of the current transaction.
+    """
+    rows = StoredEmbedding.objects.filter(
+        object_type="user_activity", object_id=user_id, model_name=EMBEDDING_MODEL_NAME
+    )
+    if lock:
+        rows = rows.select_for_update()
+    row = rows.values_list('version', 'vector').first()
+    return (row[0], np.frombuffer(bytes(row[1]), dtype=np.float32)) if row is not None else None
+
+
+def save_activity_profile(user_id, version, profile):
+    StoredEmbedding.objects.update_or_create(
+        object_type="user_activity",
+        object_id=user_id,
+        model_name=EMBEDDING_MODEL_NAME,
+        defaults={
+            "content_hash": "",
+            "version": version,
+            "vector": np.asarray(profile, dtype=np.float32).tobytes()
+        }
+    )
 
 
-def normalize_scores(scores):
+def rebuild_activity_embedding(user_id):
     """
-    Normalize a list of scores to the range [0, 1].
+    Fold the user's last RECOMMENDER_PROFILE_HISTORY community visits and searches, read from the activity
+    counters, into a fresh activity profile and persist it, as of the user's last UserActivity.
+    Only needed once per user; afterwards new activity is folded in by update_activity_profiles.
     """
-    if not scores:
-        return []
-    min_score = min(scores)
-    max_score = max(scores)
-    if max_score == min_score:
-        # Avoid division by zero
-        return [1 for _ in scores]
-    return [(score - min_score) / (max_score - min_score) for score in scores]
+    # Read first: the counters are updated before the UserActivity row, so they include everything up to it
+    version = UserActivity.objects.filter(user_id=user_id).order_by('-id').values_list('id', flat=True).first()
+    history = settings.RECOMMENDER_PROFILE_HISTORY
+    events = [
+        (visited_at, "visit", name) for name, visited_at in CommunityInteraction.objects.filter(
+            user_id=user_id, last_visited_at__isnull=False
+        ).order_by('-last_visited_at').values_list('community__name', 'last_visited_at')[:history]
+    ]
+    events.extend((searched_at, "search", query) for query, searched_at in recent_searches(user_id)[:history])
+    events = sorted(events, key=lambda event: event[0])[-history:]
+
+    profile = None
+    for embedding in activity_embeddings([event[1:] for event in events]):
+        if embedding is not None:
+            profile = fold_activity_embedding(profile, embedding)
+    if profile is not None:
+        save_activity_profile(user_id, version or 0, profile)
+    return profile
 
 
-def get_hybrid_recommendations(user_id, cbf_weight=0.6, cf_weight=0.4, score_threshold=0.2):
+def update_activity_profiles(user_ids):
     """
-    Combine content-based and collaborative filtering recommendations, excluding communities the user is already a member of.
-    Normalize the scores from both methods and filter by a similarity/popularity threshold.
+    Fold the visits and searches written since each user's persisted activity profile into it, building the
+    profile first when there is none. Run by the run_recommender_jobs worker for the "user_activity" jobs
+    queued by the UserActivity signal; the profile row is locked while it is folded, so no update is lost.
     """
-    # Get recommendations
-    cbf_recommendations = content_based_recommendation(user_id, score_threshold=score_threshold)
-    cf_recommendations = collaborative_filtering(user_id, score_threshold=score_threshold)
+    for user_id in user_ids:
+        with transaction.atomic():
+            stored = load_activity_profile(user_id, lock=True)
+            if stored is None:
+                rebuild_activity_embedding(user_id)
+                continue
+
+            version, profile = stored
+            activities = list(UserActivity.objects.filter(
+                user_id=user_id, id__gt=version, activity_type__in=("visit", *SEARCH_ACTIVITY_TYPES)
+            ).order_by('-id').values_list('id', 'activity_type', 'activity_data')[:settings.RECOMMENDER_PROFILE_HISTORY])
+            if not activities:
+                continue
+            activities.reverse()
+            for embedding in activity_embeddings([activity[1:] for activity in activities]):
+                if embedding is not None:
+                    profile = fold_activity_embedding(profile, embedding)
+            save_activity_profile(user_id, activities[-1][0], profile)
+
+
+def get_user_profile_embedding(user):
+    """
+    Blend the embedding of the user's interests with the decayed average of their recent visits and
+    searches (RECOMMENDER_PROFILE_ACTIVITY_WEIGHT). Both parts are only read here; they are computed
+    by the run_recommender_jobs worker as interests and activity are saved.
+    """
+    interest_embedding = get_interest_embedding(user)
 
-    # Extract scores for normalization
-    cbf_scores = [score for _, score, _ in cbf_recommendations]
-    cf_scores = [score for _, score, _ in cf_recommendations]
+    # Read from the database on every call: the worker may have folded in a new activity
+    stored = load_activity_profile(user.id)
+    activity_embedding = stored[1] if stored is not None else None
 
-    # Normalize the scores within their own range
-    normalized_cbf_scores = normalize_scores(cbf_scores)
-    normalized_cf_scores = normalize_scores(cf_scores)
+    if interest_embedding is None or activity_embedding is None:
+        return interest_embedding if activity_embedding is None else activity_embedding
+    weight = settings.RECOMMENDER_PROFILE_ACTIVITY_WEIGHT
+    return (1 - weight) * normalize_rows(interest_embedding) + weight * normalize_rows(activity_embedding)
 
-    # Map normalized scores back to their respective recommendations
-    normalized_cbf = [
-        (community, score, reason)
-        for (community, _, reason), score in zip(cbf_recommendations, normalized_cbf_scores)
-    ]
-    normalized_cf = [
-        (community, score, reason)
-        for (community, _, reason), score in zip(cf_recommendations, normalized_cf_scores)
-    ]
 
-    # Combine the normalized scores
-    combined_scores = {}
-    combined_communities = {}
-
-    for community, score, reason in normalized_cbf:
-        if community.id not in combined_scores:
-            combined_scores[community.id] = 0
-            combined_communities[community.id] = (community, reason)
-        combined_scores[community.id] += score * cbf_weight
-
-    for community, score, reason in normalized_cf:
-        if community.id not in combined_scores:
-            combined_scores[community.id] = 0
-            combined_communities[community.id] = (community, reason)
-        combined_scores[community.id] += score * cf_weight
-
-    # Filter by final score threshold
-    filtered_recommendations = [
-        (combined_communities[community_id][0], score, combined_communities[community_id][1])
-        for community_id, score in combined_scores.items() if score >= score_threshold
-    ]
+def interest_text(user):
+    return " ".join(user.interests or [])
 
-    # Sort combined recommendations
-    sorted_recommendations = sorted(filtered_recommendations, key=lambda x: x[1], reverse=True)
 
-    return sorted_recommendations
+def get_interest_embedding(user):
+    """
+    Embedding of the user's profile interests, shared by every recommender. Never encoded here:
+    when the current interests have no stored embedding, the user is queued for the run_recommender_jobs
+    worker and None is returned meanwhile.
+    """
+    text = interest_text(user)
+    embedding = get_embeddings([text], [f"user_{user.id}"], "users", [user.id], encode=False)[0]
+    if embedding is None and text.strip():
+        recommender_jobs.enqueue("users", [user.id], requeue=False)
+    return embedding
 
 
+def embed_interests(user_ids):
+    """
+    Encode and persist the interest embeddings of the given users where their interests changed.
+    Their recommendation lists, cached or precomputed while the embedding was missing, are dropped.
+    """
+    users = list(User.objects.filter(id__in=user_ids))
+    stored = load_stored_embeddings("users", [user.id for user in users])
+    stored_hashes = {user_id: text_hash for user_id, (text_hash, _) in stored.items()}
+    # Only the users whose current interests have no stored embedding are encoded
+    users = [
+        user for user in users
+        if interest_text(user).strip() and stored_hashes.get(user.id) != content_hash(interest_text(user))
+    ]
+    get_embeddings(
+        [interest_text(user) for user in users], [f"user_{user.id}" for user in users], "users",
+        [user.id for user in users], force_update=True
+    )
+    for user in users:
+        invalidate_recommendations(user.id)
 
-def log_hybrid_recommendations(user_id):
-    recommendations = get_hybrid_recommendations(user_id)
-    logger.info(f"Hybrid Recommendations for User {user_id}: {recommendations}")
-    return recommendations
+
+# Content-Based Filtering
+def community_candidates(context):
+    return np.fromiter(Community.objects.values_list('id', flat=True).iterator(), dtype=np.int64)
 
 
+def community_exclusions(context):
+    not_interested_communities = NotInterested.objects.filter(
+        user_id=context.user_id, community__isnull=False
+    ).values_list('community_id', flat=True)
+    return context.memberships | set(not_interested_communities)
 
-def content_based_post_recommendation(user_id, score_threshold=0.3):
-    user = User.objects.get(id=user_id)
-    user_interests = " ".join(user.interests)
-    user_embedding = get_embedding(user_interests, cache_key=f"user_{user.id}", cache_type="users")
+
+def community_content_scores(context):
+    user = context.user
+
+    # Interests blended with recent visits and searches, so communities can be recommended
+    # even if they aren't in the interests
+    user_embedding = get_user_profile_embedding(user)
 
     if user_embedding is None:
         logger.error("User embedding is empty, cannot proceed with content-based filtering.")
-        return []
+        return ScoredItems()
 
-    # Filter posts from public communities
-    public_communities = Community.objects.filter(privacy="public")
-    posts = Post.objects.filter(posted_in__in=public_communities).distinct()
-    post_embeddings = [
-        get_embedding(
-            f"{post.title} {post.content}",
-            cache_key=f"post_{post.id}",
-            cache_type="posts"
+    # Score the user against the candidate rows of the community matrix and keep the best ones
+    candidate_ids = context.candidate_ids.tolist()
+    matrix = ensure_matrix_rows("communities", candidate_ids)
+    community_ids, similarities = matrix.top_k(
+        user_embedding, settings.RECOMMENDER_TOP_K, candidate_ids, context.score_threshold
+    )
+    communities = Community.objects.in_bulk(community_ids.tolist())
+    context.objects.update(communities)
+
+    ids, scores, reasons = [], [], {}
+    for community_id, similarity in zip(community_ids.tolist(), similarities.tolist()):
+        community = communities.get(community_id)
+        if community is None:
+            continue
+        combined_text = community_embedding_text(community).lower()
+
+        # Match user interests, but also recommend based on visits and searches
+        matching_interests = [interest for interest in user.interests or [] if interest.lower() in combined_text]
+
+        # Reason for recommendation (matches interests or based on recent activity)
+        if matching_interests:
+            reasons[community_id] = f"Matches your interest: {', '.join(matching_interests)}"
+        else:
+            reasons[community_id] = "Recommended based on your recent searches and visits."
+        ids.append(community_id)
+        scores.append(similarity)
+
+    return ScoredItems(ids, scores, reasons)
+
+
+def get_community_interactions():
+    """
+    Return the user x community membership matrix, loading it in bulk when it is missing or older
+    than RECOMMENDER_INTERACTIONS_MAX_AGE. Membership signals keep it up to date in between.
+    """
+    if community_interactions.is_stale:
+        community_interactions.load(Membership.objects.values_list('user_id', 'community_id').iterator())
+    return community_interactions
+
+
+def refresh_community_neighbors(community_ids=None):
+    """
+    Recompute the CommunityNeighbor rows of the given communities (all of them when None) from the
+    co-membership matrix, keeping the RECOMMENDER_COMMUNITY_NEIGHBORS most similar communities of each.
+    Concurrent refreshes are serialised, and rows another refresh wrote meanwhile are overwritten, not
+    duplicated. Returns the number of rows written.
+    """
+    interactions = get_community_interactions()
+    item_ids = interactions.item_ids
+    columns = None
+    if community_ids is not None:
+        columns = [interactions.column_of(community_id) for community_id in community_ids]
+        columns = [column for column in columns if column is not None]
+
+    neighbor_lists = [
+        (int(item_ids[column]), item_ids[neighbor_columns].tolist(), scores.tolist())
+        for column, neighbor_columns, scores in cosine_neighbors(
+            interactions.matrix, columns, settings.RECOMMENDER_COMMUNITY_NEIGHBORS
         )
-        for post in posts
     ]
-    post_embeddings = validate_embeddings(post_embeddings)
+    # Skip communities deleted since the matrix was loaded
+    referenced = set()
+    for community_id, neighbor_ids, _ in neighbor_lists:
+        referenced.add(community_id)
+        referenced.update(neighbor_ids)
+    existing = set(Community.objects.filter(id__in=referenced).values_list('id', flat=True))
+    rows = [
+        CommunityNeighbor(community_id=community_id, neighbor_id=neighbor_id, score=score)
+        for community_id, neighbor_ids, scores in neighbor_lists if community_id in existing
+        for neighbor_id, score in zip(neighbor_ids, scores) if neighbor_id in existing
+    ]
 
-    if not post_embeddings:
-        logger.error("No valid post embeddings available.")
-        return []
+    with transaction.atomic():
+        recommender_jobs.lock("community_neighbors")
+        stale_rows = CommunityNeighbor.objects.all()
+        if community_ids is not None:
+            stale_rows = stale_rows.filter(community_id__in=community_ids)
+        stale_rows.delete()
+        CommunityNeighbor.objects.bulk_create(
+            rows,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['community', 'neighbor'],
+            update_fields=['score']
+        )
+    return len(rows)
 
-    similarities = cosine_similarity([user_embedding], post_embeddings)[0]
-    recommended_posts = [
-        (post, similarity)
-        for post, similarity in zip(posts, similarities)
-        if similarity >= score_threshold
-    ]
 
-    recommended_posts = sorted(recommended_posts, key=lambda x: x[1], reverse=True)
-    return recommended_posts  # Returns (Post, similarity_score)
+def refresh_neighbors_around(community_ids):
+    """
+    Refresh, in one pass, the neighbour lists membership changes of the given communities can affect:
+    their own, those of the communities sharing a member with them, and those that listed them before.
+    Run by the run_recommender_jobs worker for the "community_neighbors" jobs queued by the Membership signals.
+    """
+    interactions = get_community_interactions()
+    # The job can be claimed before the membership message of the invalidation bus reaches this process
+    interactions.reload_items(
+        community_ids, Membership.objects.filter(community_id__in=community_ids).values_list('user_id', 'community_id')
+    )
+    affected = set(
+        CommunityNeighbor.objects.filter(neighbor_id__in=community_ids).values_list('community_id', flat=True)
+    )
+    affected.update(community_ids)
+    matrix = interactions.matrix
+    for community_id in community_ids:
+        column = interactions.column_of(community_id)
+        if column is not None:
+            affected.update(interactions.item_ids[co_occurring_columns(matrix, column)].tolist())
+    refresh_community_neighbors(affected)
+
+
+def community_collaborative_scores(context):
+    # Merge the precomputed neighbour lists of the joined communities: a candidate scores the sum of its
+    # similarities to them, and is explained by the joined community it is most similar to
+    neighbors = CommunityNeighbor.objects.filter(
+        community_id__in=context.memberships
+    ).exclude(
+        neighbor_id__in=context.excluded_ids
+    ).values_list('neighbor_id', 'score', 'community__name')
+
+    scores, reasons, best = {}, {}, {}
+    for neighbor_id, score, community_name in neighbors:
+        scores[neighbor_id] = scores.get(neighbor_id, 0) + score
+        if score > best.get(neighbor_id, 0):
+            best[neighbor_id] = score
+            reasons[neighbor_id] = f"Members of {community_name} also joined this community"
+
+    # Communities the user keeps visiting or finding in searches, from the decayed activity counters
+    for community_id, (visit_score, search_score) in community_signal_scores(context.user_id).items():
+        if community_id in context.excluded_ids:
+            continue
+        activity_score = visit_score * 0.5 + search_score * 0.3
+        if activity_score > 0:
+            scores[community_id] = scores.get(community_id, 0) + activity_score
+            reasons.setdefault(community_id, "Recommended based on your recent searches and visits.")
 
+    if not scores:
+        logger.warning("No communities found for collaborative filtering.")
+        return ScoredItems()
+    return ScoredItems(list(scores), list(scores.values()), reasons)
 
-def collaborative_post_recommendation(user_id, score_threshold=0.3):
-    user_memberships = Membership.objects.filter(user_id=user_id).values_list('community_id', flat=True)
-    similar_users = Membership.objects.filter(
-        community_id__in=user_memberships
-    ).exclude(user_id=user_id).values_list('user_id', flat=True).distinct()
 
-    posts = Post.objects.filter(
-        created_by__in=similar_users,
-        posted_in__privacy="public"
-    ).exclude(
-        created_by=user_id
-    ).distinct()
+def retrieve_content_scores(context, cache_type):
+    """
+    Content scoring shared by posts and activities: retrieve the candidates nearest to the user's interests,
+    from the ANN index when the candidate window is large, and keep the best RECOMMENDER_TOP_K.
+    """
+    user_embedding = get_interest_embedding(context.user)
 
-    if not posts.exists():
-        logger.warning("No posts found for collaborative filtering.")
-        return []
+    if user_embedding is None:
+        logger.error("User embedding is empty, cannot proceed with content-based filtering.")
+        return ScoredItems()
 
-    popularity_scores = [
-        (post, LikedPost.objects.filter(post=post).count())
-        for post in posts
-    ]
+    matrix = sync_matrix_rows(cache_type)
+    object_ids, similarities = matrix.search(
+        user_embedding, settings.RECOMMENDER_TOP_K, context.score_threshold, context.candidate_ids.tolist()
+    )
+    return ScoredItems(object_ids, similarities)
 
-    recommended_posts = [
-        (post, score)
-        for post, score in popularity_scores
-        if score >= score_threshold
-    ]
 
-    recommended_posts = sorted(recommended_posts, key=lambda x: x[1], reverse=True)
-    return recommended_posts  # Returns (Post, popularity_score)
+def recency_weights(ages):
+    """
+    Score multipliers for items the given numbers of seconds old: 1 - RECOMMENDER_RECENCY_WEIGHT for a
+    very old item, rising to 1 for a new one with a half-life of RECOMMENDER_RECENCY_HALF_LIFE_DAYS.
+    """
+    ages = np.maximum(np.asarray(ages, dtype=np.float64), 0)
+    decay = 0.5 ** (ages / (settings.RECOMMENDER_RECENCY_HALF_LIFE_DAYS * 86400))
+    weight = settings.RECOMMENDER_RECENCY_WEIGHT
+    return 1 - weight + weight * decay
 
 
-def hybrid_post_recommendation(user_id, cbf_weight=0.6, cf_weight=0.4, score_threshold=0.3):
+def similar_users(context):
     """
-    Combine content-based and collaborative filtering recommendations for posts.
+    Subquery of the other users sharing a community with the user.
     """
-    cbf_recommendations = content_based_post_recommendation(user_id, score_threshold=score_threshold)
-    cf_recommendations = collaborative_post_recommendation(user_id, score_threshold=score_threshold)
+    return Membership.objects.filter(
+        community_id__in=context.memberships
+    ).exclude(user_id=context.user_id).values_list('user_id', flat=True).distinct()
 
-    cbf_scores = [score for _, score in cbf_recommendations]
-    cf_scores = [score for _, score in cf_recommendations]
 
-    normalized_cbf_scores = normalize_scores(cbf_scores)
-    normalized_cf_scores = normalize_scores(cf_scores)
+def recent_posts():
+    """
+    Public posts created within RECOMMENDER_POST_WINDOW_DAYS, the only posts that get recommended.
+    """
+    return Post.objects.filter(
+        posted_in__privacy="public",
+        created_at__gte=timezone.now() - timedelta(days=settings.RECOMMENDER_POST_WINDOW_DAYS)
+    )
 
-    combined_scores = {}
-    combined_posts = {}
 
-    for post, score in zip([post for post, _ in cbf_recommendations], normalized_cbf_scores):
-        combined_scores[post.id] = score * cbf_weight
-        combined_posts[post.id] = post
+def post_candidates(context):
+    # Weighted by recency, fetched with the ids
+    now = timezone.now()
+    rows = list(recent_posts().values_list('id', 'created_at'))
+    return ScoredItems(
+        [post_id for post_id, _ in rows],
+        recency_weights([(now - created_at).total_seconds() for _, created_at in rows])
+    )
 
-    for post, score in zip([post for post, _ in cf_recommendations], normalized_cf_scores):
-        combined_scores[post.id] = combined_scores.get(post.id, 0) + score * cf_weight
-        combined_posts[post.id] = post
 
-    filtered_recommendations = [
-        (combined_posts[post_id], score)
-        for post_id, score in combined_scores.items() if score >= score_threshold
-    ]
+def post_exclusions(context):
+    return NotInterested.objects.filter(user_id=context.user_id, post__isnull=False).values_list('post_id', flat=True)
 
-    sorted_recommendations = sorted(filtered_recommendations, key=lambda x: x[1], reverse=True)
-    return sorted_recommendations  # Returns (Post, hybrid_score)
 
+def post_content_scores(context):
+    return retrieve_content_scores(context, "posts")
 
-def content_based_activity_recommendation(user_id, score_threshold=0.3):
-    user = User.objects.get(id=user_id)
-    user_interests = " ".join(user.interests)
-    user_embedding = get_embedding(user_interests, cache_key=f"user_{user.id}", cache_type="users")
 
-    if user_embedding is None:
-        logger.error("User embedding is empty, cannot proceed with content-based filtering.")
-        return []
+def post_collaborative_scores(context):
+    # Recent public posts by similar users, scored by their number of likes in one aggregate query
+    popularity_scores = list(
+        recent_posts().filter(
+            created_by__in=similar_users(context)
+        ).exclude(
+            created_by=context.user_id
+        ).annotate(
+            like_count=Count('liked_by', distinct=True)
+        ).filter(
+            like_count__gte=context.score_threshold
+        ).values_list('id', 'like_count')
+    )
+
+    if not popularity_scores:
+        logger.warning("No posts found for collaborative filtering.")
+        return ScoredItems()
+    return ScoredItems(*zip(*popularity_scores))
+
 
-    # Filter activities from public communities
-    public_communities = Community.objects.filter(privacy="public")
-    activities = CommunityActivity.objects.filter(community__in=public_communities).distinct()
-    activity_embeddings = [
-        get_embedding(
-            f"{activity.title} {activity.description}",
-            cache_key=f"activity_{activity.id}",
-            cache_type="activities"
+def refresh_related_posts(chunk_size=256):
+    """
+    Rebuild the PostNeighbor table: for every approved post, the RECOMMENDER_RELATED_POSTS approved posts
+    closest to it by embedding, from an exact scan. Every approved post is loaded into a matrix of its own,
+    beyond the window of the shared posts matrix; those without a stored embedding are encoded, chunk_size
+    at a time. Returns the number of rows written.
+    """
+    matrix = EmbeddingMatrix(dtype=EMBEDDING_DTYPE)
+    approved_ids = set()
+    batch = []
+    for post in Post.objects.filter(status="approved").order_by('id').iterator(chunk_size=chunk_size):
+        batch.append(post)
+        approved_ids.add(post.id)
+        if len(batch) == chunk_size:
+            load_posts_into_matrix(matrix, batch)
+            batch = []
+    if batch:
+        load_posts_into_matrix(matrix, batch)
+
+    ids, vectors = matrix.rows()
+    rows = [
+        PostNeighbor(post_id=post_id, neighbor_id=neighbor_id, score=score)
+        for post_id, neighbor_ids, scores in embedding_neighbors(
+            ids, vectors, settings.RECOMMENDER_RELATED_POSTS, chunk_size
         )
-        for activity in activities
+        for neighbor_id, score in zip(neighbor_ids.tolist(), scores.tolist())
     ]
-    activity_embeddings = validate_embeddings(activity_embeddings)
 
-    if not activity_embeddings:
-        logger.error("No valid activity embeddings available.")
-        return []
+    with transaction.atomic():
+        PostNeighbor.objects.all().delete()
+        # Skip posts deleted or hidden since they were loaded
+        existing = set(Post.objects.filter(id__in=approved_ids).values_list('id', flat=True))
+        rows = [row for row in rows if row.post_id in existing and row.neighbor_id in existing]
+        PostNeighbor.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
 
-    similarities = cosine_similarity([user_embedding], activity_embeddings)[0]
-    recommended_activities = [
-        (activity, similarity)
-        for activity, similarity in zip(activities, similarities)
-        if similarity >= score_threshold
-    ]
 
-    recommended_activities = sorted(recommended_activities, key=lambda x: x[1], reverse=True)
-    return recommended_activities  # Returns (Activity, similarity_score)
+def load_posts_into_matrix(matrix, posts):
+    texts = [post_embedding_text(post) for post in posts]
+    posts, embeddings = validate_embeddings(
+        posts, get_embeddings(texts, [None] * len(posts), "posts", [post.id for post in posts])
+    )
+    matrix.upsert([post.id for post in posts], embeddings)
 
 
-def collaborative_activity_recommendation(user_id, score_threshold=0.3):
-    user_memberships = Membership.objects.filter(user_id=user_id).values_list('community_id', flat=True)
-    similar_users = Membership.objects.filter(
-        community_id__in=user_memberships
-    ).exclude(user_id=user_id).values_list('user_id', flat=True).distinct()
+def update_related_posts(post_ids):
+    """
+    Maintain the PostNeighbor table after the given posts were created, edited or moderated: the lists of
+    the posts and of the posts that listed them are recomputed with one (approximate) search of the posts
+    matrix each, so among the posts of its window (RECOMMENDER_MATRIX_WINDOW_DAYS), and the posts are
+    inserted into the lists of the posts they are now closer to than their weakest neighbour. Lists of
+    posts outside the window only lose the changed posts, as do lists that held a deleted post; both are
+    refilled by the next full rebuild (see the build_related_posts command).
+    """
+    post_ids = set(post_ids)
+    size = settings.RECOMMENDER_RELATED_POSTS
+    matrix = sync_matrix_rows("posts")
+    listed_by = set(PostNeighbor.objects.filter(neighbor_id__in=post_ids).values_list('post_id', flat=True))
+    approved_ids = set(Post.objects.filter(
+        id__in=listed_by.union(post_ids), status="approved"
+    ).values_list('id', flat=True))
+    neighbor_lists = {}
+    for post_id in approved_ids:
+        vector = matrix.vector_of(post_id)
+        if vector is None:
+            continue
+        # Over-fetch, as some of the closest posts may be hidden, and as a changed post may belong in the
+        # lists of posts beyond its own closest ones
+        neighbor_ids, scores = matrix.search(vector, 4 * size + 1)
+        neighbor_lists[post_id] = [
+            (neighbor_id, score) for neighbor_id, score in zip(neighbor_ids.tolist(), scores.tolist())
+            if neighbor_id != post_id
+        ]
+    visible = set(Post.objects.filter(
+        id__in={neighbor_id for neighbors in neighbor_lists.values() for neighbor_id, _ in neighbors},
+        status="approved"
+    ).values_list('id', flat=True))
+    neighbor_lists = {
+        post_id: [(neighbor_id, score) for neighbor_id, score in neighbors if neighbor_id in visible]
+        for post_id, neighbors in neighbor_lists.items()
+    }
 
-    activities = CommunityActivity.objects.filter(
-        organizer__in=similar_users,
-        community__privacy="public"
-    ).exclude(
-        organizer=user_id
-    ).distinct()
+    with transaction.atomic():
+        PostNeighbor.objects.filter(
+            Q(post_id__in=post_ids) | Q(post_id__in=neighbor_lists) | Q(neighbor_id__in=post_ids)
+        ).delete()
+        rows = [
+            PostNeighbor(post_id=post_id, neighbor_id=neighbor_id, score=score)
+            for post_id, neighbors in neighbor_lists.items() for neighbor_id, score in neighbors[:size]
+        ]
+        # Similarity is symmetric: offer each changed post to the lists of the posts close to it
+        rows.extend(
+            PostNeighbor(post_id=neighbor_id, neighbor_id=post_id, score=score)
+            for post_id, neighbors in neighbor_lists.items() if post_id in post_ids
+            for neighbor_id, score in neighbors
+        )
+        PostNeighbor.objects.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+
+        # Keep the best `size` rows of every list that received a post
+        offered_to = {row.post_id for row in rows}
+        kept = {}
+        overflow = []
+        for row_id, post_id in PostNeighbor.objects.filter(post_id__in=offered_to).order_by(
+                'post_id', '-score').values_list('id', 'post_id'):
+            kept[post_id] = kept.get(post_id, 0) + 1
+            if kept[post_id] > size:
+                overflow.append(row_id)
+        PostNeighbor.objects.filter(id__in=overflow).delete()
+
+
+def related_posts(post_id, user_id, limit=None):
+    """
+    Return up to `limit` (post, similarity) most similar to a post that the user may see, best first,
+    from its precomputed PostNeighbor list.
+    """
+    neighbors = PostNeighbor.objects.filter(post_id=post_id, neighbor__in=searchable("posts", user_id)).select_related(
+        'neighbor__created_by', 'neighbor__posted_in'
+    ).order_by('-score')
+    return [(neighbor.neighbor, neighbor.score) for neighbor in neighbors[:limit or settings.RECOMMENDER_RELATED_POSTS]]
+
+
+def open_activities():
+    """
+    Public activities that have not ended and start within RECOMMENDER_ACTIVITY_WINDOW_DAYS,
+    the only activities that get recommended.
+    """
+    now = timezone.now()
+    return CommunityActivity.objects.filter(
+        community__privacy="public",
+        endDate__gte=now,
+        startDate__lte=now + timedelta(days=settings.RECOMMENDER_ACTIVITY_WINDOW_DAYS)
+    )
+
+
+def activity_candidates(context):
+    # Weighted by recency: ongoing activities count as new, upcoming ones fade the further away they start
+    now = timezone.now()
+    rows = list(open_activities().values_list('id', 'startDate'))
+    return ScoredItems(
+        [activity_id for activity_id, _ in rows],
+        recency_weights([(start_date - now).total_seconds() for _, start_date in rows])
+    )
+
+
+def activity_exclusions(context):
+    return NotInterested.objects.filter(
+        user_id=context.user_id, activity__isnull=False
+    ).values_list('activity_id', flat=True)
+
+
+def activity_content_scores(context):
+    return retrieve_content_scores(context, "activities")
 
-    if not activities.exists():
+
+def activity_collaborative_scores(context):
+    # Open public activities organised by similar users, scored by their number of participants in one query
+    popularity_scores = list(
+        open_activities().filter(
+            organizer__in=similar_users(context)
+        ).exclude(
+            organizer=context.user_id
+        ).annotate(
+            participant_count=Count('activityparticipants', distinct=True)
+        ).filter(
+            participant_count__gte=context.score_threshold
+        ).values_list('id', 'participant_count')
+    )
+
+    if not popularity_scores:
         logger.warning("No activities found for collaborative filtering.")
-        return []
+        return ScoredItems()
+    return ScoredItems(*zip(*popularity_scores))
 
-    popularity_scores = [
-        (activity, ActivityParticipants.objects.filter(activity=activity).count())
-        for activity in activities
-    ]
 
-    recommended_activities = [
-        (activity, score)
-        for activity, score in popularity_scores
-        if score >= score_threshold
-    ]
+def popular_queryset(entity_type):
+    """
+    Items of a type annotated with their popularity: members, likes or participants.
+    """
+    if entity_type == "communities":
+        return Community.objects.annotate(popularity=Count('membership', distinct=True))
+    if entity_type == "posts":
+        return recent_posts().annotate(popularity=Count('liked_by', distinct=True))
+    return open_activities().annotate(popularity=Count('activityparticipants', distinct=True))
+
+
+def refresh_popular_items(entity_type):
+    """
+    Recompute the RECOMMENDER_POPULAR_SIZE most popular items of a type and cache them for
+    RECOMMENDER_POPULAR_TTL seconds. Returns the [(object_id, popularity)] list.
+    """
+    ranked = list(
+        popular_queryset(entity_type).order_by('-popularity', '-id').values_list('id', 'popularity')
+        [:settings.RECOMMENDER_POPULAR_SIZE]
+    )
+    cache.set(f"popular:{entity_type}", ranked, timeout=settings.RECOMMENDER_POPULAR_TTL)
+    return ranked
+
+
+def popular_items(entity_type):
+    """
+    The cached popular items of a type as ScoredItems, scored relative to the most popular one.
+    """
+    ranked = cache.get(f"popular:{entity_type}")
+    if ranked is None:
+        ranked = refresh_popular_items(entity_type)
+    if not ranked:
+        return ScoredItems()
+    ids, popularity = zip(*ranked)
+    scores = (np.asarray(popularity, dtype=np.float64) + 1) / (max(popularity) + 1)
+    return ScoredItems(ids, scores, {object_id: "Popular right now" for object_id in ids})
+
+
+# One hybrid pipeline per entity type, see pipeline.RecommendationPipeline
+PIPELINES = {
+    "communities": RecommendationPipeline(
+        "communities", Community,
+        candidates=community_candidates,
+        exclusions=community_exclusions,
+        content=community_content_scores,
+        collaborative=community_collaborative_scores,
+        fallback=lambda context: popular_items("communities"),
+        with_reasons=True,
+        score_threshold=0.2,
+    ),
+    "posts": RecommendationPipeline(
+        "posts", Post,
+        candidates=post_candidates,
+        exclusions=post_exclusions,
+        content=post_content_scores,
+        collaborative=post_collaborative_scores,
+        fallback=lambda context: popular_items("posts"),
+    ),
+    "activities": RecommendationPipeline(
+        "activities", CommunityActivity,
+        candidates=activity_candidates,
+        exclusions=activity_exclusions,
+        content=activity_content_scores,
+        collaborative=activity_collaborative_scores,
+        fallback=lambda context: popular_items("activities"),
+    ),
+}
+
+
+def get_hybrid_recommendations(user_id, cbf_weight=0.6, cf_weight=0.4, score_threshold=0.2, limit=None):
+    """
+    Combine content-based and collaborative filtering recommendations, excluding communities the user is already
+    a member of or marked as not interesting. Returns at most `limit` (Community, hybrid_score, reason), best
+    first, or the popular communities when there is nothing to go on.
+    """
+    return PIPELINES["communities"].run(
+        user_id, content_weight=cbf_weight, collaborative_weight=cf_weight, score_threshold=score_threshold,
+        limit=limit
+    )
+
 
-    recommended_activities = sorted(recommended_activities, key=lambda x: x[1], reverse=True)
-    return recommended_activities  # Returns (Activity, popularity_score)
+def log_hybrid_recommendations(user_id):
+    recommendations = get_hybrid_recommendations(user_id)
+    logger.info(f"Hybrid Recommendations for User {user_id}: {recommendations}")
+    return recommendations
 
 
-def hybrid_activity_recommendation(user_id, cbf_weight=0.6, cf_weight=0.4, score_threshold=0.3):
+def hybrid_post_recommendation(user_id, cbf_weight=0.6, cf_weight=0.4, score_threshold=0.3, limit=None):
+    """
+    Combine content-based and collaborative filtering recommendations for posts.
+    Returns at most `limit` (Post, hybrid_score), best first, or the popular posts when there is nothing to go on.
+    """
+    return PIPELINES["posts"].run(
+        user_id, content_weight=cbf_weight, collaborative_weight=cf_weight, score_threshold=score_threshold,
+        limit=limit
+    )
+
+
+def hybrid_activity_recommendation(user_id, cbf_weight=0.6, cf_weight=0.4, score_threshold=0.3, limit=None):
     """
     Combine content-based and collaborative filtering recommendations for activities.
+    Returns at most `limit` (Activity, hybrid_score), best first, or the popular activities when there is
+    nothing to go on.
     """
-    cbf_recommendations = content_based_activity_recommendation(user_id, score_threshold=score_threshold)
-    cf_recommendations = collaborative_activity_recommendation(user_id, score_threshold=score_threshold)
+    return PIPELINES["activities"].run(
+        user_id, content_weight=cbf_weight, collaborative_weight=cf_weight, score_threshold=score_threshold,
+        limit=limit
+    )
 
-    cbf_scores = [score for _, score in cbf_recommendations]
-    cf_scores = [score for _, score in cf_recommendations]
 
-    normalized_cbf_scores = normalize_scores(cbf_scores)
-    normalized_cf_scores = normalize_scores(cf_scores)
+def searchable(entity_type, user_id):
+    """
+    Objects of a type the user may find by searching: every community, and approved posts and activities
+    of public communities or of communities the user belongs to.
+    """
+    if entity_type == "communities":
+        return Community.objects.all()
+    visible = Q(community__privacy="public") | Q(
+        community_id__in=Membership.objects.filter(user_id=user_id).values('community_id')
+    )
+    if entity_type == "posts":
+        visible = Q(posted_in__privacy="public") | Q(
+            posted_in_id__in=Membership.objects.filter(user_id=user_id).values('community_id')
+        )
+        return Post.objects.filter(visible, status="approved")
+    return CommunityActivity.objects.filter(visible)
 
-    combined_scores = {}
-    combined_activities = {}
 
-    for activity, score in zip([activity for activity, _ in cbf_recommendations], normalized_cbf_scores):
-        combined_scores[activity.id] = score * cbf_weight
-        combined_activities[activity.id] = activity
+def semantic_search(query, entity_type, user_id, limit=None, score_threshold=0.2):
+    """
+    Rank the objects of a type by cosine similarity to the query, using the recommender's in-memory
+    matrices (and ANN index), and return up to `limit` (object_id, similarity) the user may see, best first.
+    """
+    limit = limit or settings.SEMANTIC_SEARCH_LIMIT
+    query_vector = query_embedding(query)
+    if query_vector is None:
+        return []
+
+    if entity_type == "communities":
+        matrix = ensure_matrix_rows("communities", list(Community.objects.values_list('id', flat=True)))
+    else:
+        matrix = sync_matrix_rows(entity_type)
+    # Over-fetch, as some of the closest objects may not be visible to the user
+    object_ids, similarities = matrix.search(query_vector, 4 * limit, score_threshold)
+    visible_ids = set(
+        searchable(entity_type, user_id).filter(id__in=object_ids.tolist()).values_list('id', flat=True)
+    )
+    return [
+        (object_id, similarity)
+        for object_id, similarity in zip(object_ids.tolist(), similarities.tolist()) if object_id in visible_ids
+    ][:limit]
+
 
-    for activity, score in zip([activity for activity, _ in cf_recommendations], normalized_cf_scores):
-        combined_scores[activity.id] = combined_scores.get(activity.id, 0) + score * cf_weight
-        combined_activities[activity.id] = activity
+# Hybrid recommender behind each cached recommendation type
+RECOMMENDERS = {
+    "communities": get_hybrid_recommendations,
+    "posts": hybrid_post_recommendation,
+    "activities": hybrid_activity_recommendation,
+}
 
-    filtered_recommendations = [
-        (combined_activities[activity_id], score)
-        for activity_id, score in combined_scores.items() if score >= score_threshold
+# What the run_recommender_jobs worker does for each kind of queued job (see recommender_jobs), given the object ids
+JOB_HANDLERS = {
+    **{cache_type: partial(embed_objects, cache_type) for cache_type in EMBEDDED_ENTITIES},
+    "users": embed_interests,
+    "user_activity": update_activity_profiles,
+    "community_neighbors": refresh_neighbors_around,
+}
+
+
+def recommendation_cache_key(user_id, entity_type):
+    return f"recommendations:{entity_type}:{user_id}"
+
+
+def compute_recommendations(user_id, entity_type):
+    """
+    Run the hybrid recommender of a type live and return the best RECOMMENDATION_LIMIT as
+    (object_id, score, ...) tuples.
+    """
+    return [
+        (item.id, *details)
+        for item, *details in RECOMMENDERS[entity_type](user_id, limit=settings.RECOMMENDATION_LIMIT)
     ]
 
-    sorted_recommendations = sorted(filtered_recommendations, key=lambda x: x[1], reverse=True)
-    return sorted_recommendations  # Returns (Activity, hybrid_score)
+
+def load_precomputed_recommendations(user_id, entity_type):
+    """
+    Return the ranked list written by the precompute_recommendations command, or None when there is
+    none younger than RECOMMENDER_PRECOMPUTED_MAX_AGE and computed after the user's last change.
+    """
+    items = PrecomputedRecommendation.objects.filter(
+        Q(invalidated_at__isnull=True) | Q(computed_at__gt=F('invalidated_at')),
+        user_id=user_id,
+        entity_type=entity_type,
+        computed_at__gte=timezone.now() - timedelta(seconds=settings.RECOMMENDER_PRECOMPUTED_MAX_AGE)
+    ).values_list('items', flat=True).first()
+    return [tuple(item) for item in items] if items is not None else None
+
+
+def reserve_precomputed_recommendations(user_ids, entity_types):
+    """
+    Make sure the users have a row per entity type before their lists are computed, so that an invalidation
+    during the computation has a row to mark (see invalidate_recommendations). New rows read as out of date.
+    """
+    now = timezone.now()
+    PrecomputedRecommendation.objects.bulk_create(
+        [
+            PrecomputedRecommendation(user_id=user_id, entity_type=entity_type, computed_at=now, invalidated_at=now)
+            for user_id in user_ids for entity_type in entity_types
+        ],
+        ignore_conflicts=True
+    )
+
+
+def save_precomputed_recommendations(rows, computed_at):
+    """
+    Upsert (user_id, entity_type, ranked) rows in one query. computed_at is when the computation started,
+    after reserve_precomputed_recommendations: lists invalidated since then are stored but never read.
+    """
+    PrecomputedRecommendation.objects.bulk_create(
+        [
+            PrecomputedRecommendation(user_id=user_id, entity_type=entity_type, items=ranked, computed_at=computed_at)
+            for user_id, entity_type, ranked in rows
+        ],
+        update_conflicts=True,
+        unique_fields=['user', 'entity_type'],
+        update_fields=['items', 'computed_at']
+    )
+
+
+def get_cached_recommendations(user_id, entity_type, limit=None):
+    """
+    Return the best `limit` (all the kept ones when None) recommendations of a user as (object_id, score, ...)
+    tuples.
+    The list is taken from Django's cache, then from the precomputed table, and only computed live
+    for users the batch job has not seen yet. It is then kept in the cache for RECOMMENDATION_CACHE_TTL
+    seconds, so paginated views slice it instead of re-running the hybrid pipeline.
+    """
+    key = recommendation_cache_key(user_id, entity_type)
+    ranked = cache.get(key)
+    if ranked is None:
+        ranked = load_precomputed_recommendations(user_id, entity_type)
+        if ranked is None:
+            ranked = compute_recommendations(user_id, entity_type)
+        cache.set(key, ranked, timeout=settings.RECOMMENDATION_CACHE_TTL)
+    return ranked[:limit]
+
+
+def invalidate_recommendations(user_id, entity_types=tuple(RECOMMENDERS)):
+    """
+    Drop a user's cached and precomputed recommendation lists after their memberships, interests, likes or
+    not-interested marks change. The next precompute run with --stale recomputes them.
+    Precomputed rows are marked rather than deleted, so a precompute that started before the change
+    cannot store its list as a fresh one.
+    """
+    keys = [recommendation_cache_key(user_id, entity_type) for entity_type in entity_types]
+    cache.delete_many(keys)
+    invalidation_bus.notify("cache", keys)
+    PrecomputedRecommendation.objects.filter(user_id=user_id, entity_type__in=entity_types).update(
+        invalidated_at=timezone.now()
+    )
+
+
+def load_in_order(model_class, object_ids):
+    """
+    Fetch objects by id with one query, keeping the order of object_ids and skipping deleted ones.
+    """
+    objects = model_class.objects.in_bulk(object_ids)
+    return [objects[object_id] for object_id in object_ids if object_id in objects]
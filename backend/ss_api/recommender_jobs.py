@@ -0,0 +1,126 @@
+import logging
+import uuid
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import RecommenderJob
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(kind, object_ids, requeue=True):
+    """
+    Durably record jobs, in the caller's transaction, for the run_recommender_jobs worker.
+    With requeue a job that is already waiting or being processed is replaced by a fresh one, with a new
+    token and its failed attempts forgotten: a worker that started on the previous version of the object
+    leaves it in the queue (see complete()), and one that gave up on it gets to try again. Without requeue,
+    an existing job is left alone.
+    """
+    enqueued_at = timezone.now()
+    token = uuid.uuid4()
+    jobs = [
+        RecommenderJob(kind=kind, object_id=object_id, enqueued_at=enqueued_at, token=token)
+        for object_id in set(object_ids)
+    ]
+    if not jobs:
+        return
+    if requeue:
+        RecommenderJob.objects.bulk_create(
+            jobs, update_conflicts=True, unique_fields=['kind', 'object_id'],
+            update_fields=['enqueued_at', 'token', 'attempts', 'claimed_at']
+        )
+    else:
+        RecommenderJob.objects.bulk_create(jobs, ignore_conflicts=True)
+
+
+def lock(name):
+    """
+    Take a PostgreSQL advisory lock until the end of the current transaction, so that workers rebuilding
+    the same rows run one after the other. Does nothing on other databases.
+    """
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", [zlib.crc32(name.encode("utf-8"))])
+
+
+def claim(batch_size):
+    """
+    Mark up to batch_size of the oldest unclaimed jobs as taken by this worker and return them.
+    Jobs locked by another worker are skipped, and abandoned claims are taken over.
+    """
+    claimed_at = timezone.now()
+    with transaction.atomic():
+        jobs = list(RecommenderJob.objects.select_for_update(skip_locked=True).filter(
+            Q(claimed_at__isnull=True) |
+            Q(claimed_at__lt=claimed_at - timedelta(seconds=settings.RECOMMENDER_JOB_CLAIM_TIMEOUT)),
+            attempts__lt=settings.RECOMMENDER_JOB_MAX_ATTEMPTS
+        ).order_by('enqueued_at')[:batch_size])
+        RecommenderJob.objects.filter(id__in=[job.id for job in jobs]).update(claimed_at=claimed_at)
+    return jobs
+
+
+def claimed_versions(jobs):
+    """
+    The given jobs as they were claimed: rows enqueued again since carry another token and are left out.
+    """
+    return RecommenderJob.objects.filter(id__in=[job.id for job in jobs], token__in={job.token for job in jobs})
+
+
+def complete(jobs):
+    """
+    Delete processed jobs, except those enqueued again since they were claimed, which stay queued.
+    """
+    claimed_versions(jobs).delete()
+
+
+def fail(jobs):
+    """
+    Release failed jobs for a retry; after RECOMMENDER_JOB_MAX_ATTEMPTS attempts they are left aside until
+    their object is enqueued again. Jobs enqueued again since they were claimed already start afresh.
+    """
+    claimed_versions(jobs).update(attempts=F('attempts') + 1, claimed_at=None)
+
+
+def run_jobs(handler, kind, jobs):
+    """
+    Run the jobs of one kind with a single handler call. If it fails, each job is retried on its own, so
+    only the objects that fail by themselves are charged an attempt.
+    """
+    try:
+        handler(sorted(job.object_id for job in jobs))
+    except Exception:
+        if len(jobs) > 1:
+            logger.warning(f"Could not process {len(jobs)} recommender jobs of kind {kind}, retrying one by one")
+            for job in jobs:
+                run_jobs(handler, kind, [job])
+            return
+        logger.exception(f"Could not process recommender job {kind} {jobs[0].object_id}")
+        fail(jobs)
+    else:
+        complete(jobs)
+
+
+def process_batch(handlers, batch_size):
+    """
+    Claim a batch of jobs and run them, grouped by kind: handlers[kind](object_ids). A failing object is
+    released for a retry without affecting the others. Returns the number of jobs claimed.
+    """
+    jobs = claim(batch_size)
+    jobs_by_kind = {}
+    for job in jobs:
+        jobs_by_kind.setdefault(job.kind, []).append(job)
+
+    for kind, kind_jobs in jobs_by_kind.items():
+        handler = handlers.get(kind)
+        if handler is None:
+            logger.error(f"No handler for {len(kind_jobs)} recommender jobs of kind {kind}")
+            fail(kind_jobs)
+            continue
+        run_jobs(handler, kind, kind_jobs)
+    return len(jobs)
@@ -1,41 +1,145 @@
+import logging
+
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import User, Community, Membership, Post, CommunityActivity
-from .recommender import embedding_cache
+from .models import User, Community, Membership, Post, CommunityActivity, LikedPost, NotInterested, UserActivity
+from .recommender import EMBEDDED_ENTITIES, delete_stored_embeddings, invalidate_recommendations, refresh_embedding, \
+    enqueue_embedding, content_hash, forget_embedding, \
+    apply_membership_change
+from .activity_counters import SEARCH_ACTIVITY_TYPES
+from . import invalidation_bus, recommender_jobs
+
+logger = logging.getLogger(__name__)
 
 @receiver(post_save, sender=User)
 @receiver(post_save, sender=Community)
-@receiver(post_save, sender=Membership)
 @receiver(post_save, sender=Post)
 @receiver(post_save, sender=CommunityActivity)
 @receiver(post_delete, sender=User)
 @receiver(post_delete, sender=Community)
-@receiver(post_delete, sender=Membership)
 @receiver(post_delete, sender=Post)
 @receiver(post_delete, sender=CommunityActivity)
 def invalidate_cache(sender, instance, **kwargs):
     """
-    Invalidate the embedding cache when a User, Community, Membership, Post, or CommunityActivity is modified or deleted.
+    Invalidate the embedding cache when a User, Community, Post, or CommunityActivity is modified or deleted.
+    Cached embeddings carry the hash of their source text, so a save only drops them when that text changed:
+    pinning or moderating a post, or the last_active update on every request, keeps them.
+    Every saved community, post and activity is queued, in the same transaction, for the run_recommender_jobs
+    worker (see recommender.enqueue_embedding), which encodes it only if its text changed since the stored
+    embedding, and also updates the related posts; the save itself never waits for the model.
+    Memberships are not part of any embedded text, so they leave the embeddings alone; the collaborative
+    filtering matrix and the recommendation lists are updated by their own receivers below.
+    Other worker processes apply the same change when notified over the invalidation bus.
     """
+    deleted = kwargs.get('signal') is post_delete
+
     if isinstance(instance, User):
-        # Remove the cached embedding for the specific user
-        print(f"Invalidating user embedding for user {instance.id}")
-        embedding_cache["users"].pop(f"user_{instance.id}", None)
-        embedding_cache["users"].pop(f"user_activity_{instance.id}", None)
-    elif isinstance(instance, Community):
-        # Remove the cached embedding for the specific community
-        print(f"Invalidating community embedding for community {instance.id}")
-        embedding_cache["communities"].pop(f"community_{instance.id}", None)
-    elif isinstance(instance, Membership):
-        # Clear all user-related community embeddings when membership changes
-        print(f"Invalidating user embeddings for user {instance.user_id}")
-        embedding_cache["users"].clear()
-        embedding_cache["communities"].clear()
-    elif isinstance(instance, Post):
-        # Remove the cached embedding for the specific post
-        print(f"Invalidating post embedding for post {instance.id}")
-        embedding_cache["posts"].pop(f"post_{instance.id}", None)
-    elif isinstance(instance, CommunityActivity):
-        # Remove the cached embedding for the specific activity
-        print(f"Invalidating activity embedding for activity {instance.id}")
-        embedding_cache["activities"].pop(f"activity_{instance.id}", None)
\ No newline at end of file
+        # User embeddings are checked against the current interests whenever they are read,
+        # so only a deleted user's entry needs to go
+        if deleted:
+            logger.debug(f"Invalidating user embedding for user {instance.id}")
+            forget_embedding("users", instance.id)
+            invalidation_bus.notify("embedding_deleted", "users", instance.id)
+        return
+
+    cache_type, key_prefix = {
+        Community: ("communities", "community"),
+        Post: ("posts", "post"),
+        CommunityActivity: ("activities", "activity"),
+    }[sender]
+    if deleted:
+        forget_embedding(cache_type, instance.id)
+        invalidation_bus.notify("embedding_deleted", cache_type, instance.id)
+        return
+    # Other workers compare the hash with the version they hold, as refresh_embedding does here. New objects
+    # are announced too: their id can be below the high-water mark of a sync that ran before this save committed,
+    # so other workers would never look for them otherwise
+    invalidation_bus.notify(
+        "embedding", cache_type, instance.id, content_hash(EMBEDDED_ENTITIES[cache_type][2](instance))
+    )
+    # Community embeddings depend on the name and keywords, posts on the title and content and
+    # activities on the title and description; other edits keep them
+    if refresh_embedding(cache_type, instance):
+        logger.debug(f"Invalidating {key_prefix} embedding for {key_prefix} {instance.id}")
+    # Queued even when this process held no stale copy, as the stored embedding may still be one; for posts,
+    # approving or hiding one also changes the related-post lists it may appear in
+    enqueue_embedding(cache_type, instance.id)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Community)
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=CommunityActivity)
+def delete_persisted_embeddings(sender, instance, **kwargs):
+    """
+    Remove the persisted embeddings of a deleted User, Community, Post, or CommunityActivity.
+    """
+    object_types = {
+        User: "users",
+        Community: "communities",
+        Post: "posts",
+        CommunityActivity: "activities",
+    }
+    delete_stored_embeddings(object_types[sender], instance.id)
+    if sender is User:
+        delete_stored_embeddings("user_activity", instance.id)
+
+
+@receiver(post_save, sender=UserActivity)
+def update_user_profile(sender, instance, created, **kwargs):
+    """
+    Queue a new visit or search to be folded into the user's activity profile by the run_recommender_jobs
+    worker (see recommender.update_activity_profiles).
+    """
+    if created and instance.user_id is not None and instance.activity_type in ("visit", *SEARCH_ACTIVITY_TYPES):
+        recommender_jobs.enqueue("user_activity", [instance.user_id])
+
+
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+def update_community_interactions(sender, instance, **kwargs):
+    """
+    Apply a single Membership change to the in-memory user x community matrix, in every worker.
+    """
+    value = 0 if kwargs.get('signal') is post_delete else 1
+    apply_membership_change(instance.user_id, instance.community_id, value)
+    invalidation_bus.notify("membership", instance.user_id, instance.community_id, value)
+
+
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+def update_community_neighbors(sender, instance, created=False, **kwargs):
+    """
+    Queue the refresh of the co-membership neighbour lists around the community after a join or leave,
+    done by the run_recommender_jobs worker (see recommender.refresh_neighbors_around).
+    """
+    if created or kwargs.get('signal') is post_delete:
+        recommender_jobs.enqueue("community_neighbors", [instance.community_id])
+
+
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+@receiver(post_save, sender=NotInterested)
+@receiver(post_delete, sender=NotInterested)
+@receiver(post_save, sender=LikedPost)
+@receiver(post_delete, sender=LikedPost)
+def invalidate_user_recommendations(sender, instance, **kwargs):
+    """
+    Drop the cached recommendation lists of the user whose membership, not-interested mark or like changed.
+    """
+    if sender is LikedPost:
+        invalidate_recommendations(instance.user_id, ["posts"])
+    else:
+        invalidate_recommendations(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def invalidate_profile_recommendations(sender, instance, update_fields=None, **kwargs):
+    """
+    Drop a user's cached recommendation lists when their profile (and so possibly their interests) is saved.
+    Saves limited to other fields, such as the last_active update on every request, keep the cache.
+    """
+    if update_fields is None or 'interests' in update_fields:
+        invalidate_recommendations(instance.id)
+        # Encoded by the run_recommender_jobs worker only if the interests changed
+        recommender_jobs.enqueue("users", [instance.id])
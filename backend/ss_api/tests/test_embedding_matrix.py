@@ -0,0 +1,125 @@
+import tempfile
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..ann_index import IVFIndex
+from ..embedding_matrix import EmbeddingMatrix, normalize_rows
+from ..embedding_snapshot import EmbeddingSnapshot, SnapshotWriter
+
+
+def text_hash(number):
+    return f"{number:016x}" * 4
+
+
+def clustered_vectors(rng, count, dimension=64, clusters=50, noise=0.3):
+    centres = rng.normal(size=(clusters, dimension))
+    return centres, centres[rng.integers(0, clusters, count)] + noise * rng.normal(size=(count, dimension))
+
+
+class IVFIndexTestCase(SimpleTestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.centres, vectors = clustered_vectors(self.rng, 10000)
+        self.matrix = EmbeddingMatrix(index=IVFIndex(min_train_size=1000))
+        self.matrix.upsert(list(range(1, len(vectors) + 1)), vectors)
+
+    def query(self):
+        centre = self.centres[self.rng.integers(0, len(self.centres))]
+        return centre + 0.3 * self.rng.normal(size=len(centre))
+
+    def test_recall_at_100(self):
+        for _ in range(20):
+            query = self.query()
+            exact_ids, exact_scores = self.matrix.top_k(query, 100)
+            ids, scores = self.matrix.search(query, 100)
+            self.assertEqual(set(ids.tolist()), set(exact_ids.tolist()))
+            np.testing.assert_allclose(scores, exact_scores, rtol=1e-5)
+        self.assertTrue(self.matrix.index.is_trained)
+
+    def test_only_probed_lists_are_scored(self):
+        self.matrix.search(self.query(), 10)
+        probed_ids = self.matrix.index.candidate_ids(normalize_rows(self.query()))
+        self.assertLess(len(probed_ids), len(self.matrix) // 2)
+
+    def test_untrained_below_min_train_size(self):
+        matrix = EmbeddingMatrix(index=IVFIndex(min_train_size=1000))
+        matrix.upsert([1, 2, 3], np.eye(3))
+        ids, _ = matrix.search(np.array([0, 1, 0]), 2)
+        self.assertEqual(ids[0], 2)
+        self.assertFalse(matrix.index.is_trained)
+
+    def test_updates_are_applied_incrementally(self):
+        query = self.query()
+        self.matrix.search(query, 10)
+        best_id = int(self.matrix.search(query, 1)[0][0])
+
+        self.matrix.remove([best_id])
+        self.assertNotIn(best_id, self.matrix.search(query, 100)[0].tolist())
+
+        self.matrix.upsert([best_id, 20001], [query, query])
+        self.assertEqual(set(self.matrix.search(query, 2)[0].tolist()), {best_id, 20001})
+
+    def test_retrains_once_the_matrix_doubled(self):
+        self.matrix.search(self.query(), 10)
+        trained_size = self.matrix.index.trained_size
+        _, vectors = clustered_vectors(self.rng, trained_size)
+        self.matrix.upsert(list(range(20001, 20001 + trained_size)), vectors)
+
+        self.matrix.search(self.query(), 10)
+        self.assertEqual(self.matrix.index.trained_size, 2 * trained_size)
+
+
+class EmbeddingMatrixSnapshotTestCase(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.vectors = normalize_rows(np.random.default_rng(0).normal(size=(6, 8)))
+
+        writer = SnapshotWriter(self.directory.name, "posts", capacity=6)
+        writer.append([1, 2, 3, 4, 5, 6], self.vectors, [text_hash(object_id) for object_id in range(1, 7)])
+        writer.commit("model", synced_up_to=6)
+        self.snapshot = EmbeddingSnapshot.open_current(self.directory.name, "posts")
+        self.matrix = EmbeddingMatrix()
+        self.matrix.attach_snapshot(self.snapshot)
+
+    def test_snapshot_rows_are_the_base(self):
+        self.assertEqual(len(self.matrix), 6)
+        self.assertEqual(self.matrix.synced_up_to, 6)
+        self.assertTrue(self.matrix.hash_matches(2, text_hash(2)))
+        self.assertFalse(self.matrix.hash_matches(2, text_hash(3)))
+        np.testing.assert_allclose(self.matrix.vector_of(3), self.vectors[2], rtol=1e-6)
+        self.assertEqual(self.matrix.top_k(self.vectors[3], 1)[0].tolist(), [4])
+
+    def test_replaced_rows_mask_the_snapshot(self):
+        self.matrix.upsert([2], [self.vectors[4]], [text_hash(7)])
+
+        self.assertEqual(len(self.matrix), 6)
+        self.assertEqual(sorted(self.matrix.ids.tolist()), [1, 2, 3, 4, 5, 6])
+        self.assertTrue(self.matrix.hash_matches(2, text_hash(7)))
+        np.testing.assert_allclose(self.matrix.vector_of(2), self.vectors[4], rtol=1e-6)
+        self.assertEqual(set(self.matrix.top_k(self.vectors[4], 2)[0].tolist()), {2, 5})
+
+    def test_removed_and_invalidated_rows_are_hidden(self):
+        self.matrix.remove([1])
+        self.matrix.invalidate([3])
+
+        self.assertEqual(len(self.matrix), 4)
+        self.assertNotIn(1, self.matrix)
+        self.assertIsNone(self.matrix.vector_of(3))
+        self.assertEqual(self.matrix.pending_ids, {3})
+        self.assertEqual(set(self.matrix.top_k(self.vectors[0], 6)[0].tolist()), {2, 4, 5, 6})
+        ids, vectors = self.matrix.rows()
+        self.assertEqual(ids.tolist(), [2, 4, 5, 6])
+        np.testing.assert_allclose(vectors, self.vectors[[1, 3, 4, 5]], rtol=1e-6)
+
+    def test_attaching_keeps_in_process_rows_and_pending_ids(self):
+        matrix = EmbeddingMatrix()
+        matrix.upsert([2, 7], [self.vectors[5], self.vectors[0]])
+        matrix.invalidate([4])
+        matrix.attach_snapshot(self.snapshot)
+
+        self.assertEqual(len(matrix), 6)
+        self.assertNotIn(4, matrix)
+        np.testing.assert_allclose(matrix.vector_of(2), self.vectors[5], rtol=1e-6)
+        self.assertEqual(sorted(matrix.ids.tolist()), [1, 2, 3, 5, 6, 7])
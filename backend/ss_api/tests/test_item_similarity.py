@@ -0,0 +1,164 @@
+import numpy as np
+from django.test import SimpleTestCase, TestCase, override_settings
+from scipy import sparse
+
+from .. import recommender
+from ..interaction_matrix import InteractionMatrix
+from ..item_similarity import cosine_neighbors, co_occurring_columns
+from ..models import User, Community, Membership, CommunityNeighbor
+
+
+def random_memberships(rng, users, items, density):
+    return [
+        (int(user_id), int(item_id))
+        for user_id, item_id in zip(*np.nonzero(rng.random((users, items)) < density))
+    ]
+
+
+def reference_neighbors(dense, size):
+    """
+    Item-item cosine similarity computed directly on the dense matrix, best `size` neighbours per column.
+    """
+    neighbors = {}
+    for column in range(dense.shape[1]):
+        scores = {}
+        for other in range(dense.shape[1]):
+            co_occurrences = float(dense[:, column] @ dense[:, other])
+            if other != column and co_occurrences:
+                scores[other] = co_occurrences / np.sqrt(dense[:, column].sum() * dense[:, other].sum())
+        neighbors[column] = dict(sorted(scores.items(), key=lambda item: -item[1])[:size])
+    return neighbors
+
+
+class CosineNeighborsTestCase(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.dense = (rng.random((200, 60)) < 0.08).astype(np.float32)
+        self.matrix = sparse.csr_matrix(self.dense)
+
+    def neighbor_lists(self, **options):
+        return {
+            column: dict(zip(neighbor_columns.tolist(), scores.tolist()))
+            for column, neighbor_columns, scores in cosine_neighbors(self.matrix, **options)
+        }
+
+    def test_matches_the_dense_computation(self):
+        expected = reference_neighbors(self.dense, size=60)
+        neighbors = self.neighbor_lists(size=60)
+        self.assertEqual(neighbors.keys(), expected.keys())
+        for column, scores in expected.items():
+            self.assertEqual(neighbors[column].keys(), scores.keys())
+            for neighbor, score in scores.items():
+                self.assertAlmostEqual(neighbors[column][neighbor], score, places=5)
+
+    def test_keeps_the_best_neighbors_best_first(self):
+        full = self.neighbor_lists(size=60)
+        for column, scores in self.neighbor_lists(size=5).items():
+            self.assertLessEqual(len(scores), 5)
+            self.assertEqual(list(scores.values()), sorted(scores.values(), reverse=True))
+            best_left_out = max((score for neighbor, score in full[column].items() if neighbor not in scores),
+                                default=0)
+            self.assertTrue(all(score >= best_left_out for score in scores.values()))
+
+    def test_chunks_and_columns_do_not_change_the_result(self):
+        full = self.neighbor_lists(size=10)
+        self.assertEqual(self.neighbor_lists(size=10, chunk_size=7), full)
+        columns = [3, 17, 42]
+        self.assertEqual(self.neighbor_lists(size=10, columns=columns), {column: full[column] for column in columns})
+
+    def test_co_occurring_columns(self):
+        users = np.flatnonzero(self.dense[:, 5])
+        expected = set(np.flatnonzero(self.dense[users].sum(axis=0)).tolist()) | {5}
+        self.assertEqual(set(co_occurring_columns(self.matrix, 5).tolist()), expected)
+
+
+class InteractionMatrixTestCase(SimpleTestCase):
+    def assertSameInteractions(self, matrix, pairs):
+        rows, columns = matrix.matrix.nonzero()
+        user_ids = {row: user_id for user_id, row in matrix._row_index.items()}
+        item_ids = matrix.item_ids
+        self.assertEqual({(user_ids[row], int(item_ids[column])) for row, column in zip(rows, columns)}, set(pairs))
+
+    def test_single_updates_match_a_bulk_load(self):
+        rng = np.random.default_rng(0)
+        pairs = set(random_memberships(rng, 50, 30, 0.1))
+        matrix = InteractionMatrix()
+        matrix.load(pairs)
+
+        for _ in range(200):
+            pair = (int(rng.integers(0, 60)), int(rng.integers(0, 40)))
+            value = int(rng.integers(0, 2))
+            matrix.set(*pair, value)
+            if value:
+                pairs.add(pair)
+            else:
+                pairs.discard(pair)
+            if rng.random() < 0.1:
+                self.assertSameInteractions(matrix, pairs)
+        self.assertSameInteractions(matrix, pairs)
+
+    def test_reload_items_replaces_their_interactions(self):
+        matrix = InteractionMatrix()
+        matrix.load([(1, 10), (2, 10), (2, 20), (3, 30)])
+        matrix.set(4, 10)
+        matrix.reload_items([10, 40], [(3, 10), (5, 40)])
+        self.assertSameInteractions(matrix, [(3, 10), (2, 20), (3, 30), (5, 40)])
+
+
+@override_settings(INVALIDATION_BUS_ENABLED=False, RECOMMENDER_COMMUNITY_NEIGHBORS=50)
+class CommunityNeighborsTestCase(TestCase):
+    def setUp(self):
+        recommender.clear_state()
+        self.addCleanup(recommender.clear_state)
+        self.rng = np.random.default_rng(0)
+        self.users = [
+            User.objects.create(username=f"user{number}", email=f"user{number}@example.com")
+            for number in range(40)
+        ]
+        self.communities = [
+            Community.objects.create(name=f"Community {number}", description="d", rules="r", keyword=[])
+            for number in range(25)
+        ]
+        for user, community in random_memberships(self.rng, len(self.users), len(self.communities), 0.15):
+            Membership.objects.create(user=self.users[user], community=self.communities[community])
+
+    def neighbor_rows(self):
+        return {
+            (community_id, neighbor_id): score
+            for community_id, neighbor_id, score in CommunityNeighbor.objects.values_list(
+                'community_id', 'neighbor_id', 'score'
+            )
+        }
+
+    def assertSameRows(self, rows, expected):
+        self.assertEqual(rows.keys(), expected.keys())
+        for key, score in expected.items():
+            self.assertAlmostEqual(rows[key], score, places=5)
+
+    def test_incremental_refresh_equals_a_full_rebuild(self):
+        recommender.refresh_community_neighbors()
+        for _ in range(5):
+            changed = set()
+            for _ in range(4):
+                user = self.users[int(self.rng.integers(0, len(self.users)))]
+                community = self.communities[int(self.rng.integers(0, len(self.communities)))]
+                membership = Membership.objects.filter(user=user, community=community).first()
+                if membership:
+                    membership.delete()
+                else:
+                    Membership.objects.create(user=user, community=community)
+                changed.add(community.id)
+            recommender.refresh_neighbors_around(sorted(changed))
+            incremental = self.neighbor_rows()
+
+            recommender.clear_state()
+            recommender.refresh_community_neighbors()
+            self.assertSameRows(incremental, self.neighbor_rows())
+
+    def test_refresh_overwrites_existing_rows(self):
+        recommender.refresh_community_neighbors()
+        expected = self.neighbor_rows()
+        community_ids = [community.id for community in self.communities[:5]]
+        recommender.refresh_community_neighbors(community_ids)
+        recommender.refresh_community_neighbors(community_ids)
+        self.assertSameRows(self.neighbor_rows(), expected)
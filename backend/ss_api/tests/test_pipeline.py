@@ -0,0 +1,101 @@
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from ..pipeline import ScoredItems, fuse, min_max_normalize
+from ..recommender import recency_weights
+
+
+def reference_fuse(weighted_sources, score_threshold, limit=None, item_weights=None):
+    """
+    fuse() written out with dicts: normalise, sum per id, threshold, weight, then sort and cut.
+    """
+    totals, first_seen = {}, {}
+    for items, weight in weighted_sources:
+        scores = items.scores.tolist()
+        low, high = (min(scores), max(scores)) if scores else (0, 0)
+        for object_id, score in zip(items.ids.tolist(), scores):
+            normalized = 1.0 if high == low else (score - low) / (high - low)
+            totals[object_id] = totals.get(object_id, 0) + normalized * weight
+            first_seen.setdefault(object_id, len(first_seen))
+    weights = dict(zip(item_weights.ids.tolist(), item_weights.scores.tolist())) if item_weights else {}
+    results = [
+        (object_id, total * weights.get(object_id, 1.0))
+        for object_id, total in totals.items() if total >= score_threshold
+    ]
+    results.sort(key=lambda result: (-result[1], first_seen[result[0]]))
+    return results[:limit]
+
+
+class FuseTestCase(SimpleTestCase):
+    def random_sources(self, rng):
+        return [
+            (ScoredItems(rng.choice(300, size, replace=False), rng.random(size)), weight)
+            for size, weight in ((200, 0.6), (120, 0.4))
+        ]
+
+    def test_matches_the_reference_implementation(self):
+        rng = np.random.default_rng(0)
+        for _ in range(20):
+            sources = self.random_sources(rng)
+            weight_ids = rng.choice(300, 100, replace=False)
+            item_weights = ScoredItems(weight_ids, rng.random(100)) if rng.random() < 0.5 else None
+            limit = [None, 1, 10, 50][int(rng.integers(0, 4))]
+
+            ids, scores, _ = fuse(sources, 0.2, limit, item_weights)
+            expected = reference_fuse(sources, 0.2, limit, item_weights)
+            np.testing.assert_allclose(scores, [score for _, score in expected])
+            # Equal scores may be ordered differently only at the limit
+            self.assertEqual(set(ids[scores > scores[-1]].tolist()),
+                             {object_id for object_id, score in expected if score > scores[-1]})
+
+    def test_ties_keep_the_source_order(self):
+        ids, scores, _ = fuse([(ScoredItems([5, 3, 9, 1], [2, 2, 2, 1]), 1.0)], 0)
+        self.assertEqual(ids.tolist(), [5, 3, 9, 1])
+        self.assertEqual(scores.tolist(), [1, 1, 1, 0])
+
+    def test_item_weights_apply_before_the_limit(self):
+        sources = [(ScoredItems([1, 2, 3], [3, 2, 1]), 1.0)]
+        ids, scores, _ = fuse(sources, 0, limit=1, item_weights=ScoredItems([1, 3], [0.1, 1.0]))
+        self.assertEqual(ids.tolist(), [2])
+        self.assertEqual(scores.tolist(), [0.5])
+
+    def test_threshold_applies_before_the_item_weights(self):
+        sources = [(ScoredItems([1, 2, 3], [3, 2, 1]), 1.0)]
+        ids, scores, _ = fuse(sources, 0.5, item_weights=ScoredItems([1], [0.1]))
+        self.assertEqual(ids.tolist(), [2, 1])
+        np.testing.assert_allclose(scores, [0.5, 0.1])
+
+    def test_first_source_reason_wins(self):
+        sources = [
+            (ScoredItems([1, 2], [1, 0], {1: "content"}), 0.6),
+            (ScoredItems([1, 3], [1, 0], {1: "collaborative", 3: "collaborative"}), 0.4),
+        ]
+        _, _, reasons = fuse(sources, 0)
+        self.assertEqual(reasons, {1: "content", 3: "collaborative"})
+
+    def test_empty_sources(self):
+        ids, scores, reasons = fuse([(ScoredItems(), 0.6), (ScoredItems(), 0.4)], 0.2, limit=10)
+        self.assertEqual((len(ids), len(scores), reasons), (0, 0, {}))
+
+
+class ScoredItemsTestCase(SimpleTestCase):
+    def test_scores_of(self):
+        items = ScoredItems([7, 3, 5], [0.7, 0.3, 0.5])
+        self.assertEqual(items.scores_of([5, 4, 7, 9]).tolist(), [0.5, 1.0, 0.7, 1.0])
+        self.assertEqual(ScoredItems().scores_of([1], default=0).tolist(), [0])
+
+    def test_without(self):
+        items = ScoredItems([7, 3, 5], [0.7, 0.3, 0.5], {3: "reason"})
+        remaining = items.without({3, 4})
+        self.assertEqual((remaining.ids.tolist(), remaining.scores.tolist()), ([7, 5], [0.7, 0.5]))
+        self.assertEqual(remaining.reasons, {3: "reason"})
+
+    def test_min_max_normalize(self):
+        self.assertEqual(min_max_normalize(np.array([2.0, 4.0, 3.0])).tolist(), [0, 1, 0.5])
+        self.assertEqual(min_max_normalize(np.array([2.0, 2.0])).tolist(), [1, 1])
+
+
+@override_settings(RECOMMENDER_RECENCY_WEIGHT=0.5, RECOMMENDER_RECENCY_HALF_LIFE_DAYS=1)
+class RecencyWeightsTestCase(SimpleTestCase):
+    def test_weights_halve_towards_the_floor(self):
+        np.testing.assert_allclose(recency_weights([0, 86400, 2 * 86400, 10 ** 9, -60]), [1, 0.75, 0.625, 0.5, 1])
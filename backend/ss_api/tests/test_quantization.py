@@ -0,0 +1,144 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..embedding_matrix import EmbeddingMatrix, normalize_rows
+from ..quantization import EmbeddingBlockCache, quantize_rows, dequantize_rows, score_rows
+
+
+class QuantizationTestCase(SimpleTestCase):
+    def setUp(self):
+        self.vectors = normalize_rows(np.random.default_rng(0).normal(size=(1000, 64)))
+
+    def test_int8_round_trip(self):
+        codes, scales = quantize_rows(self.vectors, "int8")
+        self.assertEqual(codes.dtype, np.int8)
+        self.assertEqual(scales.shape, (1000,))
+        self.assertEqual(np.abs(codes).max(axis=1).tolist(), [127] * 1000)
+        # Rounding moves each value by at most half a step
+        errors = np.abs(dequantize_rows(codes, scales) - self.vectors)
+        self.assertTrue(np.all(errors <= scales[:, None] / 2 + 1e-7))
+
+    def test_zero_rows_survive_quantization(self):
+        codes, scales = quantize_rows(np.zeros((2, 4)), "int8")
+        self.assertEqual(dequantize_rows(codes, scales).tolist(), [[0] * 4] * 2)
+
+    def test_float_dtypes_have_no_scales(self):
+        codes, scales = quantize_rows(self.vectors, "float16")
+        self.assertEqual(codes.dtype, np.float16)
+        self.assertIsNone(scales)
+        np.testing.assert_allclose(dequantize_rows(codes), self.vectors, atol=1e-3)
+
+    def test_chunked_scores_match_the_dense_product(self):
+        query = self.vectors[0]
+        codes, scales = quantize_rows(self.vectors, "int8")
+        expected = dequantize_rows(codes, scales) @ query
+        np.testing.assert_allclose(score_rows(codes, scales, query, chunk_size=64), expected, atol=1e-6)
+        rows = np.array([5, 999, 0, 17])
+        np.testing.assert_allclose(score_rows(codes, scales, query, rows, chunk_size=3), expected[rows], atol=1e-6)
+
+    def test_compact_matrices_keep_the_top_k(self):
+        queries = self.vectors[:20] + np.random.default_rng(1).normal(size=(20, 64))
+        exact = EmbeddingMatrix()
+        exact.upsert(list(range(1000)), self.vectors)
+        for dtype in ("float16", "int8"):
+            matrix = EmbeddingMatrix(dtype=dtype, chunk_size=100)
+            matrix.upsert(list(range(1000)), self.vectors)
+            recall = np.mean([
+                len(set(matrix.top_k(query, 100)[0].tolist()) & set(exact.top_k(query, 100)[0].tolist())) / 100
+                for query in queries
+            ])
+            self.assertGreaterEqual(recall, 0.95, dtype)
+            np.testing.assert_allclose(matrix.vectors, self.vectors, atol=0.01)
+
+
+class EmbeddingBlockCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.vectors = normalize_rows(np.random.default_rng(0).normal(size=(10, 8)))
+
+    def test_int8_entries_round_trip(self):
+        cache = EmbeddingBlockCache(dtype="int8", block_size=4)
+        for key, vector in enumerate(self.vectors):
+            cache[key] = vector
+        self.assertEqual(len(cache._blocks), 3)
+        for key, vector in enumerate(self.vectors):
+            value = cache[key]
+            self.assertEqual(value.dtype, np.float32)
+            np.testing.assert_allclose(value, vector, atol=np.abs(vector).max() / 254 + 1e-7)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = EmbeddingBlockCache(max_entries=3)
+        for key in range(3):
+            cache[key] = self.vectors[key]
+        cache.get(0)
+        cache[3] = self.vectors[3]
+
+        self.assertNotIn(1, cache)
+        self.assertEqual(sorted(cache._slots), [0, 2, 3])
+        cache[2] = self.vectors[4]
+        cache[4] = self.vectors[5]
+        self.assertEqual(sorted(cache._slots), [2, 3, 4])
+        np.testing.assert_allclose(cache[2], self.vectors[4], rtol=1e-6)
+        # Evicted rows are reused, so the cache never outgrows max_entries
+        self.assertEqual(len(cache._blocks), 1)
+        self.assertEqual(cache.stats()["evictions"], 2)
+
+    def test_versions_and_stats(self):
+        cache = EmbeddingBlockCache(max_entries=5)
+        cache.set("a", self.vectors[0], version="v1")
+        self.assertIsNotNone(cache.get("a", version="v1"))
+        self.assertIsNone(cache.get("a", version="v2"))
+        self.assertIsNone(cache.get("b"))
+
+        stats = cache.stats()
+        self.assertEqual((stats["size"], stats["max_entries"], stats["hits"], stats["misses"]), (1, 5, 1, 2))
+        self.assertEqual(stats["nbytes"], 5 * 8 * 4)
+
+    def test_pop_frees_the_row(self):
+        cache = EmbeddingBlockCache(block_size=2)
+        cache["a"] = self.vectors[0]
+        cache["b"] = self.vectors[1]
+        np.testing.assert_allclose(cache.pop("a"), self.vectors[0], rtol=1e-6)
+        cache["c"] = self.vectors[2]
+        self.assertEqual(len(cache._blocks), 1)
+        self.assertIsNone(cache.pop("a"))
+        with self.assertRaises(ValueError):
+            cache["d"] = np.ones(3)
+
+
+class EmbeddingMatrixStorageTestCase(SimpleTestCase):
+    def setUp(self):
+        self.vectors = normalize_rows(np.random.default_rng(0).normal(size=(100, 8)))
+
+    def test_removing_most_rows_gives_the_memory_back(self):
+        matrix = EmbeddingMatrix(initial_capacity=8, dtype="int8")
+        matrix.upsert(list(range(100)), self.vectors)
+        self.assertEqual(matrix.stats()["capacity"], 100)
+
+        matrix.remove(list(range(90)))
+        stats = matrix.stats()
+        self.assertEqual((stats["rows"], stats["delta_rows"]), (10, 10))
+        self.assertEqual(stats["capacity"], 20)
+        self.assertEqual(stats["nbytes"], 20 * (8 + 4 + 8 + 16))
+        self.assertEqual(sorted(matrix.ids.tolist()), list(range(90, 100)))
+        ids, vectors = matrix.rows()
+        np.testing.assert_allclose(vectors, self.vectors[ids], atol=0.01)
+
+    def test_rows_keep_their_text_hash(self):
+        matrix = EmbeddingMatrix()
+        matrix.upsert([1, 2], self.vectors[:2], ["a" * 64, "b" * 64])
+        matrix.remove([1])
+        self.assertTrue(matrix.hash_matches(2, "b" * 64))
+        self.assertFalse(matrix.hash_matches(2, "a" * 64))
+        self.assertFalse(matrix.hash_matches(1, "a" * 64))
+
+    def test_invalidated_rows_are_pending(self):
+        matrix = EmbeddingMatrix()
+        matrix.upsert([1, 2], self.vectors[:2])
+        matrix.invalidate([2])
+        self.assertEqual(matrix.stats()["pending"], 1)
+        matrix.upsert([2], self.vectors[2:3])
+        self.assertEqual(matrix.stats()["pending"], 0)
+        matrix.clear()
+        self.assertEqual(matrix.stats(), {
+            "rows": 0, "snapshot_rows": 0, "delta_rows": 0, "capacity": 0, "pending": 0, "nbytes": 0
+        })
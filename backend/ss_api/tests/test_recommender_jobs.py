@@ -0,0 +1,59 @@
+from django.test import TestCase, override_settings
+
+from .. import recommender_jobs
+from ..models import RecommenderJob
+
+
+@override_settings(RECOMMENDER_JOB_MAX_ATTEMPTS=3)
+class RecommenderJobsTestCase(TestCase):
+    def queued(self):
+        return {
+            object_id: (attempts, claimed_at is not None)
+            for object_id, attempts, claimed_at in RecommenderJob.objects.values_list(
+                'object_id', 'attempts', 'claimed_at'
+            )
+        }
+
+    def test_a_failing_object_does_not_charge_the_others(self):
+        recommender_jobs.enqueue("posts", [1, 2, 3, 4])
+        batches = []
+
+        def handler(object_ids):
+            batches.append(object_ids)
+            if 3 in object_ids:
+                raise ValueError("bad row")
+
+        self.assertEqual(recommender_jobs.process_batch({"posts": handler}, 10), 4)
+        self.assertEqual(batches, [[1, 2, 3, 4], [1], [2], [3], [4]])
+        self.assertEqual(self.queued(), {3: (1, False)})
+
+    def test_requeue_forgets_failed_attempts(self):
+        recommender_jobs.enqueue("posts", [1])
+        for _ in range(3):
+            recommender_jobs.fail(recommender_jobs.claim(10))
+        self.assertEqual(recommender_jobs.claim(10), [])
+
+        recommender_jobs.enqueue("posts", [1], requeue=False)
+        self.assertEqual(recommender_jobs.claim(10), [])
+        recommender_jobs.enqueue("posts", [1])
+        self.assertEqual(self.queued(), {1: (0, False)})
+        self.assertEqual(len(recommender_jobs.claim(10)), 1)
+
+    def test_jobs_enqueued_again_while_claimed_stay_queued(self):
+        recommender_jobs.enqueue("posts", [1, 2])
+        jobs = recommender_jobs.claim(10)
+        self.assertEqual(self.queued(), {1: (0, True), 2: (0, True)})
+
+        recommender_jobs.enqueue("posts", [2])
+        recommender_jobs.complete(jobs)
+        self.assertEqual(self.queued(), {2: (0, False)})
+
+        jobs = recommender_jobs.claim(10)
+        recommender_jobs.enqueue("posts", [2])
+        recommender_jobs.fail(jobs)
+        self.assertEqual(self.queued(), {2: (0, False)})
+
+    def test_jobs_without_a_handler_are_released(self):
+        recommender_jobs.enqueue("unknown", [1])
+        self.assertEqual(recommender_jobs.process_batch({}, 10), 1)
+        self.assertEqual(self.queued(), {1: (1, False)})
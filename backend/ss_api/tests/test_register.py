@@ -1,6 +1,6 @@
 from django.test import TestCase, Client
 from django.urls import reverse
-from .models import Student
+from ..models import Student
 
 class RegisterTestCase(TestCase):
     def setUp(self):
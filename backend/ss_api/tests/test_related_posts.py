@@ -0,0 +1,71 @@
+import io
+import random
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from .. import recommender, recommender_jobs
+from ..management.commands.benchmark_recommender import HashingEncoder
+from ..models import User, Community, Post, PostNeighbor
+
+
+@override_settings(INVALIDATION_BUS_ENABLED=False, RECOMMENDER_RELATED_POSTS=5)
+class RelatedPostsTestCase(TestCase):
+    def setUp(self):
+        model_name = recommender.EMBEDDING_MODEL_NAME
+        recommender.set_model(HashingEncoder(), model_name="hashing")
+        recommender.clear_state()
+        self.addCleanup(recommender.clear_state)
+        self.addCleanup(recommender.set_model, None, model_name)
+
+        self.random = random.Random(0)
+        self.words = [f"word{number}" for number in range(40)]
+        user = User.objects.create(username="author", email="author@example.com")
+        community = Community.objects.create(name="Community", description="d", rules="r", keyword=[])
+        self.posts = Post.objects.bulk_create([
+            Post(title=self.text(3), content=self.text(5), posted_in=community, created_by=user, status="approved")
+            for _ in range(80)
+        ])
+        self.rebuild()
+
+    def text(self, words):
+        return " ".join(self.random.sample(self.words, words))
+
+    def rebuild(self):
+        call_command('build_related_posts', stdout=io.StringIO())
+        return self.neighbor_rows()
+
+    def run_jobs(self):
+        # What the run_recommender_jobs worker does, without its connection handling
+        while recommender_jobs.process_batch(recommender.JOB_HANDLERS, 100):
+            pass
+
+    def neighbor_rows(self):
+        return {
+            (post_id, neighbor_id): score
+            for post_id, neighbor_id, score in PostNeighbor.objects.values_list('post_id', 'neighbor_id', 'score')
+        }
+
+    def assertSameRows(self, rows, expected):
+        self.assertEqual(rows.keys(), expected.keys())
+        for key, score in expected.items():
+            self.assertAlmostEqual(rows[key], score, places=5)
+
+    def test_edits_keep_the_lists_of_a_full_rebuild(self):
+        for post in self.random.sample(self.posts, 5):
+            post.title, post.content = self.text(3), self.text(5)
+            post.save()
+            self.run_jobs()
+            self.assertSameRows(self.neighbor_rows(), self.rebuild())
+
+    def test_hidden_posts_leave_every_list(self):
+        post = self.posts[0]
+        listed_by = set(PostNeighbor.objects.filter(neighbor=post).values_list('post_id', flat=True))
+        self.assertTrue(listed_by)
+
+        post.status = "hidden"
+        post.save()
+        self.run_jobs()
+        self.assertFalse(PostNeighbor.objects.filter(neighbor=post).exists())
+        self.assertFalse(PostNeighbor.objects.filter(post=post).exists())
+        self.assertSameRows(self.neighbor_rows(), self.rebuild())
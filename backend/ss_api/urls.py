@@ -23,7 +23,8 @@ from .views import (RegisterView, LoginView, LogoutView, ChangePasswordView, Com
                     UpdateSettingsView, ModeratorSettingsDetailView, getCommunityActivities, createCommunityActivity,
                     communityActivityParticipantView, activityRatingViewset, getCommunityView,
                     getJoinedCommunityActivities, NotInterestedView, PostRecommendationView, ActivityRecommendationView,
-                    CombinedPostView, CombinedActivityView, PollViewSet, PollListView, PollDetailView, PollVoteView)
+                    CombinedPostView, CombinedActivityView, PollViewSet, PollListView, PollDetailView, PollVoteView,
+                    SemanticSearchView, RelatedPostsView, RecommenderStatsView)
 from django.contrib import admin
 
 
@@ -71,6 +72,7 @@ urlpatterns = [
     path('community/<int:community_id>/join/', JoinCommunityView.as_view(), name='join-community'),
     path('community/', CommunityListView.as_view(), name='community-list'),
     path('community/<int:community_id>/post/<int:post_id>', getCommunityPost.as_view(), name='post-view'),
+    path('community/<int:community_id>/post/<int:post_id>/related/', RelatedPostsView.as_view(), name='related-posts'),
     path('community/<int:community_id>/post/<int:post_id>/likes', getPostLikesView.as_view(), name='post-likes'),
     path('community/<int:community_id>/post/<int:post_id>/like', likePostView.as_view(), name='like-post'),
     path('community/<int:community_id>/post/<int:post_id>/unlike', unlikePostView.as_view(), name='unlike-post'),
@@ -146,6 +148,7 @@ urlpatterns = [
     path('admin/interactions/', InteractionTrendView.as_view(), name='admin-interactions'),
     path('admin/settings/', SettingsView.as_view(), name='admin-settings'),
     path('admin/update/settings/', UpdateSettingsView.as_view(), name='update-admin-settings'),
+    path('admin/recommender/stats/', RecommenderStatsView.as_view(), name='recommender-stats'),
     path('moderator/settings/<int:community_id>/', ModeratorSettingsDetailView.as_view(), name='moderator-settings'),
 
 
@@ -154,6 +157,7 @@ urlpatterns = [
 
     path('recommendations/combined-posts/', CombinedPostView.as_view(), name='combined-posts'),
     path('recommendations/combined-activities/', CombinedActivityView.as_view(), name='combined-activities'),
+    path('search/semantic/', SemanticSearchView.as_view(), name='semantic-search'),
 
 
 
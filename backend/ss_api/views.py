@@ -79,7 +79,11 @@ from .serializers import (UserSerializer, RegisterSerializer, CustomTokenObtainP
 from .permissions import IsCommunityMember, CookieJWTAuthentication, IsCommunityAdminORModerator, IsCommunityAdmin, \
     IsSuperUser, RefreshCookieJWTAuthentication, IsSuperUserOrStaff, isCommunityViewer
 
-from .recommender import get_hybrid_recommendations, hybrid_post_recommendation, hybrid_activity_recommendation
+from .recommender import get_cached_recommendations, load_in_order, semantic_search, related_posts, \
+    embedding_cache_stats
+from .activity_counters import record_visit, record_search, community_search, COMMUNITY_SEARCH_PAGE_SIZE, \
+    COMMUNITY_SEARCH
+from . import invalidation_bus
 
 from django.conf import settings
 
@@ -746,6 +750,7 @@ class getCommunityView(generics.RetrieveAPIView):
         community = Community.objects.get(id=community_id)
         serializer = CommunitySerializer(community)
 
+        record_visit(self.request.user.id, community.id)
         UserActivity.objects.create(user=self.request.user, activity_type='visit', activity_data=community.name)
 
         return Response(serializer.data)
@@ -1046,6 +1051,34 @@ class getCommunityPost(generics.RetrieveAPIView):
         post_id = self.kwargs.get('post_id')
         return get_object_or_404(Post, id=post_id, posted_in=community_id)
 
+
+class RelatedPostsView(APIView):
+    """
+    The posts most similar to a post, read from the precomputed related-posts table.
+    """
+    authentication_classes = [CookieJWTAuthentication]
+    permission_classes = [IsAuthenticated, isCommunityViewer]
+
+    def get(self, request, community_id, post_id):
+        post = get_object_or_404(Post, id=post_id, posted_in=community_id)
+        related = related_posts(post.id, request.user.id)
+        serialized_posts = PostSerializer([related_post for related_post, _ in related], many=True)
+        return Response({'posts': [
+            {**data, "score": score} for data, (_, score) in zip(serialized_posts.data, related)
+        ]})
+
+
+class RecommenderStatsView(APIView):
+    """
+    Memory held by the recommender's embeddings in the worker process serving the request: LRU cache sizes
+    and hit rates, and the rows and bytes of the scoring matrices.
+    """
+    authentication_classes = [CookieJWTAuthentication]
+    permission_classes = [IsAuthenticated, IsSuperUserOrStaff]
+
+    def get(self, request):
+        return Response({"pid": os.getpid(), **embedding_cache_stats()}, status=status.HTTP_200_OK)
+
 class likePostView(APIView):
     authentication_classes = [CookieJWTAuthentication]
     permission_classes = [IsAuthenticated, isCommunityViewer]
@@ -1411,18 +1444,21 @@ class CommunityListView(APIView):
         search_query = request.query_params.get('search', None)  # Get the search query parameter
 
         if search_query:
-            communities = Community.objects.filter(
-                Q(name__icontains=search_query)
-            )
-            UserActivity.objects.create(user=self.request.user, activity_type='search', activity_data=search_query)
+            communities = community_search(search_query)
         else:
             communities = Community.objects.all()  # If no search query, get all communities
 
         # Set up pagination
         paginator = PageNumberPagination()
-        paginator.page_size = 10  # Set the number of communities per page
+        paginator.page_size = COMMUNITY_SEARCH_PAGE_SIZE  # Set the number of communities per page
         paginated_communities = paginator.paginate_queryset(communities, request)
 
+        if search_query:
+            # Count the search for the communities on its first page, then log it
+            record_search(self.request.user.id, search_query, COMMUNITY_SEARCH)
+            UserActivity.objects.create(user=self.request.user, activity_type=COMMUNITY_SEARCH,
+                                        activity_data=search_query)
+
         if paginated_communities is None:
             return Response({"error": "Invalid page number"}, status=status.HTTP_404_NOT_FOUND)
 
@@ -1502,7 +1538,9 @@ class UserListView(generics.ListAPIView):
                 Q(email__icontains=search)
             )
 
-            UserActivity.objects.create(user=self.request.user, activity_type='search', activity_data=search)
+            # People searches only go to the search history, they are not counted for communities
+            record_search(self.request.user.id, search, 'user_search')
+            UserActivity.objects.create(user=self.request.user, activity_type='user_search', activity_data=search)
         return queryset
 
 class getCommunityStats(APIView):
@@ -1933,6 +1971,17 @@ class RespondToFriendRequestView(generics.UpdateAPIView):
         return Response({"detail": "Invalid action."}, status=status.HTTP_400_BAD_REQUEST)
 
 
+def recommendation_limit(request):
+    """
+    The ?limit= of a recommendation endpoint, between 1 and RECOMMENDATION_LIMIT (the default).
+    """
+    try:
+        limit = int(request.query_params.get('limit', settings.RECOMMENDATION_LIMIT))
+    except ValueError:
+        limit = settings.RECOMMENDATION_LIMIT
+    return max(1, min(limit, settings.RECOMMENDATION_LIMIT))
+
+
 class UserRecommendationsView(APIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [CookieJWTAuthentication]
@@ -1942,8 +1991,9 @@ class UserRecommendationsView(APIView):
             # Get the current authenticated user
             user = request.user  # The authenticated user from the request
 
-            # Fetch hybrid recommendations based on the current user
-            recommendations = get_hybrid_recommendations(user.id)
+            # Fetch the (cached) hybrid recommendations of the current user
+            recommendations = get_cached_recommendations(user.id, "communities", recommendation_limit(request))
+            communities = Community.objects.in_bulk([community_id for community_id, _, _ in recommendations])
 
             # Serialize the recommended communities data
             serialized_communities = [
@@ -1954,7 +2004,8 @@ class UserRecommendationsView(APIView):
                         'reason': reason
                     }
                 ).data
-                for community, score, reason in recommendations
+                for community_id, score, reason in recommendations
+                if (community := communities.get(community_id)) is not None
             ]
 
             # Return the recommendations as a JSON response
@@ -2705,8 +2756,9 @@ class UpdateSettingsView(APIView):
             system_setting.value = str(value)
             system_setting.save()
 
-            # Invalidate the cache for this setting
+            # Invalidate the cache for this setting, in this worker and every other one
             cache.delete(key)
+            invalidation_bus.notify("cache", [key])
 
             return Response(
                 {"message": f"Setting '{key}' updated successfully."}, status=status.HTTP_200_OK
@@ -2889,9 +2941,10 @@ class PostRecommendationView(APIView):
     pagination_class = PostPagination
     def get(self, request, *args, **kwargs):
         user_id = request.user.id
-        post_recommendations = hybrid_post_recommendation(user_id)
-        serialized_posts = PostSerializer([post for post, _ in post_recommendations], many=True)
-        return JsonResponse({'posts': serialized_posts}, safe=False)
+        post_recommendations = get_cached_recommendations(user_id, "posts", recommendation_limit(request))
+        posts = load_in_order(Post, [post_id for post_id, _ in post_recommendations])
+        serialized_posts = PostSerializer(posts, many=True)
+        return JsonResponse({'posts': serialized_posts.data}, safe=False)
 
 
 class ActivityRecommendationView(APIView):
@@ -2902,13 +2955,58 @@ class ActivityRecommendationView(APIView):
         user_id = request.user.id
 
         # Get hybrid recommendations for activities
-        activity_recommendations = hybrid_activity_recommendation(user_id)
+        activity_recommendations = get_cached_recommendations(user_id, "activities", recommendation_limit(request))
+        activities = load_in_order(CommunityActivity, [activity_id for activity_id, _ in activity_recommendations])
 
         # Serialize the recommendations
-        serialized_activities = CommunityActivitySerializer([activity for activity, _ in activity_recommendations], many=True)
+        serialized_activities = CommunityActivitySerializer(activities, many=True)
 
         # Return the serialized data as a JSON response
-        return JsonResponse({'activities': serialized_activities}, safe=False)
+        return JsonResponse({'activities': serialized_activities.data}, safe=False)
+
+class SemanticSearchView(APIView):
+    """
+    Search posts, communities and activities by meaning rather than by keyword:
+    ?q=<query>&type=posts|communities|activities (repeatable, all by default)&limit=<per type>.
+    """
+    authentication_classes = [CookieJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    serializers = {
+        "posts": (Post, PostSerializer),
+        "communities": (Community, CommunitySerializer),
+        "activities": (CommunityActivity, CommunityActivitySerializer),
+    }
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"error": "A search query is required"}, status=status.HTTP_400_BAD_REQUEST)
+        entity_types = request.query_params.getlist('type') or list(self.serializers)
+        if any(entity_type not in self.serializers for entity_type in entity_types):
+            return Response({"error": f"type must be one of {', '.join(self.serializers)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', settings.SEMANTIC_SEARCH_LIMIT)),
+                               settings.SEMANTIC_SEARCH_LIMIT))
+        except ValueError:
+            limit = settings.SEMANTIC_SEARCH_LIMIT
+
+        results = {}
+        for entity_type in entity_types:
+            model_class, serializer_class = self.serializers[entity_type]
+            matches = semantic_search(query, entity_type, request.user.id, limit)
+            objects = load_in_order(model_class, [object_id for object_id, _ in matches])
+            scores = dict(matches)
+            results[entity_type] = [
+                {**data, "score": scores[obj.id]}
+                for obj, data in zip(objects, serializer_class(objects, many=True, context={'request': request}).data)
+            ]
+
+        # Add the search to the search history, then log it; only community searches are counted for communities
+        record_search(request.user.id, query, 'semantic_search')
+        UserActivity.objects.create(user=request.user, activity_type='semantic_search', activity_data=query)
+        return Response(results)
+
 
 class CombinedPostView(APIView):
     authentication_classes = [CookieJWTAuthentication]
@@ -2919,26 +3017,26 @@ class CombinedPostView(APIView):
     def get(self, request, *args, **kwargs):
         user_id = request.user.id
 
-        # Get hybrid recommendations for posts
-        post_recommendations = hybrid_post_recommendation(user_id)
-        recommended_posts = [post for post, _ in post_recommendations]
+        # Get the cached hybrid recommendations for posts
+        post_recommendations = get_cached_recommendations(user_id, "posts")
+        recommended_post_ids = [post_id for post_id, _ in post_recommendations]
 
-        # Get joined community posts
+        # Get joined community post ids
         joined_communities = Membership.objects.filter(user_id=user_id).values_list('community_id', flat=True)
-        joined_posts = Post.objects.filter(posted_in_id__in=joined_communities, status='approved').order_by('-isPinned', '-created_at')
+        joined_post_ids = Post.objects.filter(posted_in_id__in=joined_communities, status='approved').order_by('-isPinned', '-created_at').values_list('id', flat=True)
 
-        # Combine the results
-        combined_posts = list(recommended_posts) + list(joined_posts)
+        # Combine the ids, only the requested page is loaded from the database
+        combined_post_ids = recommended_post_ids + list(joined_post_ids)
 
         # Apply pagination
         paginator = self.pagination_class()
-        paginated_posts = paginator.paginate_queryset(combined_posts, request)
+        paginated_post_ids = paginator.paginate_queryset(combined_post_ids, request)
         
-        if paginated_posts is None:
+        if paginated_post_ids is None:
             # Return an empty paginated response if there are no more items
             return paginator.get_paginated_response([])
 
-        serialized_posts = self.serializer_class(paginated_posts, many=True)
+        serialized_posts = self.serializer_class(load_in_order(Post, paginated_post_ids), many=True)
 
         return paginator.get_paginated_response(serialized_posts.data)
 
@@ -2954,21 +3052,21 @@ class CombinedActivityView(APIView):
     def get(self, request, *args, **kwargs):
         user_id = request.user.id
 
-        # Get hybrid recommendations for activities
-        activity_recommendations = hybrid_activity_recommendation(user_id)
-        recommended_activities = [activity for activity, _ in activity_recommendations]
+        # Get the cached hybrid recommendations for activities
+        activity_recommendations = get_cached_recommendations(user_id, "activities")
+        recommended_activity_ids = [activity_id for activity_id, _ in activity_recommendations]
 
-        # Get joined community activities
+        # Get joined community activity ids
         joined_communities = Membership.objects.filter(user_id=user_id).values_list('community_id', flat=True)
-        joined_activities = CommunityActivity.objects.filter(community__in=joined_communities).order_by('-created_at')
+        joined_activity_ids = CommunityActivity.objects.filter(community__in=joined_communities).order_by('-created_at').values_list('id', flat=True)
 
-        # Combine the results
-        combined_activities = list(recommended_activities) + list(joined_activities)
+        # Combine the ids, only the requested page is loaded from the database
+        combined_activity_ids = recommended_activity_ids + list(joined_activity_ids)
 
         # Apply pagination
         paginator = self.pagination_class()
-        paginated_activities = paginator.paginate_queryset(combined_activities, request)
-        serialized_activities = self.serializer_class(paginated_activities, many=True)
+        paginated_activity_ids = paginator.paginate_queryset(combined_activity_ids, request)
+        serialized_activities = self.serializer_class(load_in_order(CommunityActivity, paginated_activity_ids or []), many=True)
 
         return paginator.get_paginated_response(serialized_activities.data)
 